@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Throughput benchmarks of the driver hot paths against the simulated instruments.
+
+    python benchmarks/bench_drivers.py --output after.json --compare before.json
+
+Every benchmark reports ops/sec, p50/p99 latency, bytes/sec on the wire
+(from the SCPI instrumentation) and the peak Python memory of one call.
+Comparing against a saved run exits non-zero when a benchmark got slower
+than the threshold.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from electronics_lab.drivers import instrumentation  # noqa: E402
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z  # noqa: E402
+from electronics_lab.drivers.session import pool  # noqa: E402
+from electronics_lab.drivers.siglentsdg1032x import SiglentSDG1032X  # noqa: E402
+from electronics_lab.drivers.siglentsdm3055 import SiglentSDM3055  # noqa: E402
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X  # noqa: E402
+
+import bench_import  # noqa: E402
+
+memory_depths = (12000, 120000, 1200000)
+
+
+def run_benchmark(function, min_time=1.0, min_runs=5, max_runs=10000):
+    """Calls function until min_time has passed, returns the summary of the calls"""
+    recorder = instrumentation.enable()
+    recorder.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+        recorder.reset()
+        timings = []
+        started = time.perf_counter()
+        while len(timings) < max_runs and (len(timings) < min_runs or time.perf_counter() - started < min_time):
+            call_started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        wire_bytes = sum(summary['bytes_in'] + summary['bytes_out'] for commands in recorder.snapshot().values()
+                         for operations in commands.values() for summary in operations.values())
+        instrumentation.disable()
+        tracemalloc.start()
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    timings = np.array(timings)
+    return {'runs': len(timings), 'ops_per_second': len(timings) / elapsed,
+            'p50_seconds': float(np.percentile(timings, 50)), 'p99_seconds': float(np.percentile(timings, 99)),
+            'bytes_per_second': wire_bytes / elapsed, 'peak_memory_bytes': peak_memory}
+
+
+def driver_benchmarks(directory, latency=0.0):
+    """Returns (name, function) for every driver benchmark"""
+    link = '?latency={:g}'.format(latency)
+    scope = RigolDS1054z('SIM::DS1054Z' + link)
+    meter = SiglentSDM3055('SIM::SDM3055' + link)
+    supply = SiglentSPD3303X('SIM::SPD3303X' + link)
+    generator = SiglentSDG1032X('SIM::SDG1032X' + link)
+    arb = np.sin(np.linspace(0, 2 * np.pi, 16384, endpoint=False))
+    benchmarks = [
+        ('rigol.get_measurement', lambda: scope.get_measurement(1, RigolDS1054z.frequency)),
+        ('rigol.get_measurements', lambda: scope.get_measurements(channels=(1, 2))),
+        ('sdm.get_measurement', lambda: meter.get_measurement(SiglentSDM3055.dc_voltage)),
+        ('spd.get_measurement', lambda: supply.get_measurement(1, SiglentSPD3303X.voltage)),
+        # invalidating first sends the write, otherwise every call after the first is a cache hit
+        ('spd.set_param', lambda: (supply.invalidate(), supply.set_param(1, SiglentSPD3303X.voltage, 3.3))),
+        ('sdg.get_measurement', lambda: generator.get_measurement(1, SiglentSDG1032X.frequency)),
+        # invalidating first forces the transfer, otherwise the cached waveform is only selected
+        ('sdg.upload_arb[16384]', lambda: (generator.invalidate(), generator.upload_arb(1, arb))),
+        ('rigol.write_screen_capture', lambda: scope.write_screen_capture(os.path.join(directory, 'screen.png'))),
+    ]
+    for depth in memory_depths:
+        deep_scope = RigolDS1054z('SIM::DS1054Z{}&memory_depth={}'.format(link, depth))
+        benchmarks.append(('rigol.write_waveform_data[{}]'.format(depth),
+                           lambda deep_scope=deep_scope: deep_scope.write_waveform_data(
+                               1, os.path.join(directory, 'waveform.csv'))))
+        # the full memory transfer, write_waveform_data only reads the 1200 screen points at any depth
+        benchmarks.append(('rigol.stream_waveform_to_file[{}]'.format(depth),
+                           lambda deep_scope=deep_scope: deep_scope.stream_waveform_to_file(
+                               1, os.path.join(directory, 'waveform.npy'))))
+    return benchmarks
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run_all(names=None, min_time=1.0, latency=0.0, import_runs=10):
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for name, function in driver_benchmarks(directory, latency):
+            if names and not any(selected in name for selected in names):
+                continue
+            results[name] = run_benchmark(function, min_time)
+            print_result(name, results[name])
+    finally:
+        pool.close_all()
+        shutil.rmtree(directory)
+    if import_runs and (not names or any(selected in 'import' for selected in names)):
+        baseline = np.median(bench_import.time_import('pass', import_runs))
+        timings = np.array(bench_import.time_import('import electronics_lab', import_runs)) - baseline
+        results['import'] = {'runs': import_runs, 'ops_per_second': 1.0 / np.median(timings),
+                             'p50_seconds': float(np.percentile(timings, 50)),
+                             'p99_seconds': float(np.percentile(timings, 99)),
+                             'bytes_per_second': 0.0, 'peak_memory_bytes': 0}
+        print_result('import', results['import'])
+    return {'commit': git_commit(), 'timestamp': time.time(), 'python': platform.python_version(),
+            'latency': latency, 'benchmarks': results}
+
+
+def print_result(name, result):
+    print("{:45} {:10.1f} ops/s  p50 {:9.3f} ms  p99 {:9.3f} ms  {:9.2f} MB/s  peak {:8.1f} kB".format(
+        name, result['ops_per_second'], result['p50_seconds'] * 1e3, result['p99_seconds'] * 1e3,
+        result['bytes_per_second'] / 1e6, result['peak_memory_bytes'] / 1e3))
+
+
+def compare(baseline, current, threshold=0.1):
+    """Prints the ops/sec change per benchmark, returns the names that slowed down by more than threshold"""
+    regressions = []
+    print("\nchange against {}".format(baseline.get('commit') or 'baseline'))
+    for name, result in sorted(current['benchmarks'].items()):
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            continue
+        ratio = result['ops_per_second'] / before['ops_per_second']
+        flag = ''
+        if ratio < 1.0 - threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("{:45} {:8.2f}x ops/s  p99 {:9.3f} -> {:9.3f} ms{}".format(
+            name, ratio, before['p99_seconds'] * 1e3, result['p99_seconds'] * 1e3, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown counted as a regression')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds spent in each benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per transaction')
+    parser.add_argument('--import-runs', type=int, default=10, help='interpreter starts for the import benchmark')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.names, args.min_time, args.latency, args.import_runs)
+    if args.output:
+        with open(args.output, 'w') as fid:
+            json.dump(results, fid, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fid:
+            return 1 if compare(json.load(fid), results, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
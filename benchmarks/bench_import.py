@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Startup benchmark: time to import electronics_lab in a fresh interpreter."""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# modules that must stay out of a bare `import electronics_lab`
+heavy_modules = ('visa', 'pyvisa', 'vxi11', 'numpy', 'asyncio')
+
+# `python -c` imports from its working directory, so the interpreters start in the checkout
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(statement, runs=20):
+    """Returns the wall clock seconds of `python -c statement` for each run"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement], cwd=repository)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def loaded_heavy_modules():
+    check = 'import sys, electronics_lab; print(",".join(m for m in {!r} if m in sys.modules))'.format(heavy_modules)
+    output = subprocess.check_output([sys.executable, '-c', check], cwd=repository).decode().strip()
+    return [module for module in output.split(',') if module]
+
+
+def main(runs=20):
+    baseline = statistics.median(time_import('pass', runs))
+    package = statistics.median(time_import('import electronics_lab', runs))
+    print("interpreter startup     {:8.1f} ms".format(baseline * 1e3))
+    print("import electronics_lab  {:8.1f} ms (+{:.1f} ms)".format(package * 1e3, (package - baseline) * 1e3))
+    print("heavy modules loaded    {}".format(', '.join(loaded_heavy_modules()) or 'none'))
+    return package - baseline
+
+
+if __name__ == '__main__':
+    main()
@@ -6,4 +6,18 @@ __author__ = """Derick Hess"""
 __email__ = 'derick.hess@gmail.com'
 __version__ = '0.1.0'
 
-from .drivers import *
+from . import drivers
+
+__all__ = list(drivers.__all__)
+
+
+# drivers are resolved on first access, so importing the package does not load any transport
+def __getattr__(name):
+    try:
+        return getattr(drivers, name)
+    except AttributeError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(dir(drivers)))
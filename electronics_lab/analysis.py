@@ -0,0 +1,391 @@
+"""Scope measurements computed on the host from transferred waveforms
+
+One waveform transfer per channel replaces a :MEAS:ITEM? round trip per
+measurement, e.g.
+
+    time, volts = scope.read_waveform(1, mode='NORM')
+    results = measure(volts, time[1] - time[0], xorigin=time[0])
+    print(results['VRMS'], results['RTIM'])
+
+The measurements follow the scope's definitions. Top and base are the most
+common levels in the upper and lower half of the waveform (the extremes
+when the waveform has no flat top), the thresholds are fractions of the
+amplitude between them (90%, 50% and 10% by default). An edge goes from
+beyond one outer threshold to beyond the other, timed by linear
+interpolation between samples. Timing measurements use the first complete
+edge, period or pulse on the waveform, counts use all of them.
+
+volts is one waveform, or a (captures, points) array with one capture per
+row, then every result is an array with one value per capture. A
+measurement without enough edges is NaN, where the scope would answer
+9.9E37. The work is done on whole arrays, only edge positions are kept per
+edge, so deep memory captures are analysed without Python loops over
+samples.
+"""
+
+import numpy as np
+
+# upper, middle and lower threshold as fractions of top_to_base, the scope's defaults
+default_thresholds = (0.9, 0.5, 0.1)
+
+# number of level bins used to find top and base, one per code of the scope's 8 bit samples
+histogram_bins = 256
+
+# points per row histogrammed at once, bounds the temporary memory for deep captures
+histogram_chunk = 1 << 20
+
+single_commands = ('VMAX', 'VMIN', 'VPP', 'VTOP', 'VBAS', 'VAMP', 'VAVG', 'VRMS', 'VUP', 'VMID', 'VLOW', 'OVER',
+                   'PRES', 'VARI', 'PVRMS', 'PER', 'FREQ', 'RTIM', 'FTIM', 'PWID', 'NWID', 'PDUT', 'NDUT', 'TVMAX',
+                   'TVMIN', 'PPUL', 'NPUL', 'PEDG', 'NEDG', 'PSLEW', 'NSLEW', 'MAR', 'MPAR')
+
+double_commands = ('RPH', 'FPH', 'RDEL', 'FDEL')
+
+
+def measure(volts, xincrement, commands=None, xorigin=0.0, thresholds=default_thresholds):
+    """Returns {command: value} for the single source commands, all of them by default"""
+    return WaveformAnalysis(volts, xincrement, xorigin, thresholds).measure(commands)
+
+
+def measure_pair(volts1, volts2, xincrement, commands=None, xorigin=0.0, thresholds=default_thresholds):
+    """Returns {command: value} for the double source commands of source 1 and source 2, all of them by default"""
+    source1 = WaveformAnalysis(volts1, xincrement, xorigin, thresholds)
+    return source1.measure_pair(WaveformAnalysis(volts2, xincrement, xorigin, thresholds), commands)
+
+
+class Edges(object):
+    """Edges of one direction over all rows, in order
+
+    Times are in samples from the start of the flattened array, so they sort
+    across rows, row is the capture each edge belongs to.
+    """
+
+    def __init__(self, start, middle, end, row):
+        self.start = start
+        self.middle = middle
+        self.end = end
+        self.row = row
+
+    def __len__(self):
+        return len(self.row)
+
+
+class WaveformAnalysis(object):
+    """Measurements of one waveform or a batch of waveforms sampled every xincrement seconds
+
+    Intermediate results such as top, base and the edges are computed once
+    and shared by every measurement that needs them.
+    """
+
+    def __init__(self, volts, xincrement, xorigin=0.0, thresholds=default_thresholds):
+        volts = np.asarray(volts)
+        if volts.ndim not in (1, 2):
+            raise ValueError("volts must be one waveform or a (captures, points) array, not {} dimensions".format(
+                volts.ndim))
+        if volts.dtype.kind != 'f':
+            volts = volts.astype(np.float64)
+        self.batch = volts.ndim == 2
+        self.volts = np.ascontiguousarray(volts.reshape(-1, volts.shape[-1]))
+        self.rows, self.points = self.volts.shape
+        self.flat = self.volts.reshape(-1)
+        self.xincrement = float(xincrement)
+        self.xorigin = float(xorigin)
+        self.thresholds = thresholds
+        self.row_starts = np.arange(self.rows) * self.points
+        self._memo = {}
+
+    def measure(self, commands=None):
+        """Returns {command: value} for the single source commands"""
+        return dict((command, self.result(getattr(self, command.lower())()))
+                    for command in (single_commands if commands is None else commands))
+
+    def measure_pair(self, other, commands=None):
+        """Returns {command: value} for the double source commands, self is source 1 and other source 2"""
+        if other.volts.shape != self.volts.shape:
+            raise ValueError("both sources need the same shape, not {} and {}".format(
+                self.volts.shape, other.volts.shape))
+        return dict((command, self.result(getattr(self, command.lower())(other)))
+                    for command in (double_commands if commands is None else commands))
+
+    def result(self, values):
+        """Returns the per row values, or a single Python number for one waveform"""
+        return values if self.batch else values[0].item()
+
+    def _cached(self, name, function):
+        if name not in self._memo:
+            self._memo[name] = function()
+        return self._memo[name]
+
+    # levels
+
+    def vmax(self):
+        return self._cached('vmax', lambda: self.volts.max(axis=1))
+
+    def vmin(self):
+        return self._cached('vmin', lambda: self.volts.min(axis=1))
+
+    def vpp(self):
+        return self.vmax() - self.vmin()
+
+    def vtop(self):
+        return self._levels()[0]
+
+    def vbas(self):
+        return self._levels()[1]
+
+    def vamp(self):
+        return self.vtop() - self.vbas()
+
+    def vavg(self):
+        return self._cached('vavg', lambda: self.volts.mean(axis=1))
+
+    def mean_square(self):
+        # einsum avoids a squared copy of the whole capture
+        return self._cached('mean_square', lambda: np.einsum('ij,ij->i', self.volts, self.volts) / self.points)
+
+    def vrms(self):
+        return np.sqrt(self.mean_square())
+
+    def vari(self):
+        return np.maximum(self.mean_square() - self.vavg() ** 2, 0.0)
+
+    def vup(self):
+        return self.vbas() + self.thresholds[0] * self.vamp()
+
+    def vmid(self):
+        return self.vbas() + self.thresholds[1] * self.vamp()
+
+    def vlow(self):
+        return self.vbas() + self.thresholds[2] * self.vamp()
+
+    def over(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.vmax() - self.vtop()) / self.vamp()
+
+    def pres(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.vbas() - self.vmin()) / self.vamp()
+
+    def _levels(self):
+        return self._cached('levels', self._histogram_levels)
+
+    def _histogram_levels(self):
+        """Returns (top, base), the most populated level bin in the upper and lower half of each row"""
+        vmin, vpp = self.vmin(), self.vpp()
+        scale = np.where(vpp > 0, (histogram_bins - 1) / np.where(vpp > 0, vpp, 1.0), 0.0)
+        counts = np.zeros((self.rows, histogram_bins), dtype=np.int64)
+        offsets = (np.arange(self.rows) * histogram_bins)[:, None]
+        for start in range(0, self.points, histogram_chunk):
+            chunk = self.volts[:, start:start + histogram_chunk]
+            bins = ((chunk - vmin[:, None]) * scale[:, None] + 0.5).astype(np.intp)
+            bins += offsets
+            counts += np.bincount(bins.ravel(), minlength=self.rows * histogram_bins).reshape(counts.shape)
+        half = histogram_bins // 2
+        top_bin = half + np.argmax(counts[:, half:], axis=1)
+        base_bin = np.argmax(counts[:, :half], axis=1)
+        width = np.where(vpp > 0, vpp / (histogram_bins - 1), 0.0)
+        # a waveform without a flat top, e.g. a sine, peaks in the outermost bin: that level is the extreme itself
+        top = np.where(top_bin == histogram_bins - 1, self.vmax(), vmin + top_bin * width)
+        base = np.where(base_bin == 0, vmin, vmin + base_bin * width)
+        return top, base
+
+    # edges
+
+    def _crossings(self, level):
+        """Returns (sample indexes just after upward crossings, just after downward crossings) of the per row level"""
+        above = self.volts > level[:, None]
+        rows, columns = np.nonzero(above[:, 1:] != above[:, :-1])
+        positions = rows * self.points + columns + 1
+        upward = above.reshape(-1)[positions]
+        return positions[upward], positions[~upward]
+
+    def _interpolate(self, positions, level):
+        """Returns the fractional sample times where the level is crossed between positions - 1 and positions"""
+        before, after = self.flat[positions - 1], self.flat[positions]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = (level[positions // self.points] - before) / (after - before)
+        return positions - 1 + np.nan_to_num(fraction)
+
+    def _edges(self):
+        return self._cached('edges', self._find_edges)
+
+    def _find_edges(self):
+        """Returns (rising Edges, falling Edges), each going from beyond one outer threshold to beyond the other"""
+        upper, middle, lower = self.vup(), self.vmid(), self.vlow()
+        enter_high, leave_high = self._crossings(upper)
+        leave_low, enter_low = self._crossings(lower)
+        middle_up, middle_down = self._crossings(middle)
+        # a row that starts beyond a threshold has entered that state at its first sample
+        first = self.volts[:, 0]
+        enter_high = np.concatenate((self.row_starts[first > upper], enter_high))
+        enter_low = np.concatenate((self.row_starts[first < lower], enter_low))
+        positions = np.concatenate((enter_high, enter_low))
+        high = np.concatenate((np.ones(len(enter_high), bool), np.zeros(len(enter_low), bool)))
+        order = np.argsort(positions, kind='stable')
+        positions, high = positions[order], high[order]
+        same_row = positions[1:] // self.points == positions[:-1] // self.points
+        # an edge ends where the waveform enters one outer band after having been in the other one
+        rising_end = positions[1:][same_row & high[1:] & ~high[:-1]]
+        falling_end = positions[1:][same_row & ~high[1:] & high[:-1]]
+        rising = self._edge_times(rising_end, leave_low, middle_up, lower, middle, upper)
+        falling = self._edge_times(falling_end, leave_high, middle_down, upper, middle, lower)
+        return rising, falling
+
+    def _edge_times(self, ends, starts, middles, start_level, middle_level, end_level):
+        """Returns the Edges ending at ends, starting at the last starts crossing and passing the last middles one"""
+        start = starts[np.searchsorted(starts, ends, 'right') - 1] if len(ends) else ends
+        middle = middles[np.searchsorted(middles, ends, 'right') - 1] if len(ends) else ends
+        return Edges(self._interpolate(start, start_level), self._interpolate(middle, middle_level),
+                     self._interpolate(ends, end_level), ends // self.points)
+
+    def _first(self, times, after=None):
+        """Returns (index of the first time in each row, at or after the per row after, valid mask)"""
+        starts = self.row_starts if after is None else after
+        index = np.searchsorted(times, starts)
+        valid = index < len(times)
+        index = np.minimum(index, max(len(times) - 1, 0))
+        if len(times):
+            valid &= times[index] < self.row_starts + self.points
+        return index, valid
+
+    def _select(self, valid, values):
+        """Returns values where valid, NaN elsewhere"""
+        return np.where(valid, values, np.nan) if len(values) else np.full(self.rows, np.nan)
+
+    def _first_rising_period(self):
+        """Returns (start, end, valid) of the first period between middle crossings of rising edges, in samples"""
+        def first_period():
+            middles = self._edges()[0].middle
+            index, valid = self._first(middles)
+            following = np.minimum(index + 1, max(len(middles) - 1, 0))
+            valid &= index + 1 < len(middles)
+            if len(middles):
+                valid &= middles[following] < self.row_starts + self.points
+                return middles[index], middles[following], valid
+            return np.zeros(self.rows), np.zeros(self.rows), valid
+        return self._cached('first_period', first_period)
+
+    # timing
+
+    def per(self):
+        start, end, valid = self._first_rising_period()
+        return self._select(valid, (end - start) * self.xincrement)
+
+    def freq(self):
+        return 1.0 / self.per()
+
+    def rtim(self):
+        return self._first_edge_time(self._edges()[0])
+
+    def ftim(self):
+        return self._first_edge_time(self._edges()[1])
+
+    def _first_edge_time(self, edges):
+        index, valid = self._first(edges.end)
+        return self._select(valid, (edges.end[index] - edges.start[index]) * self.xincrement if len(edges) else [])
+
+    def pwid(self):
+        rising, falling = self._edges()
+        return self._width(rising.middle, falling.middle)
+
+    def nwid(self):
+        rising, falling = self._edges()
+        return self._width(falling.middle, rising.middle)
+
+    def _width(self, leading, trailing):
+        """Returns the time from the first leading edge to the trailing edge after it, per row"""
+        first, valid = self._first(leading)
+        if not len(leading):
+            return self._select(valid, [])
+        index, following = self._first(trailing, leading[first])
+        if not len(trailing):
+            return self._select(valid, [])
+        return self._select(valid & following, (trailing[index] - leading[first]) * self.xincrement)
+
+    def pdut(self):
+        return self.pwid() / self.per()
+
+    def ndut(self):
+        return self.nwid() / self.per()
+
+    def tvmax(self):
+        return np.argmax(self.volts, axis=1) * self.xincrement + self.xorigin
+
+    def tvmin(self):
+        return np.argmin(self.volts, axis=1) * self.xincrement + self.xorigin
+
+    def pslew(self):
+        return (self.vup() - self.vlow()) / self.rtim()
+
+    def nslew(self):
+        return (self.vlow() - self.vup()) / self.ftim()
+
+    # counts
+
+    def pedg(self):
+        return np.bincount(self._edges()[0].row, minlength=self.rows)
+
+    def nedg(self):
+        return np.bincount(self._edges()[1].row, minlength=self.rows)
+
+    def ppul(self):
+        rising, falling = self._edges()
+        return self._pulses(rising, falling)
+
+    def npul(self):
+        rising, falling = self._edges()
+        return self._pulses(falling, rising)
+
+    def _pulses(self, leading, trailing):
+        """Counts the leading edges followed by a trailing edge in the same row"""
+        index = np.searchsorted(trailing.end, leading.end)
+        closed = index < len(trailing)
+        closed[closed] = trailing.row[index[closed]] == leading.row[closed]
+        return np.bincount(leading.row[closed], minlength=self.rows)
+
+    # areas
+
+    def mar(self):
+        return self.volts.sum(axis=1) * self.xincrement
+
+    def mpar(self):
+        return self._period_reduce(lambda segment: segment.sum() * self.xincrement)
+
+    def pvrms(self):
+        return self._period_reduce(lambda segment: np.sqrt(np.dot(segment, segment) / len(segment)))
+
+    def _period_reduce(self, function):
+        """Applies function to the samples of the first period of every row that has one"""
+        start, end, valid = self._first_rising_period()
+        values = np.full(self.rows, np.nan)
+        for row in np.flatnonzero(valid):
+            first, last = int(np.ceil(start[row])), int(np.ceil(end[row]))
+            values[row] = function(self.flat[first:last])
+        return values
+
+    # two sources, other is source 2
+
+    def rdel(self, other):
+        return self._delay(self._edges()[0].middle, other._edges()[0].middle)
+
+    def fdel(self, other):
+        return self._delay(self._edges()[1].middle, other._edges()[1].middle)
+
+    def rph(self, other):
+        return self.rdel(other) / self.per() * 360.0
+
+    def fph(self, other):
+        return self.fdel(other) / self.per() * 360.0
+
+    def _delay(self, times1, times2):
+        """Returns the time from the first source 1 edge to the nearest source 2 edge, positive when source 2 lags"""
+        first, valid = self._first(times1)
+        if not len(times1) or not len(times2):
+            return np.full(self.rows, np.nan)
+        reference = times1[first]
+        after = np.searchsorted(times2, reference)
+        candidates = np.stack((np.clip(after - 1, 0, len(times2) - 1), np.clip(after, 0, len(times2) - 1)))
+        same_row = times2[candidates] // self.points == (reference // self.points)[None, :]
+        distance = np.where(same_row, np.abs(times2[candidates] - reference), np.inf)
+        nearest = candidates[np.argmin(distance, axis=0), np.arange(self.rows)]
+        valid &= np.isfinite(distance.min(axis=0))
+        return self._select(valid, (times2[nearest] - reference) * self.xincrement)
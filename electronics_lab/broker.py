@@ -0,0 +1,486 @@
+"""Broker process sharing instruments between scripts over a Unix domain socket
+
+One broker owns every instrument session, scripts connect to it instead of
+opening VISA or VXI-11 themselves, e.g.
+
+    python -m electronics_lab.broker &
+
+    client = BrokerClient()
+    scope = client.instrument('RigolDS1054z', 'TCPIP0::192.168.1.5::INSTR')
+    print(scope.get_measurement(1, RigolDS1054z.frequency))
+    time_axis, volts = scope.read_waveform(1)
+
+Every message is a fixed binary header (message type, request id, JSON
+length, payload length), a small JSON body naming the method, arguments and
+result structure, and the raw bytes of the arrays and bytes it refers to,
+so numbers and strings stay readable while bulk data is never text encoded.
+Each instrument has its own worker thread: SCPI from different clients never
+interleaves, calls on different instruments run in parallel, and a queue of
+slow calls on one instrument does not hold up the others. Arrays and bytes
+larger than inline_limit are not sent over the socket: the broker writes
+them to a file in /dev/shm and the client maps it, so waveforms are copied
+once, into shared memory. Bytes such as screenshots are copied out of the
+mapping and returned as bytes.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from .drivers.driver import Measurement, Reading
+
+log = logging.getLogger('electronics_lab.broker')
+
+# message type, request id, JSON body length, raw payload length
+header = struct.Struct('<BIII')
+REQUEST, REPLY, ERROR = 1, 2, 3
+
+# arrays and bytes up to this size travel inside the JSON body
+inline_limit = 4096
+
+# methods a client may not call on a shared instrument
+blocked_methods = ('close',)
+
+
+def default_socket_path():
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, 'electronics_lab-{}.sock'.format(os.getuid()))
+
+
+def shared_memory_directory():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class BrokerError(Exception):
+    """An exception raised by the instrument call in the broker, type is the name of its class"""
+
+    def __init__(self, type, message):
+        Exception.__init__(self, '{}: {}'.format(type, message))
+        self.type = type
+
+
+def encode_message(kind, request_id, body, payloads=()):
+    """Returns the parts of a message, the payloads are the raw buffers the body's descriptions point into"""
+    data = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    return [header.pack(kind, request_id, len(data), sum(len(payload) for payload in payloads)), data] + list(payloads)
+
+
+def send_message(connection, parts):
+    for part in parts:
+        connection.sendall(part)
+
+
+def receive_exactly(connection, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if not count:
+            raise EOFError("broker connection closed")
+        received += count
+    return buffer
+
+
+def receive_message(connection):
+    """Returns (message type, request id, decoded JSON body, raw payload)"""
+    kind, request_id, length, payload_length = header.unpack(receive_exactly(connection, header.size))
+    body = json.loads(receive_exactly(connection, length).decode('utf-8'))
+    return kind, request_id, body, receive_exactly(connection, payload_length)
+
+
+class Encoder(object):
+    """Turns call arguments and results into JSON values and back
+
+    Buffers up to inline_limit are appended to payloads and sent raw after
+    the JSON body, decoding reads them from payload. shared_files collects
+    the shared memory files written for larger ones, decoding maps and
+    unlinks them. One Encoder encodes or decodes one message.
+    """
+
+    def __init__(self, shared_files=None, payload=b''):
+        self.shared_files = shared_files
+        self.payloads = []
+        self.offset = 0
+        self.payload = payload
+
+    def encode(self, value):
+        if isinstance(value, Reading):
+            return {'__reading__': [self.encode(field) for field in value]}
+        if isinstance(value, Measurement):
+            return {'__measurement__': value.name, 'command': value.command}
+        if isinstance(value, np.ndarray):
+            return self._encode_buffer(np.ascontiguousarray(value), 'array')
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self._encode_buffer(np.frombuffer(value, dtype=np.uint8), 'bytes')
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, dict):
+            if all(isinstance(key, str) for key in value):
+                return dict((key, self.encode(item)) for key, item in value.items())
+            return {'__items__': [[self.encode(key), self.encode(item)] for key, item in value.items()]}
+        if isinstance(value, tuple):
+            return {'__tuple__': [self.encode(item) for item in value]}
+        if isinstance(value, list):
+            return [self.encode(item) for item in value]
+        return value
+
+    def _encode_buffer(self, array, kind):
+        description = {'kind': kind, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        if array.nbytes <= inline_limit or self.shared_files is None:
+            # payloads start on 8 byte boundaries, so arrays decode aligned
+            self.payloads.append(array.tobytes() + b'\0' * (-array.nbytes % 8))
+            description['offset'] = self.offset
+            self.offset += len(self.payloads[-1])
+            return {'__buffer__': description}
+        descriptor, path = tempfile.mkstemp(prefix='electronics_lab-', dir=shared_memory_directory())
+        with os.fdopen(descriptor, 'wb') as fid:
+            fid.write(array.data)
+        self.shared_files.append(path)
+        description['path'] = path
+        return {'__buffer__': description}
+
+    def decode(self, value, measurements=None):
+        if isinstance(value, list):
+            return [self.decode(item, measurements) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if '__reading__' in value:
+            return Reading(*self.decode(value['__reading__']))
+        if '__measurement__' in value:
+            return measurements[value['__measurement__'], value['command']]
+        if '__buffer__' in value:
+            return self._decode_buffer(value['__buffer__'])
+        if '__items__' in value:
+            return dict((self.decode(key, measurements), self.decode(item, measurements))
+                        for key, item in value['__items__'])
+        if '__tuple__' in value:
+            return tuple(self.decode(item, measurements) for item in value['__tuple__'])
+        return dict((key, self.decode(item, measurements)) for key, item in value.items())
+
+    def _decode_buffer(self, description):
+        if 'offset' in description:
+            dtype = np.dtype(description['dtype'])
+            count = int(np.prod(description['shape']))
+            # the payload belongs to this message, the array keeps it without a copy
+            array = np.frombuffer(self.payload, dtype=dtype, count=count, offset=description['offset'])
+            if description['kind'] == 'bytes':
+                return array.tobytes()
+            return array.reshape(description['shape'])
+        with open(description['path'], 'rb') as fid:
+            size = os.fstat(fid.fileno()).st_size
+            mapped = mmap.mmap(fid.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+        # the mapping keeps the pages, the name is not needed any more
+        os.unlink(description['path'])
+        if description['kind'] == 'bytes':
+            # bytes, as for inline payloads, the copy lets the mapping go
+            data = mapped[:]
+            if size:
+                mapped.close()
+            return data
+        return np.frombuffer(mapped, dtype=description['dtype']).reshape(description['shape'])
+
+
+def measurement_table(cls):
+    """Returns {(name, command): Measurement} of the Measurements defined on a driver class"""
+    table = {}
+    for attribute in dir(cls):
+        value = getattr(cls, attribute, None)
+        if isinstance(value, Measurement):
+            table[value.name, value.command] = value
+    return table
+
+
+class Broker(object):
+    """Serves driver calls from clients connected to the Unix socket at path
+
+    Instruments are opened on the first call naming them and stay open
+    for every client, as ('<driver registry name>', '<resource>').
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_socket_path()
+        self.instruments = {}
+        self.measurements = {}
+        self.lock = threading.Lock()
+        self._opening = {}
+        self.workers = {}
+        self.connections = set()
+        self.running = False
+        self.listener = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            # a socket left behind by a broker that did not shut down
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(16)
+        self.running = True
+        self._thread = threading.Thread(target=self._accept_loop, name='electronics_lab-broker-accept', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        self._thread.join()
+
+    def close(self):
+        self.running = False
+        if self.listener is not None:
+            # closing alone does not wake the thread blocked in accept()
+            try:
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.listener.close()
+            self.listener = None
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self.lock:
+            workers, self.workers = list(self.workers.values()), {}
+        for worker in workers:
+            worker.shutdown()
+        for instrument in self.instruments.values():
+            instrument.close()
+        self.instruments = {}
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def instrument(self, driver, resource):
+        """Returns the broker's driver instance for the resource, opening it on first use"""
+        key = (driver, resource)
+        with self.lock:
+            instrument = self.instruments.get(key)
+            if instrument is not None:
+                return instrument
+            opening = self._opening.setdefault(key, threading.Lock())
+        # opening can take seconds, it only holds up the calls waiting for the same instrument
+        with opening:
+            with self.lock:
+                instrument = self.instruments.get(key)
+            if instrument is not None:
+                return instrument
+            cls = getattr(importlib.import_module('electronics_lab.drivers'), driver)
+            instrument = cls(resource)
+            measurements = measurement_table(cls)
+            with self.lock:
+                self.instruments[key] = instrument
+                self.measurements[driver] = measurements
+                self._opening.pop(key, None)
+            return instrument
+
+    # one thread per instrument runs its calls in order, so a busy instrument only delays its own callers
+    def worker(self, driver, resource):
+        with self.lock:
+            worker = self.workers.get((driver, resource))
+            if worker is None:
+                worker = self.workers[driver, resource] = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='electronics_lab-broker-' + str(driver))
+            return worker
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.add(connection)
+            threading.Thread(target=self._serve, args=(connection,), name='electronics_lab-broker-client',
+                             daemon=True).start()
+
+    def _serve(self, connection):
+        send_lock = threading.Lock()
+        shared_files = []
+        futures = set()
+        try:
+            while True:
+                kind, request_id, body, payload = receive_message(connection)
+                if kind == REQUEST:
+                    future = self.worker(str(body.get('driver')), str(body.get('resource'))).submit(
+                        self._handle, connection, send_lock, shared_files, request_id, body, payload)
+                    futures.add(future)
+                    future.add_done_callback(futures.discard)
+        except (EOFError, OSError, RuntimeError):
+            pass
+        finally:
+            self.connections.discard(connection)
+            # calls still running may write more payloads, they are cleaned up once all of them are done
+            wait(list(futures))
+            connection.close()
+            # payloads the client never mapped
+            for path in shared_files:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _handle(self, connection, send_lock, shared_files, request_id, body, payload):
+        encoder = Encoder(shared_files, payload)
+        try:
+            if body['method'].startswith('_') or body['method'] in blocked_methods:
+                raise AttributeError("{} can not be called through the broker".format(body['method']))
+            instrument = self.instrument(body['driver'], body['resource'])
+            measurements = self.measurements[body['driver']]
+            args = encoder.decode(body.get('args', []), measurements)
+            kwargs = encoder.decode(body.get('kwargs', {}), measurements)
+            with instrument.transaction():
+                result = getattr(instrument, body['method'])(*args, **kwargs)
+            # a result JSON can not hold fails here, the client gets an ERROR rather than no reply
+            reply = {'result': encoder.encode(result)}
+            message = encode_message(REPLY, request_id, reply, encoder.payloads)
+        except Exception as error:
+            log.warning("Broker call %s failed", body.get('method'), exc_info=True)
+            message = encode_message(ERROR, request_id, {'type': type(error).__name__, 'message': str(error)})
+        try:
+            with send_lock:
+                send_message(connection, message)
+        except OSError:
+            log.warning("Could not send the reply to %s, the client is gone", body.get('method'), exc_info=True)
+
+
+class RemoteInstrument(object):
+    """Proxy calling the methods of a driver in the broker, e.g. scope.get_measurement(1, RigolDS1054z.frequency)"""
+
+    def __init__(self, client, driver, resource):
+        self._client = client
+        self._driver = driver
+        self._resource = resource
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self._client.call(self._driver, self._resource, name, args, kwargs)
+        call.__name__ = name
+        return call
+
+    # the broker keeps the instrument open for the other clients
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class BrokerClient(object):
+    """Connection to a Broker, safe to use from several threads at once"""
+
+    def __init__(self, path=None, timeout=60.0):
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(self.path)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, name='electronics_lab-broker-reader', daemon=True)
+        self._reader.start()
+
+    def instrument(self, driver, resource):
+        """Returns a proxy for the driver (its registry name, e.g. 'RigolDS1054z') on resource"""
+        return RemoteInstrument(self, driver, resource)
+
+    def call(self, driver, resource, method, args=(), kwargs=None):
+        request_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        encoder = Encoder()
+        body = {'driver': driver, 'resource': resource, 'method': method,
+                'args': encoder.encode(list(args)), 'kwargs': encoder.encode(kwargs or {})}
+        message = encode_message(REQUEST, request_id, body, encoder.payloads)
+        with self._lock:
+            if self._closed:
+                raise EOFError("broker connection closed")
+            self._pending[request_id] = waiter
+            send_message(self.connection, message)
+        if not waiter[0].wait(self.timeout):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise BrokerError('TimeoutError', "no reply to {} within {} s".format(method, self.timeout))
+        if waiter[1] is None:
+            raise EOFError("broker connection closed")
+        kind, reply, payload = waiter[1]
+        if kind == ERROR:
+            raise BrokerError(reply['type'], reply['message'])
+        return Encoder(payload=payload).decode(reply['result'])
+
+    def _read_loop(self):
+        try:
+            while True:
+                kind, request_id, body, payload = receive_message(self.connection)
+                with self._lock:
+                    waiter = self._pending.pop(request_id, None)
+                if waiter is not None:
+                    waiter[1] = (kind, body, payload)
+                    waiter[0].set()
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            self._closed = True
+            pending, self._pending = list(self._pending.values()), {}
+        for waiter in pending:
+            waiter[0].set()
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+        self._reader.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shares instruments between processes over a Unix socket')
+    parser.add_argument('--socket', default=default_socket_path(), help='path of the Unix socket')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    broker = Broker(args.socket)
+    log.info("Serving instruments on %s", args.socket)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Background screen capture with timelapse and duplicate frame skipping
+
+A worker thread reads screen captures from the scope and a writer thread
+stores them, so a multi-hour soak records the screen without stalling the
+measurements made on the same session, e.g.
+
+    with CaptureService(scope, directory='soak', interval=60.0) as service:
+        run_soak(scope)
+    print(service.stats())
+
+Frames whose content hash matches the previous frame are not stored. The
+queue between the two threads holds queue_size frames, when it is full the
+policy decides: 'block' stalls the worker, 'drop_oldest' discards the
+oldest queued frame and 'drop_newest' discards the new frame.
+"""
+
+import datetime
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger('electronics_lab.capture')
+
+policies = ('block', 'drop_oldest', 'drop_newest')
+
+
+class Frame(namedtuple('Frame', 'index timestamp digest data')):
+    """One screen capture, timestamp is time.time() when the transfer finished"""
+    __slots__ = ()
+
+
+class CaptureService(object):
+    """Captures scope.read_screen_capture() on a worker thread and stores frames on a writer thread
+
+    interval is the timelapse period in seconds, None only captures when
+    capture() is called. writer is called with each Frame to be stored, by
+    default frames are written to directory as <prefix><time>_<index>.png.
+    """
+
+    def __init__(self, scope, directory='.', interval=None, queue_size=8, policy='block', dedup=True,
+                 prefix='rigol_', writer=None):
+        if policy not in policies:
+            raise ValueError("policy must be one of {}, not {!r}".format(', '.join(policies), policy))
+        self.scope = scope
+        self.directory = directory
+        self.interval = interval
+        self.policy = policy
+        self.dedup = dedup
+        self.prefix = prefix
+        self.writer = writer or self.write_frame
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.captured = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.missed_deadlines = 0
+        self.last_digest = None
+        self.last_filename = None
+        self._requests = 0
+        self._wake = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._threads = [threading.Thread(target=self._capture_loop, name='electronics_lab-capture', daemon=True),
+                         threading.Thread(target=self._write_loop, name='electronics_lab-capture-writer',
+                                          daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stops capturing and returns once every queued frame has been stored"""
+        with self._wake:
+            self._running = False
+            self._wake.notify_all()
+        if self._threads:
+            self._threads[0].join()
+            self.queue.put(None)
+            self._threads[1].join()
+            self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def capture(self):
+        """Asks the worker for one capture now, in addition to the timelapse"""
+        with self._wake:
+            self._requests += 1
+            self._wake.notify_all()
+
+    def grab(self):
+        """Reads one frame from the scope in the calling thread, returns None for a duplicate"""
+        data = self.scope.read_screen_capture()
+        digest = hashlib.sha1(data).hexdigest()
+        self.captured += 1
+        if self.dedup and digest == self.last_digest:
+            self.duplicates += 1
+            return None
+        self.last_digest = digest
+        return Frame(self.captured, time.time(), digest, data)
+
+    def stats(self):
+        return {'captured': self.captured, 'duplicates': self.duplicates, 'dropped': self.dropped,
+                'written': self.written, 'errors': self.errors, 'missed_deadlines': self.missed_deadlines,
+                'queued': self.queue.qsize()}
+
+    def write_frame(self, frame):
+        name = datetime.datetime.fromtimestamp(frame.timestamp).strftime("%Y-%m-%d_%H-%M-%S")
+        filename = os.path.join(self.directory, "{}{}_{:06d}.png".format(self.prefix, name, frame.index))
+        # written under a temporary name so a crash never leaves a partial image behind
+        with open(filename + '.part', 'wb') as fid:
+            fid.write(frame.data)
+        os.replace(filename + '.part', filename)
+        self.last_filename = filename
+
+    def _next_request(self, deadline):
+        """Waits until the deadline or a capture() request, returns False once stopped"""
+        with self._wake:
+            while self._running and not self._requests:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return True
+                self._wake.wait(remaining)
+            self._requests = 0
+            return self._running
+
+    def _capture_loop(self):
+        deadline = None if self.interval is None else time.monotonic()
+        while self._next_request(deadline):
+            if deadline is not None and time.monotonic() >= deadline:
+                deadline += self.interval
+                # slots that passed during a slow transfer are skipped rather than captured back to back
+                while deadline <= time.monotonic():
+                    deadline += self.interval
+                    self.missed_deadlines += 1
+            try:
+                frame = self.grab()
+            except Exception:
+                self.errors += 1
+                log.exception("Screen capture failed")
+                continue
+            if frame is not None:
+                self._enqueue(frame)
+
+    def _enqueue(self, frame):
+        if self.policy == 'block':
+            self.queue.put(frame)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                if self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def _write_loop(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            try:
+                self.writer(frame)
+                self.written += 1
+            except Exception:
+                self.errors += 1
+                log.exception("Storing screen capture %d failed", frame.index)
@@ -0,0 +1,328 @@
+"""Append-only columnar log of readings for long soak tests
+
+Readings are collected per series in memory and written in blocks, each
+block holding one series' timestamps and values as float64 columns behind
+a header with the block's time range and value range, e.g.
+
+    with DataLogger('soak.eldlog') as logger:
+        logger.attach()          # every get_measurement reading is logged
+        run_soak()
+
+    log = DataLog('soak.eldlog')
+    times, amps = log.query('SiglentSPD3303X/CH1/current', t0, t1)
+
+Blocks are written by a background thread, write() only appends to a
+list. Partial blocks are written every flush_interval seconds, so a crash
+loses at most the readings of the last interval. Every block carries a
+CRC, a torn block at the end of the file is ignored on reading and cut off
+before the next append.
+
+Queries read the block headers once and map the file, only blocks whose
+time range overlaps the query are touched.
+"""
+
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from .drivers import driver
+
+log = logging.getLogger('electronics_lab.datalog')
+
+file_magic = b'ELDLOG1\n'
+
+# magic, series name length, point count, CRC32 of name and columns, first and last time, smallest and largest value
+block_header = struct.Struct('<4sHIIdddd')
+block_magic = b'BLK1'
+
+
+def series_name(instrument, reading):
+    """Returns '<name>/CH<channel>/<reading name>', name is the driver's name attribute or its class name"""
+    prefix = getattr(instrument, 'name', None) or type(instrument).__name__
+    if reading.channel is None:
+        return '{}/{}'.format(prefix, reading.name)
+    return '{}/CH{}/{}'.format(prefix, reading.channel, reading.name)
+
+
+def padding(length):
+    """Bytes needed after length bytes to keep the columns 8 byte aligned"""
+    return -length % 8
+
+
+class Block(namedtuple('Block', 'series offset count t_min t_max v_min v_max')):
+    """Index entry of one block, offset is where its timestamp column starts in the file"""
+    __slots__ = ()
+
+
+def encode_block(series, timestamps, values):
+    """Returns the bytes of one block"""
+    name = series.encode('utf-8')
+    timestamps = np.ascontiguousarray(timestamps, dtype='<f8')
+    values = np.ascontiguousarray(values, dtype='<f8')
+    body = b''.join((name, b'\0' * padding(block_header.size + len(name)), timestamps.tobytes(), values.tobytes()))
+    finite = values[np.isfinite(values)]
+    v_min, v_max = (finite.min(), finite.max()) if len(finite) else (np.nan, np.nan)
+    header = block_header.pack(block_magic, len(name), len(timestamps), zlib.crc32(body) & 0xffffffff,
+                               timestamps.min(), timestamps.max(), v_min, v_max)
+    return header + body
+
+
+def scan_blocks(data, start=len(file_magic), verify=True):
+    """Returns (Blocks from start on, offset after the last whole block), stopping at a torn or corrupt block
+
+    verify=False checks the CRC of the last block only, which finds the end
+    of a long log without reading every column.
+    """
+    blocks = []
+    offset = last = start
+    last_crc = None
+    while offset + block_header.size <= len(data):
+        magic, name_length, count, crc, t_min, t_max, v_min, v_max = block_header.unpack_from(data, offset)
+        columns = offset + block_header.size + name_length + padding(block_header.size + name_length)
+        end = columns + 16 * count
+        if magic != block_magic or end > len(data):
+            break
+        if verify and zlib.crc32(data[offset + block_header.size:end]) & 0xffffffff != crc:
+            break
+        series = bytes(data[offset + block_header.size:offset + block_header.size + name_length]).decode('utf-8')
+        blocks.append(Block(series, columns, count, t_min, t_max, v_min, v_max))
+        last, last_crc, offset = offset, crc, end
+    if not verify and blocks and zlib.crc32(data[last + block_header.size:offset]) & 0xffffffff != last_crc:
+        blocks.pop()
+        offset = last
+    return blocks, offset
+
+
+class DataLogger(object):
+    """Collects readings per series and appends them to path in blocks of up to block_size points
+
+    attach() adds the logger to electronics_lab.drivers.driver.sinks, so
+    every reading a driver logs is also written here. fsync makes every
+    written block durable before the next one, at the cost of a disk flush.
+    """
+
+    def __init__(self, path, block_size=4096, flush_interval=1.0, fsync=False):
+        self.path = path
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffers = {}
+        self.blocks_written = 0
+        self.points_written = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self._file = self._open_for_append()
+        self._thread = threading.Thread(target=self._run, name='electronics_lab-datalog', daemon=True)
+        self._thread.start()
+
+    def _open_for_append(self):
+        fid = open(self.path, 'a+b')
+        size = os.fstat(fid.fileno()).st_size
+        if not size:
+            fid.write(file_magic)
+            fid.flush()
+            return fid
+        fid.seek(0)
+        if fid.read(len(file_magic)) != file_magic:
+            fid.close()
+            raise ValueError("{} is not a data log".format(self.path))
+        # only the block headers and the last block are read, a long log is not loaded into memory
+        mapped = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            end = scan_blocks(mapped, verify=False)[1]
+        finally:
+            mapped.close()
+        if end < size:
+            # the tail of a block torn by a crash, later blocks must start on a block boundary
+            log.warning("Dropping %d bytes of an incomplete block at the end of %s", size - end, self.path)
+            fid.truncate(end)
+        return fid
+
+    def write(self, series, timestamp, value):
+        """Queues one point, never waits for the disk"""
+        with self.lock:
+            buffer = self.buffers.setdefault(series, ([], []))
+            buffer[0].append(timestamp)
+            buffer[1].append(value)
+            if len(buffer[0]) >= self.block_size:
+                self.queue.put((series, self.buffers.pop(series)))
+
+    def write_reading(self, instrument, reading):
+        """Logs a driver Reading, readings without a numeric value are skipped"""
+        try:
+            value = float(reading.value)
+        except (TypeError, ValueError):
+            return
+        self.write(series_name(instrument, reading), reading.timestamp, value)
+
+    __call__ = write_reading
+
+    def attach(self):
+        """Logs every reading the drivers log from now on"""
+        if self not in driver.sinks:
+            driver.sinks.append(self)
+        return self
+
+    def detach(self):
+        if self in driver.sinks:
+            driver.sinks.remove(self)
+
+    def flush(self):
+        """Hands every buffered point to the writer thread and waits until it is on disk"""
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+        for series, buffer in buffers.items():
+            self.queue.put((series, buffer))
+        self.queue.join()
+
+    def close(self):
+        self.detach()
+        if self._thread is None:
+            return
+        self.flush()
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        flushed = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            # partial blocks go out every flush_interval, bounding what a crash can lose
+            if time.monotonic() - flushed >= self.flush_interval:
+                flushed = time.monotonic()
+                with self.lock:
+                    buffers, self.buffers = self.buffers, {}
+                for series, buffer in buffers.items():
+                    self.queue.put((series, buffer))
+            if item == ():
+                continue
+            try:
+                if item is None:
+                    return
+                self._write_block(*item)
+            except Exception:
+                self.errors += 1
+                log.exception("Writing a data log block failed")
+            finally:
+                self.queue.task_done()
+
+    def _write_block(self, series, buffer):
+        timestamps, values = buffer
+        if not timestamps:
+            return
+        self._file.write(encode_block(series, timestamps, values))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.blocks_written += 1
+        self.points_written += len(timestamps)
+
+
+class DataLog(object):
+    """Reads a data log through a memory map, refresh() picks up blocks appended since"""
+
+    def __init__(self, path):
+        self.path = path
+        self.blocks = {}
+        self._end = len(file_magic)
+        self._file = open(path, 'rb')
+        if self._file.read(len(file_magic)) != file_magic:
+            self._file.close()
+            raise ValueError("{} is not a data log".format(path))
+        self._map = None
+        self.refresh()
+
+    def refresh(self):
+        size = os.fstat(self._file.fileno()).st_size
+        if self._map is not None and size == len(self._map):
+            return
+        # arrays returned by earlier queries are copies, the old map goes once nothing refers to it
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        blocks, self._end = scan_blocks(self._map, self._end)
+        for block in blocks:
+            self.blocks.setdefault(block.series, []).append(block)
+        self._index = dict((series, np.array([(block.t_min, block.t_max) for block in series_blocks]))
+                           for series, series_blocks in self.blocks.items())
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def series(self):
+        return sorted(self.blocks)
+
+    def _overlapping(self, series, t0, t1):
+        if series not in self.blocks:
+            raise KeyError("No series {!r} in {}".format(series, self.path))
+        ranges = self._index[series]
+        selected = np.flatnonzero((ranges[:, 1] >= t0) & (ranges[:, 0] <= t1))
+        return [self.blocks[series][index] for index in selected]
+
+    def _columns(self, block):
+        timestamps = np.frombuffer(self._map, dtype='<f8', count=block.count, offset=block.offset)
+        values = np.frombuffer(self._map, dtype='<f8', count=block.count, offset=block.offset + 8 * block.count)
+        return timestamps, values
+
+    def query(self, series, t0=-np.inf, t1=np.inf):
+        """Returns (timestamps, values) of series with t0 <= timestamp <= t1, in the order they were logged"""
+        timestamps, values = [], []
+        for block in self._overlapping(series, t0, t1):
+            block_times, block_values = self._columns(block)
+            if t0 <= block.t_min and block.t_max <= t1:
+                selected = slice(None)
+            else:
+                selected = (block_times >= t0) & (block_times <= t1)
+            timestamps.append(block_times[selected])
+            values.append(block_values[selected])
+        if not timestamps:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate(timestamps), np.concatenate(values)
+
+    def extrema(self, series, t0=-np.inf, t1=np.inf):
+        """Returns (smallest, largest) value of series between t0 and t1, blocks wholly inside are not read"""
+        lows, highs = [], []
+        for block in self._overlapping(series, t0, t1):
+            if t0 <= block.t_min and block.t_max <= t1:
+                lows.append(block.v_min)
+                highs.append(block.v_max)
+                continue
+            block_times, block_values = self._columns(block)
+            selected = block_values[(block_times >= t0) & (block_times <= t1)]
+            if len(selected):
+                lows.append(np.nanmin(selected))
+                highs.append(np.nanmax(selected))
+        if not lows:
+            return np.nan, np.nan
+        return float(np.nanmin(lows)), float(np.nanmax(highs))
+
+    def time_range(self, series):
+        ranges = self._index[series]
+        return float(ranges[:, 0].min()), float(ranges[:, 1].max())
@@ -0,0 +1,330 @@
+"""Host side I2C, SPI and UART decoding of captured waveforms
+
+The scope's own decoder only sees the screen. These decoders take the full
+captures of the bus lines, as volts, raw byte codes or booleans, and return
+the decoded words as a numpy structured array, e.g.
+
+    sda, header = load_waveform_file('sda.npy')
+    scl, header = load_waveform_file('scl.npy')
+    frames = I2CDecoder(threshold=128, xincrement=header['preamble']['xincrement']).decode(sda, scl)
+    print(frames[frames['is_address']]['address'])
+
+Samples are fed chunk by chunk, feed() keeps the bus state between calls,
+so a 12 Mpoint memory mapped capture is decoded without loading it whole.
+Edges are found with numpy on whole chunks, Python only loops over
+transactions and UART frames, not over samples.
+
+Analog lines are compared against threshold, with hysteresis the levels
+go through digitize(), a Schmitt trigger, so ringing or noise around the
+threshold on a slow edge does not add clock edges.
+
+Every frame has start and end sample indexes counted from the first sample
+fed and time, the start in seconds from xorigin and xincrement.
+"""
+
+import bisect
+
+import numpy as np
+
+# samples per chunk used by decode()
+default_chunk_size = 1 << 20
+
+i2c_dtype = np.dtype([('start', 'i8'), ('end', 'i8'), ('time', 'f8'), ('transaction', 'u4'), ('address', 'u1'),
+                      ('read', '?'), ('is_address', '?'), ('data', 'u1'), ('ack', '?')])
+
+spi_dtype = np.dtype([('start', 'i8'), ('end', 'i8'), ('time', 'f8'), ('frame', 'u4'), ('mosi', 'u4'),
+                      ('miso', 'u4')])
+
+uart_dtype = np.dtype([('start', 'i8'), ('end', 'i8'), ('time', 'f8'), ('data', 'u2'), ('parity_error', '?'),
+                       ('framing_error', '?')])
+
+
+def digitize(samples, threshold, hysteresis=0.0, initial=False):
+    """Returns the logic levels of samples, with a Schmitt trigger when hysteresis is not 0
+
+    A level only changes once the samples pass threshold +- hysteresis / 2,
+    initial is the level before the first sample, e.g. the last level of the
+    previous chunk.
+    """
+    samples = np.asarray(samples)
+    if not hysteresis:
+        return samples > threshold
+    state = np.where(samples > threshold + hysteresis / 2.0, 1, np.where(samples < threshold - hysteresis / 2.0, 0, -1))
+    decided = np.where(state >= 0, np.arange(len(state)), -1)
+    np.maximum.accumulate(decided, out=decided)
+    return np.where(decided >= 0, state[np.maximum(decided, 0)] == 1, bool(initial))
+
+
+def rising_edges(levels):
+    """Returns the indexes of the first high sample of every rising edge"""
+    return np.flatnonzero(levels[1:] & ~levels[:-1]) + 1
+
+
+def falling_edges(levels):
+    """Returns the indexes of the first low sample of every falling edge"""
+    return np.flatnonzero(~levels[1:] & levels[:-1]) + 1
+
+
+def pack_bits(bits, msb_first=True):
+    """Returns the words of a (words, bits per word) array of 0/1 values"""
+    count = bits.shape[1]
+    weights = 1 << (np.arange(count - 1, -1, -1) if msb_first else np.arange(count))
+    return bits.astype(np.int64).dot(weights) if len(bits) else np.zeros(0, dtype=np.int64)
+
+
+class Decoder(object):
+    """Feeds chunks of the bus lines and returns the frames that completed in each chunk
+
+    Lines that are not bool are compared against threshold, or taken as
+    high when not 0 if threshold is None. A level only changes once a
+    sample passes threshold +- hysteresis / 2, see digitize.
+    """
+
+    dtype = None
+
+    def __init__(self, threshold=None, xincrement=1.0, xorigin=0.0, hysteresis=0.0):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.xincrement = xincrement
+        self.xorigin = xorigin
+        self.reset()
+
+    def reset(self):
+        # samples fed so far, the index of the next chunk's first sample
+        self.offset = 0
+        self.last = None
+
+    # initial is the line's level at the end of the previous chunk, the first sample decides it otherwise
+    def levels(self, samples, initial=None):
+        samples = np.asarray(samples)
+        if samples.dtype == bool:
+            return samples
+        if self.threshold is None:
+            return samples != 0
+        if initial is None:
+            initial = len(samples) and samples[0] > self.threshold
+        return digitize(samples, self.threshold, self.hysteresis, initial)
+
+    def decode(self, *lines, **kwargs):
+        """Feeds the whole lines, e.g. memory mapped captures, chunk_size samples at a time"""
+        chunk_size = kwargs.pop('chunk_size', default_chunk_size)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments {}".format(', '.join(kwargs)))
+        lengths = set(len(line) for line in lines if line is not None)
+        if len(lengths) > 1:
+            raise ValueError("every line needs the same number of samples")
+        points = lengths.pop()
+        frames = [self.feed(*[None if line is None else line[start:start + chunk_size] for line in lines])
+                  for start in range(0, points, chunk_size)]
+        return np.concatenate(frames) if frames else np.zeros(0, dtype=self.dtype)
+
+    def _extend(self, lines):
+        """Returns the levels of the chunk with the last levels of the previous chunk in front, and their offset
+
+        Index 0 of the returned levels is sample offset of the whole capture.
+        """
+        previous = self.last or [None] * len(lines)
+        levels = [None if line is None else self.levels(line, last) for line, last in zip(lines, previous)]
+        offset = self.offset
+        self.offset += len(levels[0])
+        if self.last is not None:
+            levels = [level if level is None else np.concatenate(([last], level))
+                      for last, level in zip(self.last, levels)]
+            offset -= 1
+        self.last = [level if level is None else level[-1] for level in levels]
+        return levels, offset
+
+    def _frames(self, start, end, **fields):
+        frames = np.zeros(len(start), dtype=self.dtype)
+        frames['start'] = start
+        frames['end'] = end
+        frames['time'] = np.asarray(start) * self.xincrement + self.xorigin
+        for name, values in fields.items():
+            frames[name] = values
+        return frames
+
+
+class I2CDecoder(Decoder):
+    """Decodes SDA and SCL into one frame per byte
+
+    The first byte after a START or repeated START is the address byte,
+    address and read are set on it and on every data byte of its
+    transaction. A byte is only reported once its ACK bit was clocked, ack is
+    True when the receiver pulled SDA low.
+    """
+
+    dtype = i2c_dtype
+
+    def reset(self):
+        Decoder.reset(self)
+        # bits of the unfinished byte as (sample, value) and the open transaction, kept between chunks
+        self.pending = np.zeros((0, 2), dtype=np.int64)
+        self.transaction = -1
+        self.in_transaction = False
+        self.byte_count = 0
+        self.address = 0
+        self.read = False
+
+    def feed(self, sda, scl):
+        (sda, scl), offset = self._extend((sda, scl))
+        clock = rising_edges(scl)
+        # START is SDA falling and STOP SDA rising while SCL stays high
+        data_falls, data_rises = falling_edges(sda), rising_edges(sda)
+        starts = data_falls[scl[data_falls] & scl[data_falls - 1]]
+        stops = data_rises[scl[data_rises] & scl[data_rises - 1]]
+        bits = np.column_stack((clock + offset, sda[clock]))
+        conditions = np.concatenate((starts, stops)) + offset
+        is_start = np.concatenate((np.ones(len(starts), bool), np.zeros(len(stops), bool)))
+        order = np.argsort(conditions, kind='stable')
+        conditions, is_start = conditions[order], is_start[order]
+
+        bits = np.concatenate((self.pending, bits))
+        # bits between two conditions belong to the transaction opened by the first one
+        bounds = np.searchsorted(bits[:, 0], conditions)
+        frames = []
+        first = 0
+        for bound, start_condition in zip(bounds, is_start):
+            frames.append(self._bytes(bits[first:bound], complete=True))
+            first = bound
+            self.in_transaction = bool(start_condition)
+            self.byte_count = 0
+            if start_condition:
+                self.transaction += 1
+        frames.append(self._bytes(bits[first:], complete=False))
+        return np.concatenate(frames)
+
+    def _bytes(self, bits, complete):
+        """Returns the frames of the whole bytes in bits, the rest is kept for the next chunk unless complete"""
+        self.pending = np.zeros((0, 2), dtype=np.int64)
+        if not self.in_transaction:
+            return np.zeros(0, dtype=self.dtype)
+        count = len(bits) // 9
+        if not complete:
+            self.pending = bits[count * 9:]
+        if not count:
+            return np.zeros(0, dtype=self.dtype)
+        samples = bits[:count * 9, 0].reshape(count, 9)
+        values = bits[:count * 9, 1].reshape(count, 9)
+        data = pack_bits(values[:, :8])
+        is_address = np.zeros(count, bool)
+        if self.byte_count == 0:
+            is_address[0] = True
+            self.address, self.read = int(data[0]) >> 1, bool(data[0] & 1)
+        self.byte_count += count
+        return self._frames(samples[:, 0], samples[:, 8], transaction=self.transaction, address=self.address,
+                            read=self.read, is_address=is_address, data=data, ack=values[:, 8] == 0)
+
+
+class SPIDecoder(Decoder):
+    """Decodes SCLK, MOSI and optionally MISO and an active low chip select into one frame per word
+
+    Data is sampled on the rising clock edge when cpol == cpha, on the
+    falling edge otherwise. Without chip select the words follow each other
+    from the first clock edge, with it every assertion starts a new frame
+    and a word cut short by a deassertion is dropped.
+    """
+
+    dtype = spi_dtype
+
+    def __init__(self, threshold=None, xincrement=1.0, xorigin=0.0, cpol=0, cpha=0, word_bits=8, msb_first=True,
+                 hysteresis=0.0):
+        self.cpol = cpol
+        self.cpha = cpha
+        self.word_bits = word_bits
+        self.msb_first = msb_first
+        Decoder.__init__(self, threshold, xincrement, xorigin, hysteresis)
+
+    def reset(self):
+        Decoder.reset(self)
+        # (sample, mosi, miso) of the unfinished word
+        self.pending = np.zeros((0, 3), dtype=np.int64)
+        self.frame = 0
+
+    def feed(self, sclk, mosi, miso=None, cs=None):
+        (sclk, mosi, miso, cs), offset = self._extend((sclk, mosi, miso, cs))
+        clock = rising_edges(sclk) if self.cpol == self.cpha else falling_edges(sclk)
+        if cs is not None:
+            clock = clock[~cs[clock]]
+        bits = np.column_stack((clock + offset, mosi[clock], miso[clock] if miso is not None else np.zeros_like(clock)))
+        bits = np.concatenate((self.pending, bits))
+        asserts = falling_edges(cs) + offset if cs is not None else np.zeros(0, dtype=np.int64)
+        # a chip select assertion starts a new frame, pending bits belong to the frame before it
+        segment = np.searchsorted(asserts, bits[:, 0], 'right')
+        first_frame = self.frame
+        self.frame += len(asserts)
+        if not len(bits):
+            return np.zeros(0, dtype=self.dtype)
+        segments, first_bit, lengths = np.unique(segment, return_index=True, return_counts=True)
+        slot = np.searchsorted(segments, segment)
+        position = np.arange(len(bits)) - first_bit[slot]
+        whole = position // self.word_bits < lengths[slot] // self.word_bits
+        # the last frame's unfinished word waits for the next chunk
+        last = slot == len(segments) - 1
+        self.pending = bits[last & ~whole]
+        words = bits[whole].reshape(-1, self.word_bits, 3)
+        frame = segment[whole][::self.word_bits] + first_frame
+        return self._frames(words[:, 0, 0], words[:, -1, 0], frame=frame,
+                            mosi=pack_bits(words[:, :, 1], self.msb_first),
+                            miso=pack_bits(words[:, :, 2], self.msb_first))
+
+
+class UARTDecoder(Decoder):
+    """Decodes one idle high UART line, LSB first, into one frame per character
+
+    samples_per_bit is the sample rate divided by the baud rate, parity is
+    None, 'even' or 'odd'. Every bit is sampled in its middle, a start bit
+    that is high there is a glitch and skipped, a low stop bit sets
+    framing_error.
+    """
+
+    dtype = uart_dtype
+
+    def __init__(self, samples_per_bit, threshold=None, xincrement=1.0, xorigin=0.0, data_bits=8, parity=None,
+                 stop_bits=1, hysteresis=0.0):
+        if parity not in (None, 'even', 'odd'):
+            raise ValueError("parity must be None, 'even' or 'odd', not {!r}".format(parity))
+        self.samples_per_bit = float(samples_per_bit)
+        self.data_bits = data_bits
+        self.parity = parity
+        self.stop_bits = stop_bits
+        self.frame_bits = 1 + data_bits + (parity is not None) + stop_bits
+        Decoder.__init__(self, threshold, xincrement, xorigin, hysteresis)
+
+    def reset(self):
+        Decoder.reset(self)
+        # samples from just before an unfinished frame, decoded again with the next chunk
+        self.tail = np.zeros(0, bool)
+
+    def feed(self, line):
+        offset = self.offset - len(self.tail)
+        line = np.concatenate((self.tail, self.levels(line, self.tail[-1] if len(self.tail) else None)))
+        self.offset = offset + len(line)
+        middles = np.round((np.arange(self.frame_bits) + 0.5) * self.samples_per_bit).astype(np.int64)
+        # the next start bit can begin once the middle of the last stop bit has passed
+        spacing = int(middles[-1])
+        falls = falling_edges(line).tolist()
+        starts = []
+        index = 0
+        # the sample before the edge is kept so the edge is found again, or the last one for the next edge
+        self.tail = line[-1:]
+        while index < len(falls):
+            start = falls[index]
+            if start + spacing >= len(line):
+                self.tail = line[start - 1:]
+                break
+            if line[start + middles[0]]:
+                # high in the middle of the start bit, a glitch
+                index += 1
+                continue
+            starts.append(start)
+            index = bisect.bisect_left(falls, start + spacing, index)
+        starts = np.array(starts, dtype=np.int64)
+        samples = line[starts[:, None] + middles[None, :]] if len(starts) else np.zeros((0, self.frame_bits), bool)
+        data = pack_bits(samples[:, 1:1 + self.data_bits], msb_first=False)
+        stop = 1 + self.data_bits + (self.parity is not None)
+        parity_error = np.zeros(len(starts), bool)
+        if self.parity is not None:
+            ones = samples[:, 1:stop].sum(axis=1)
+            parity_error = ones % 2 != (1 if self.parity == 'odd' else 0)
+        return self._frames(starts + offset, starts + offset + spacing, data=data, parity_error=parity_error,
+                            framing_error=~samples[:, stop:].all(axis=1))
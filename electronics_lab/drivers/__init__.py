@@ -1,6 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""Lazy registry of the instrument drivers
+
+Names in registry, and drivers other packages register under the
+electronics_lab.drivers entry point group, are imported on first attribute
+access, so importing electronics_lab.drivers does not import pyvisa,
+vxi11 or numpy, e.g.
+
+    from electronics_lab.drivers import RigolDS1054z
+"""
 # flake8: noqa
-from .driver import Driver
-from .rigolds1054z import RigolDS1054z
-from .siglentsdm3055 import SiglentSDM3055
-from .siglentsdg1032x import SiglentSDG1032X
-from .siglentspd3303x import SiglentSPD3303X
+import importlib
+import logging
+
+log = logging.getLogger('electronics_lab.drivers')
+
+# the group third party packages list their drivers under, e.g. in setup.py
+# entry_points={'electronics_lab.drivers': ['KeysightE36312A = mypackage.keysight:KeysightE36312A']}
+entry_point_group = 'electronics_lab.drivers'
+
+# name -> 'module:attribute', drivers and their transports are only imported on first use
+registry = {
+    'Driver': 'electronics_lab.drivers.driver:Driver',
+    'InstrumentTimeout': 'electronics_lab.drivers.driver:InstrumentTimeout',
+    'AsyncDriver': 'electronics_lab.drivers.async_driver:AsyncDriver',
+    'RigolDS1054z': 'electronics_lab.drivers.rigolds1054z:RigolDS1054z',
+    'SiglentSDM3055': 'electronics_lab.drivers.siglentsdm3055:SiglentSDM3055',
+    'SiglentSDG1032X': 'electronics_lab.drivers.siglentsdg1032x:SiglentSDG1032X',
+    'SiglentSPD3303X': 'electronics_lab.drivers.siglentspd3303x:SiglentSPD3303X',
+}
+
+__all__ = list(registry)
+
+_entry_points_loaded = False
+
+
+def register_driver(name, target):
+    """Registers a driver class, or a 'module:attribute' string naming one, under name"""
+    registry[name] = target
+    globals().pop(name, None)
+    if name not in __all__:
+        __all__.append(name)
+
+
+def load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    # importlib.metadata is new in Python 3.8, setup.py installs the importlib_metadata backport before that
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            log.warning("Neither importlib.metadata nor importlib_metadata is available, drivers registered "
+                        "under the %s entry point group are not loaded", entry_point_group)
+            return
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=entry_point_group)
+    else:
+        found = found.get(entry_point_group, ())
+    for entry_point in found:
+        if entry_point.name not in registry:
+            register_driver(entry_point.name, entry_point.value)
+
+
+def __getattr__(name):
+    if name not in registry:
+        load_entry_points()
+    if name not in registry:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    target = registry[name]
+    if isinstance(target, str):
+        module_name, _, attribute = target.partition(':')
+        target = getattr(importlib.import_module(module_name), attribute)
+    globals()[name] = target
+    return target
+
+
+def __dir__():
+    load_entry_points()
+    return sorted(set(globals()) | set(registry))
@@ -0,0 +1,78 @@
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+# blocking transport calls run on a shared pool of this many threads unless an executor is given
+max_workers = 8
+
+_executor = None
+# event loop -> {instrument session: asyncio.Lock}, an asyncio.Lock only works on the loop it was first used on
+_locks = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='electronics_lab')
+    return _executor
+
+
+def _instrument_lock(instrument):
+    """Returns the asyncio lock shared by every AsyncDriver talking to this instrument session on the running loop"""
+    locks = _locks.get(asyncio.get_running_loop())
+    if locks is None:
+        locks = _locks[asyncio.get_running_loop()] = weakref.WeakKeyDictionary()
+    lock = locks.get(instrument)
+    if lock is None:
+        lock = locks[instrument] = asyncio.Lock()
+    return lock
+
+
+class AsyncDriver:
+    """Awaitable wrapper around a blocking driver
+
+    Calls on one instrument session are serialized, calls on different
+    instruments run in parallel on the executor, e.g.
+
+        dmm, supply = AsyncDriver(SiglentSDM3055(...)), AsyncDriver(SiglentSPD3303X(...))
+        volts, amps = await asyncio.gather(dmm.get_measurement(), supply.get_measurement(1, supply.current))
+    """
+
+    def __init__(self, driver, executor=None):
+        self.driver = driver
+        self.executor = executor
+
+    # pooled sessions outlive an asyncio.run(), so the lock is looked up per loop on every call
+    @property
+    def lock(self):
+        return _instrument_lock(self.driver.instrument)
+
+    @classmethod
+    async def open(cls, driver_class, *args, **kwargs):
+        """Constructs driver_class(*args, **kwargs) on the executor, opening the session without blocking"""
+        executor = kwargs.pop('executor', None)
+        loop = asyncio.get_running_loop()
+        driver = await loop.run_in_executor(executor or get_executor(),
+                                            functools.partial(driver_class, *args, **kwargs))
+        return cls(driver, executor)
+
+    async def call(self, method, *args, **kwargs):
+        function = functools.partial(getattr(self.driver, method), *args, **kwargs)
+        async with self.lock:
+            return await asyncio.get_running_loop().run_in_executor(self.executor or get_executor(), function)
+
+    async def get_measurement(self, *args, **kwargs):
+        return await self.call('get_measurement', *args, **kwargs)
+
+    async def set_param(self, *args, **kwargs):
+        return await self.call('set_param', *args, **kwargs)
+
+    # every other driver method is awaitable as well, measurement definitions and settings pass through
+    def __getattr__(self, name):
+        if name == 'driver':
+            raise AttributeError(name)
+        attribute = getattr(self.driver, name)
+        if not callable(attribute) or isinstance(attribute, type):
+            return attribute
+        return functools.partial(self.call, name)
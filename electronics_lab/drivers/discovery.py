@@ -0,0 +1,265 @@
+"""Finds instruments by *IDN? and opens them by serial number
+
+Scanning asks every VISA resource and every given LAN host for *IDN? on a
+thread pool with short timeouts, so a scan takes about as long as the
+slowest instrument rather than the sum of all of them. The identities are
+kept in a JSON file, a later run opens an instrument from the file without
+scanning until the entry is older than ttl, e.g.
+
+    scope = open_instrument('DS1ZA000000001')
+    supply = Discovery(hosts=['192.168.1.0/24']).open('SPD3XIDD000000')
+
+Opening checks the serial number again, an instrument that moved to
+another address is found by a new scan.
+"""
+
+import importlib
+import ipaddress
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .session import get_resource_manager, is_connection_error, pool, transport_opener
+
+log = logging.getLogger('electronics_lab.drivers')
+
+# VXI-11 finds the instrument's core channel through the portmapper on this port
+portmapper_port = 111
+
+# (regular expression matched against the *IDN? model field, registry name of the driver)
+driver_patterns = [
+    (r'DS1\d{3}Z', 'RigolDS1054z'),
+    (r'SDM30\d5', 'SiglentSDM3055'),
+    (r'SPD3303X', 'SiglentSPD3303X'),
+    (r'SDG10\d2X', 'SiglentSDG1032X'),
+]
+
+
+def default_cache_file():
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'electronics_lab', 'instruments.json')
+
+
+def parse_idn(reply):
+    """Returns (manufacturer, model, serial, firmware) of an *IDN? reply"""
+    fields = [field.strip() for field in reply.strip().split(',')]
+    fields += [''] * (4 - len(fields))
+    return fields[0], fields[1], fields[2], ','.join(fields[3:])
+
+
+def driver_for(model):
+    """Returns the registry name of the driver for an *IDN? model, or None"""
+    for pattern, name in driver_patterns:
+        if re.match(pattern, model, re.IGNORECASE):
+            return name
+    return None
+
+
+def expand_hosts(hosts):
+    """Returns the addresses of hosts given as names, addresses or networks such as '192.168.1.0/24'"""
+    addresses = []
+    for host in hosts:
+        try:
+            network = ipaddress.ip_network(host, strict=False)
+        except ValueError:
+            addresses.append(host)
+            continue
+        addresses.extend(str(address) for address in (network.hosts() if network.num_addresses > 1 else network))
+    return addresses
+
+
+class Identity(namedtuple('Identity', 'serial model manufacturer firmware driver resource transport seen')):
+    """One instrument found by a scan, seen is time.time() when it answered *IDN?
+
+    transport is 'visa' for a VISA resource string and 'vxi11' for a LAN
+    host, resource is what was probed.
+    """
+    __slots__ = ()
+
+    def resource_for(self, transport):
+        """Returns the resource string a driver using transport opens"""
+        if self.transport == 'vxi11' and transport == 'visa':
+            return 'TCPIP0::{}::INSTR'.format(self.resource)
+        return self.resource
+
+
+class Discovery(object):
+    """Scans for instruments and opens them by serial number
+
+    resources are probed through their transport, e.g. 'SIM::DS1054Z',
+    in addition to the VISA resource manager's list when visa is set.
+    timeout is the per instrument limit in seconds for connecting and for
+    the *IDN? reply.
+    """
+
+    def __init__(self, hosts=(), resources=(), visa=True, cache_file=None, ttl=24 * 3600.0, timeout=1.0,
+                 max_workers=32):
+        self.hosts = list(hosts)
+        self.resources = list(resources)
+        self.visa = visa
+        self.cache_file = cache_file or default_cache_file()
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.scans = 0
+        self.identities = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Reads the cached identities, entries older than ttl are dropped"""
+        try:
+            with open(self.cache_file) as fid:
+                entries = json.load(fid).get('instruments', {})
+        except (OSError, ValueError):
+            entries = {}
+        now = time.time()
+        with self.lock:
+            self.identities = dict((serial, Identity(**entry)) for serial, entry in entries.items()
+                                   if now - entry.get('seen', 0) < self.ttl)
+
+    def save(self):
+        directory = os.path.dirname(self.cache_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self.lock:
+            entries = dict((serial, identity._asdict()) for serial, identity in self.identities.items())
+        # written under a temporary name so a crash never leaves a truncated cache behind
+        with open(self.cache_file + '.part', 'w') as fid:
+            json.dump({'version': 1, 'instruments': entries}, fid, indent=2, sort_keys=True)
+        os.replace(self.cache_file + '.part', self.cache_file)
+
+    def candidates(self):
+        """Returns the (resource, transport) pairs a scan probes"""
+        found = [(resource, 'visa') for resource in self.resources]
+        if self.visa:
+            try:
+                found += [(resource, 'visa') for resource in get_resource_manager().list_resources('?*::INSTR')
+                          if resource not in self.resources]
+            except Exception:
+                log.exception("Listing VISA resources failed")
+        found += [(host, 'vxi11') for host in expand_hosts(self.hosts)]
+        return found
+
+    def scan(self):
+        """Probes every candidate in parallel, updates and saves the cache, returns the Identities found"""
+        candidates = self.candidates()
+        self.scans += 1
+        if not candidates:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(candidates)),
+                                thread_name_prefix='electronics_lab-discovery') as executor:
+            found = [identity for identity in executor.map(lambda candidate: self.probe(*candidate), candidates)
+                     if identity is not None]
+        with self.lock:
+            for identity in found:
+                self.identities[identity.serial] = identity
+        self.save()
+        return found
+
+    def probe(self, resource, transport='visa'):
+        """Returns the Identity answering *IDN? on resource, or None when nothing answers within timeout"""
+        # an instrument a driver holds open is asked on its session, a second connection may be refused
+        session = pool.sessions.get(resource)
+        try:
+            instrument = session if session is not None else self._open(resource, transport)
+        except Exception as error:
+            log.debug("No instrument at %s: %s", resource, error)
+            return None
+        try:
+            reply = instrument.ask('*IDN?') if transport == 'vxi11' else instrument.query('*IDN?')
+        except Exception as error:
+            log.debug("No *IDN? reply from %s: %s", resource, error)
+            return None
+        finally:
+            try:
+                if session is None:
+                    instrument.close()
+            except Exception:
+                pass
+        manufacturer, model, serial, firmware = parse_idn(reply)
+        if not serial:
+            return None
+        return Identity(serial, model, manufacturer, firmware, driver_for(model), resource, transport, time.time())
+
+    def _open(self, resource, transport):
+        opener = transport_opener(resource)
+        if opener is not None:
+            return opener(resource)
+        if transport == 'vxi11':
+            # a host without a portmapper is refused within timeout, vxi11 itself would wait for its own
+            socket.create_connection((resource, portmapper_port), timeout=self.timeout).close()
+            import vxi11
+            instrument = vxi11.Instrument(resource)
+            instrument.timeout = self.timeout
+            return instrument
+        milliseconds = int(self.timeout * 1000)
+        instrument = get_resource_manager().open_resource(resource, open_timeout=milliseconds)
+        instrument.timeout = milliseconds
+        return instrument
+
+    def find(self, serial=None, model=None):
+        """Returns the Identity with the serial number or model, scanning only when the cache has none"""
+        for attempt in range(2):
+            with self.lock:
+                for identity in self.identities.values():
+                    if (serial is None or identity.serial == serial) and (
+                            model is None or re.match(model, identity.model, re.IGNORECASE)):
+                        return identity
+            if attempt == 0:
+                self.scan()
+        raise LookupError("No instrument with serial {!r} and model {!r} found".format(serial, model))
+
+    def forget(self, serial):
+        with self.lock:
+            self.identities.pop(serial, None)
+
+    def open(self, serial=None, model=None, driver=None, **kwargs):
+        """Returns a driver for the instrument with the serial number or model, kwargs go to the driver
+
+        driver is the class to use when the model has none in driver_patterns.
+        """
+        for attempt in range(2):
+            identity = self.find(serial, model)
+            cls = driver or self.driver_class(identity)
+            instrument = None
+            try:
+                instrument = cls(identity.resource_for(getattr(cls, 'transport', 'visa')), **kwargs)
+                answered = parse_idn(instrument.query('*IDN?'))[2]
+            except Exception as error:
+                # an instrument that was opened but failed the check is not handed out, so it is closed here
+                if instrument is not None:
+                    try:
+                        instrument.close()
+                    except Exception:
+                        log.debug("Closing %s failed", identity.resource, exc_info=True)
+                if not is_connection_error(error) or attempt:
+                    raise
+                answered = None
+            if answered == identity.serial:
+                return instrument
+            if answered is not None:
+                instrument.close()
+            if attempt:
+                break
+            # the address now belongs to another instrument or none at all
+            log.info("Instrument %s moved from %s, scanning again", identity.serial, identity.resource)
+            self.forget(identity.serial)
+            self.scan()
+        raise LookupError("Instrument {} did not answer at {}".format(identity.serial, identity.resource))
+
+    def driver_class(self, identity):
+        if identity.driver is None:
+            raise LookupError("No driver known for {} {}, pass driver=".format(identity.manufacturer, identity.model))
+        return getattr(importlib.import_module('electronics_lab.drivers'), identity.driver)
+
+
+def open_instrument(serial=None, model=None, hosts=(), **kwargs):
+    """Opens an instrument by serial number or model with the default cache file, see Discovery.open"""
+    return Discovery(hosts=hosts).open(serial, model, **kwargs)
@@ -1,20 +1,277 @@
-import visa
+import contextlib
+import logging
+import time
+from collections import namedtuple
+from .session import pool
+from .state import StateCache
+
+log = logging.getLogger('electronics_lab.drivers')
+
+# callables given (driver, reading) for every reading a driver logs, e.g. a datalog.DataLogger
+sinks = []
+
+
+class InstrumentTimeout(Exception):
+    pass
+
+
+class Reading(namedtuple('Reading', 'name value unit channel timestamp')):
+    """One measurement result, timestamp is time.time() when the reply arrived"""
+    __slots__ = ()
+
+    def __float__(self):
+        return float(self.value)
+
+    def __str__(self):
+        if self.channel is None:
+            return "{} value is {} {}".format(self.name, self.value, self.unit or '')
+        return "Channel {} {} value is {} {}".format(self.channel, self.name, self.value, self.unit or '')
+
+
+# parsers take the reply text and the channel it was measured on, looked up by Measurement.return_type
+parsers = {
+    'float': lambda text, channel: float(text),
+    'int': lambda text, channel: int(float(text)),
+    'str': lambda text, channel: text.strip(),
+    'string': lambda text, channel: text.strip(),
+}
+
+
+class Measurement(namedtuple('Measurement', 'name description command unit return_type template parser')):
+    """Immutable measurement definition
+
+    template is the SCPI query, {command} is filled in once when the
+    measurement is defined and {channel} on every query. The parser comes
+    from parsers unless one is given.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name='', description='', command='', unit='', return_type='', template='', parser=None):
+        template = template.replace('{command}', command)
+        return super(Measurement, cls).__new__(cls, name, description, command, unit, return_type, template,
+                                               parser or parsers[return_type])
+
+    def query(self, channel=None):
+        return self.template.format(channel=channel)
+
+    def parse(self, text, channel=None):
+        return self.parser(text, channel)
+
+    def reading(self, text, channel=None):
+        return Reading(self.name, self.parser(text, channel), self.unit, channel, time.time())
+
+
+# IEEE 488.2 definite length blocks, #<number of length digits><length><payload>, carry every bulk transfer
+
+def block_header(length):
+    """Returns the header of a definite length block of length bytes, e.g. b'#41200'"""
+    digits = str(int(length))
+    return ('#' + str(len(digits)) + digits).encode()
+
+
+def block_span(data):
+    """Returns (start, stop) of the payload of the block data starts with, data is bytes or str"""
+    marker, digits = data[0:1], data[1:2]
+    if marker not in ('#', b'#') or not digits.isdigit() or int(digits) == 0:
+        raise ValueError("Not a definite length block: {!r}".format(data[:12]))
+    start = 2 + int(digits)
+    stop = start + int(data[2:start])
+    if stop > len(data):
+        raise ValueError("Block of {} bytes is cut off after {}".format(stop - start, len(data) - start))
+    return start, stop
+
+
+def block_payload(data):
+    """Returns a memoryview of the payload of the block in data, nothing is copied"""
+    start, stop = block_span(data)
+    return memoryview(data)[start:stop]
 
 
 class Driver:
+    # polling starts at poll_interval seconds and backs off by backoff_factor up to max_poll_interval
+    poll_interval = 0.005
+    max_poll_interval = 0.25
+    backoff_factor = 2.0
+
+    # longest ';' joined message sent by batch()
+    max_message_length = 512
 
+    # bytes requested per read of a binary block
+    stream_chunk_size = 1024 * 1024
+
+    # 'visa' drivers open VISA resource strings, 'vxi11' drivers a LAN host, see discovery.Identity.resource_for
+    transport = 'visa'
+
+    # sessions come from the process wide pool, so constructing a driver again reuses the open connection
     def __init__(self, resource_string, debug=False):
-        resources = visa.ResourceManager()
-        self.instrument = resources.open_resource(resource_string)
+        self.instrument = pool.acquire(resource_string)
         self.debug = debug
 
+    def close(self):
+        """Releases the pooled session, electronics_lab.drivers.session.pool.close_idle() closes it"""
+        pool.release(self.instrument)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def print_info(self):
         print("Instrument information: {}".format(self.instrument.query('*IDN?')))
 
-    class Measurement:
-        def __init__(self, name='', description='', command='', unit='', return_type=''):
-            self.name = name
-            self.description = description
-            self.command = command
-            self.unit = unit
-            self.return_type = return_type
+    # a command and the reads answering it must not interleave with another thread using the same session
+    def transaction(self):
+        """Returns a context manager holding the session lock, e.g. with scope.transaction(): ..."""
+        lock = getattr(self.instrument, 'lock', None)
+        return lock if lock is not None else contextlib.nullcontext()
+
+    def query(self, command):
+        return self.instrument.query(command)
+
+    # errors raised by condition are retried when ignore_errors is set, e.g. while the instrument reboots
+    def wait_until(self, condition, timeout=10.0, description='instrument', ignore_errors=False):
+        """Polls condition() with exponential backoff until it is true, raises InstrumentTimeout otherwise"""
+        deadline = time.monotonic() + timeout
+        interval = self.poll_interval
+        while True:
+            try:
+                if condition():
+                    return
+            except Exception:
+                if not ignore_errors:
+                    raise
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise InstrumentTimeout("Timed out after {} s waiting for {}".format(timeout, description))
+            time.sleep(min(interval, remaining))
+            interval = min(interval * self.backoff_factor, self.max_poll_interval)
+
+    # with opc set the last message ends in *OPC?, so the block returns once the instrument applied the batch
+    @contextlib.contextmanager
+    def batch(self, opc=False, max_message_length=None):
+        """Collects writes into ';' joined messages, sent before the next query and when the block ends"""
+        begin_batch = getattr(self.instrument, 'begin_batch', None)
+        with self.transaction():
+            started = begin_batch is not None and begin_batch(max_message_length or self.max_message_length)
+            try:
+                yield self
+            except BaseException:
+                if started:
+                    self.instrument.end_batch(discard=True)
+                    # the discarded settings are in the cache already
+                    self.invalidate()
+                raise
+            if started:
+                if opc:
+                    self.instrument.write('*OPC?')
+                self.instrument.end_batch()
+                if opc:
+                    self.instrument.read()
+            elif opc and begin_batch is None:
+                self.wait_for_opc()
+
+    @property
+    def cache(self):
+        """StateCache of the settings written through write_setting, shared by every driver on the session"""
+        cache = getattr(self.instrument, 'cache', None)
+        if not isinstance(cache, StateCache):
+            # instruments opened outside the pool keep the cache on the driver
+            cache = self.__dict__.get('_cache')
+            if cache is None:
+                cache = self._cache = StateCache()
+        return cache
+
+    def setting_command(self, key, value):
+        return key + ' ' + str(value)
+
+    def write_setting(self, key, value):
+        """Sends the setting unless the instrument already has it, returns True if it was sent"""
+        cache = self.cache
+        with self.transaction():
+            if cache.matches(key, value):
+                cache.skipped += 1
+                return False
+            self.instrument.write(self.setting_command(key, value))
+            cache.set(key, value)
+            cache.written += 1
+            cache.digest = None
+        return True
+
+    def read_setting(self, key):
+        return self.query(key + '?').strip()
+
+    def configure(self, profile):
+        """Brings the instrument to profile, {key: value}, sending only the settings that differ, returns those keys"""
+        return [key for key, value in profile.items() if self.write_setting(key, value)]
+
+    # the front panel changes settings behind the cache, resync reads back what the cache holds
+    def resync(self, keys=None):
+        """Re-reads keys (default every cached setting) from the instrument, returns the keys that had changed"""
+        cache = self.cache
+        changed = []
+        with self.transaction():
+            for key in list(cache.values) if keys is None else keys:
+                value = self.read_setting(key)
+                if not cache.matches(key, value):
+                    changed.append(key)
+                cache.set(key, value)
+        return changed
+
+    def invalidate(self, key=None):
+        """Forgets a cached setting, or all of them, so the next write_setting sends it"""
+        self.cache.invalidate(key)
+
+    def operation_complete(self):
+        return self.query('*OPC?').strip() == '1'
+
+    def wait_for_opc(self, timeout=10.0, ignore_errors=False):
+        self.wait_until(self.operation_complete, timeout, 'operation complete', ignore_errors)
+
+    # one read_raw per block keeps it to one round trip, out is e.g. a row of a preallocated capture buffer
+    def read_block(self, out=None):
+        """Reads a definite length block reply, returns a memoryview of its payload, copied into out when given"""
+        payload = block_payload(self.instrument.read_raw())
+        if out is None:
+            return payload
+        view = memoryview(out).cast('B')
+        if len(payload) > len(view):
+            raise ValueError("Block of {} bytes does not fit a {} byte buffer".format(len(payload), len(view)))
+        view[:len(payload)] = payload
+        return view[:len(payload)]
+
+    # for blocks too large to hold twice, e.g. a deep memory waveform or settings streamed to a file
+    def iter_block(self):
+        """Reads a definite length block reply and yields its payload in chunks of up to stream_chunk_size bytes"""
+        remaining = self._read_block_header()
+        while remaining > 0:
+            chunk = self.instrument.read_bytes(min(remaining, self.stream_chunk_size))
+            if not chunk:
+                raise InstrumentTimeout("Block ended with {} bytes missing".format(remaining))
+            remaining -= len(chunk)
+            yield chunk
+        self.instrument.read_bytes(1)
+
+    def _read_block_header(self):
+        header = self.instrument.read_bytes(2)
+        if header[:1] != b'#' or not header[1:2].isdigit() or header[1:2] == b'0':
+            raise ValueError("Not a definite length block: {!r}".format(header))
+        return int(self.instrument.read_bytes(int(header[1:2])))
+
+    def write_block(self, command, payload):
+        """Sends command followed by payload, bytes or a contiguous numpy array, as a definite length block"""
+        data = memoryview(payload).cast('B')
+        # one join copies the payload into the message, no per-byte conversion
+        self.instrument.write_raw(b''.join((command.encode(), block_header(len(data)), data, b'\n')))
+
+    def format_reading(self, reading):
+        return str(reading)
+
+    # readings are only formatted when INFO logging is enabled for electronics_lab
+    def log_reading(self, reading):
+        for sink in sinks:
+            sink(self, reading)
+        if log.isEnabledFor(logging.INFO):
+            log.info(self.format_reading(reading))
+
+    Measurement = Measurement
@@ -0,0 +1,224 @@
+"""Opt-in timing of every SCPI transaction made through a pooled session
+
+Nothing is recorded until enable() is called, sessions then report each
+write, query and read to the recorder, e.g.
+
+    recorder = instrumentation.enable()
+    scope.get_measurements(channels=(1, 2))
+    print(recorder.to_prometheus())
+
+Reads are attributed to the command last written on the same session, so
+the time spent in read_raw after ':WAV:DATA?' shows up under ':WAV:DATA?'.
+Writes, queries and reads are kept apart by an operation label, so the
+percentiles of each are those of one kind of call rather than a mix.
+"""
+
+import json
+import threading
+import time
+
+from . import session
+
+# transport methods by what they do, anything else is passed through untimed
+write_methods = ('write', 'write_raw', 'write_ascii_values', 'write_binary_values')
+query_methods = ('query', 'ask', 'ask_raw', 'query_ascii_values', 'query_binary_values')
+read_methods = ('read', 'read_raw', 'read_bytes', 'read_ascii_values', 'read_binary_values')
+
+
+def mnemonic(command):
+    """Returns the header of the first command in a message, e.g. ':MEAS:ITEM?' for ':MEAS:ITEM? VMAX,CHAN1'"""
+    if isinstance(command, (bytes, bytearray)):
+        command = bytes(command[:64]).decode('latin-1')
+    words = command.split(';', 1)[0].split(None, 1)
+    return words[0] if words else ''
+
+
+def payload_size(value):
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    return 0
+
+
+class LatencyHistogram(object):
+    """Log-linear histogram of durations in microseconds, HDR style
+
+    Values below 2**significant_bits are counted exactly, larger values go
+    into buckets 2**-(significant_bits - 1) wide relative to their size, so
+    any percentile is within 1.6% for the default of 7 bits.
+    """
+
+    def __init__(self, significant_bits=7):
+        self.significant_bits = significant_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket(self, microseconds):
+        shift = max(microseconds.bit_length() - self.significant_bits, 0)
+        return shift, microseconds >> shift
+
+    def record(self, seconds):
+        microseconds = int(round(seconds * 1e6))
+        key = self.bucket(microseconds)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percent):
+        """Returns the duration in seconds below which percent of the recorded values fall"""
+        if not self.count:
+            return 0.0
+        if percent >= 100:
+            return self.max
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for shift, mantissa in sorted(self.counts):
+            seen += self.counts[(shift, mantissa)]
+            if seen >= rank:
+                # middle of the bucket, clamped to the exact extremes
+                value = ((mantissa << shift) + ((1 << shift) - 1) / 2.0) * 1e-6
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class CommandStats(object):
+    """Latency histogram, traffic and error count of one command on one instrument"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.errors = 0
+
+    def as_dict(self, percentiles):
+        summary = {'count': self.latency.count, 'errors': self.errors, 'bytes_out': self.bytes_out,
+                   'bytes_in': self.bytes_in, 'total_seconds': self.latency.total, 'mean_seconds': self.latency.mean,
+                   'min_seconds': self.latency.min or 0.0, 'max_seconds': self.latency.max or 0.0}
+        for percent in percentiles:
+            summary['p{:g}_seconds'.format(percent)] = self.latency.percentile(percent)
+        return summary
+
+
+class Recorder(object):
+    """Collects CommandStats keyed by (resource string, command mnemonic, operation)
+
+    operation is 'write', 'query' or 'read', see write_methods, query_methods and read_methods.
+    """
+
+    percentiles = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        self.stats = {}
+        self.last_command = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def call(self, instrument_session, name, args, kwargs):
+        """Runs a transport method on the session and records it"""
+        if name in read_methods:
+            operation = 'read'
+            with self.lock:
+                command = self.last_command.get(instrument_session.key, '')
+        elif name in write_methods or name in query_methods:
+            operation = 'write' if name in write_methods else 'query'
+            command = mnemonic(args[0]) if args else ''
+            with self.lock:
+                self.last_command[instrument_session.key] = command
+        else:
+            return instrument_session._call(name, args, kwargs)
+        key = (instrument_session.key, command, operation)
+        bytes_out = sum(payload_size(argument) for argument in args)
+        started = time.perf_counter()
+        try:
+            result = instrument_session._call(name, args, kwargs)
+        except Exception:
+            self.record(key, time.perf_counter() - started, bytes_out, 0, error=True)
+            raise
+        self.record(key, time.perf_counter() - started, bytes_out, payload_size(result))
+        return result
+
+    def record(self, key, seconds, bytes_out=0, bytes_in=0, error=False):
+        """Adds one call to the stats of key, (resource, command, operation)"""
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = CommandStats()
+            stats.latency.record(seconds)
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.errors += bool(error)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Returns {resource: {command: {operation: summary}}} for every command seen since the last reset"""
+        with self.lock:
+            items = sorted(self.stats.items())
+            snapshot = {}
+            for (resource, command, operation), stats in items:
+                commands = snapshot.setdefault(resource, {})
+                commands.setdefault(command, {})[operation] = stats.as_dict(self.percentiles)
+        return snapshot
+
+    def to_json(self, **kwargs):
+        return json.dumps({'started': self.started, 'resources': self.snapshot()}, **kwargs)
+
+    # every metric family is one block of samples after its HELP and TYPE lines, as the format requires
+    def to_prometheus(self, prefix='electronics_lab_scpi'):
+        """Returns the snapshot in the Prometheus text exposition format"""
+        samples = []
+        for resource, commands in self.snapshot().items():
+            for command, operations in commands.items():
+                for operation, summary in operations.items():
+                    labels = 'resource="{}",command="{}",operation="{}"'.format(
+                        _escape(resource), _escape(command), operation)
+                    samples.append((labels, summary))
+        lines = ['# HELP {}_latency_seconds Duration of one SCPI write, query or read'.format(prefix),
+                 '# TYPE {}_latency_seconds summary'.format(prefix)]
+        for labels, summary in samples:
+            for percent in self.percentiles:
+                lines.append('{}_latency_seconds{{{},quantile="{:g}"}} {!r}'.format(
+                    prefix, labels, percent / 100.0, summary['p{:g}_seconds'.format(percent)]))
+            lines.append('{}_latency_seconds_sum{{{}}} {!r}'.format(prefix, labels, summary['total_seconds']))
+            lines.append('{}_latency_seconds_count{{{}}} {}'.format(prefix, labels, summary['count']))
+        for name, field, description in (('bytes_sent_total', 'bytes_out', 'Bytes sent to the instrument'),
+                                         ('bytes_received_total', 'bytes_in', 'Bytes received from the instrument'),
+                                         ('errors_total', 'errors', 'Calls that raised')):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, description))
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            for labels, summary in samples:
+                lines.append('{}_{}{{{}}} {}'.format(prefix, name, labels, summary[field]))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def enable(recorder=None):
+    """Starts recording every session call, returns the recorder"""
+    session.recorder = recorder or session.recorder or Recorder()
+    return session.recorder
+
+
+def disable():
+    """Stops recording, returns the recorder so its data can still be exported"""
+    recorder, session.recorder = session.recorder, None
+    return recorder
+
+
+def get_recorder():
+    return session.recorder
@@ -3,102 +3,140 @@ https://github.com/charkster/rigol_ds1054z
 '''
 
 import datetime
-import time
+import hashlib
+import json
 import re
+import time
 from math import floor, log10
-from .driver import Driver
+import numpy as np
+from ..analysis import WaveformAnalysis
+from .driver import Driver, InstrumentTimeout
 
 
 class RigolDS1054z(Driver):
+    # {channel} is a channel number, or a (source1, source2) tuple for the double source items
+    item_query = ':MEAS:ITEM? {command},CHAN{channel}'
+    double_item_query = ':MEAS:ITEM? {command},CHAN{channel[0]},CHAN{channel[1]}'
+
     max_voltage = Driver.Measurement(name='max_voltage', command='VMAX', unit='Volts', return_type='float',
+                                     template=item_query,
                                      description='voltage value from the highest point of the waveform to the GND')
     min_voltage = Driver.Measurement(name='min_voltage', command='VMIN', unit='Volts', return_type='float',
+                                     template=item_query,
                                      description='voltage value from the lowest point of the waveform to the GND')
     peak_to_peak_voltage = Driver.Measurement(name='peak_to_peak_voltage', command='VPP', unit='Volts',
+                                              template=item_query,
                                               return_type='float',
                                               description='voltage value from the highest point to the lowest'
                                                           'point of the waveform')
     top_voltage = Driver.Measurement(name='top_voltage', command='VTOP', unit='Volts', return_type='float',
+                                     template=item_query,
                                      description='voltage value from the flat top of the waveform to the GND')
     base_voltage = Driver.Measurement(name='base_voltage', command='VBAS', unit='Volts', return_type='float',
+                                      template=item_query,
                                       description='voltage value from the flat base of the waveform to the GND')
     top_to_base_voltage = Driver.Measurement(name='top_to_base_voltage', command='VAMP', unit='Volts',
+                                             template=item_query,
                                              return_type='float',
                                              description='voltage value from the top of the waveform to'
                                                          'the base of the waveform')
     average_voltage = Driver.Measurement(name='average_voltage', command='VAVG', unit='Volts', return_type='float',
+                                         template=item_query,
                                          description='arithmetic average value on the whole waveform or'
                                                      'on the gating area')
     rms_voltage = Driver.Measurement(name='rms_voltage', command='VRMS', unit='Volts', return_type='float',
+                                     template=item_query,
                                      description='root mean square value on the whole waveform or the gating area')
     upper_voltage = Driver.Measurement(name='upper_voltage', command='VUP', unit='Volts', return_type='float',
+                                       template=item_query,
                                        description='actual voltage value corresponding to the threshold maximum value')
     mid_voltage = Driver.Measurement(name='mid_voltage', command='VMID', unit='Volts', return_type='float',
+                                     template=item_query,
                                      description='actual voltage value corresponding to the threshold middle value')
     lower_voltage = Driver.Measurement(name='lower_voltage', command='VLOW', unit='Volts', return_type='float',
+                                       template=item_query,
                                        description='actual voltage value corresponding to the threshold minimum value')
     overshoot_voltage = Driver.Measurement(name='overshoot_percent', command='OVER', unit='%', return_type='float',
+                                           template=item_query,
                                            description='ratio of the difference of the maximum value and top'
                                                        'value of the waveform to the amplitude value')
     preshoot_voltage = Driver.Measurement(name='preshoot_percent', command='PRES', unit='%', return_type='float',
+                                          template=item_query,
                                           description='ratio of the difference of the minimum value and base '
                                                       'value of the waveform to the amplitude value')
     variance_voltage = Driver.Measurement(name='variance_voltage', command='VARI', unit='Volts', return_type='float',
+                                          template=item_query,
                                           description='average of the sum of the squares for the difference '
                                                       'between the amplitude value of each waveform point and '
                                                       'the waveform average value on the whole waveform or'
                                                       'on the gating area')
     period_rms_voltage = Driver.Measurement(name='period_rms_voltage', command='PVRMS', unit='Volts',
+                                            template=item_query,
                                             return_type='float',
                                             description='root mean square value within a period of the waveform')
     period_time = Driver.Measurement(name='period_time', command='PER', unit='Seconds', return_type='float',
+                                     template=item_query,
                                      description='time between the middle threshold points of two consecutive, '
                                                  'like-polarity edges')
     frequency = Driver.Measurement(name='frequency', command='FREQ', unit='Hz', return_type='float',
+                                   template=item_query,
                                    description='reciprocal of period')
     rise_time = Driver.Measurement(name='rise_time', command='RTIM', unit='Seconds', return_type='string',
+                                   template=item_query,
                                    description='time for the signal amplitude to rise from the threshold '
                                                'lower limit to the threshold upper limit')
     fall_time = Driver.Measurement(name='fall_time', command='FTIM', unit='Seconds', return_type='string',
+                                   template=item_query,
                                    description='time for the signal amplitude to fall from the threshold '
                                                'upper limit to the threshold lower limit')
     positive_width_time = Driver.Measurement(name='positive_width_time', command='PWID', unit='Seconds',
+                                             template=item_query,
                                              return_type='float',
                                              description='time difference between the threshold middle '
                                                          'value of a rising edge and the threshold middle '
                                                          'value of the next falling edge of the pulse')
     negative_width_time = Driver.Measurement(name='negative_width_time', command='NWID', unit='Seconds',
+                                             template=item_query,
                                              return_type='float',
                                              description='time difference between the threshold middle value '
                                                          'of a falling edge and the threshold middle '
                                                          'value of the next rising edge of the pulse')
     positive_duty_percent = Driver.Measurement(name='positive_duty_ratio', command='PDUT', unit='%',
+                                               template=item_query,
                                                return_type='float',
                                                description='ratio of the positive pulse width to the period')
     negative_duty_percent = Driver.Measurement(name='negative_duty_ratio', command='NDUT', unit='%',
+                                               template=item_query,
                                                return_type='float',
                                                description='ratio of the negative pulse width to the period')
     max_voltage_time = Driver.Measurement(name='max_voltage_time', command='TVMAX', unit='Seconds', return_type='float',
+                                          template=item_query,
                                           description='time corresponding to the waveform maximum value')
     min_voltage_time = Driver.Measurement(name='min_voltage_time', command='TVMIN', unit='Seconds', return_type='float',
+                                          template=item_query,
                                           description='time corresponding to the waveform minimum value')
     positive_pulse_number = Driver.Measurement(name='positive_pulse_number', command='PPUL', unit='Occurances',
+                                               template=item_query,
                                                return_type='int',
                                                description='number of positive pulses that rise from below the '
                                                            'threshold lower limit to above the threshold upper limit')
     negative_pulse_number = Driver.Measurement(name='negative_pulse_number', command='NPUL', unit='Occurances',
+                                               template=item_query,
                                                return_type='int',
                                                description='number of negative pulses that fall from above the '
                                                            'threshold upper limit to below the threshold lower limit')
     positive_edges_number = Driver.Measurement(name='positive_edges_number', command='PEDG', unit='Occurances',
+                                               template=item_query,
                                                return_type='int',
                                                description='number of rising edges that rise from below the threshold '
                                                            'lower limit to above the threshold upper limit')
     negative_edges_number = Driver.Measurement(name='negative_edges_number', command='NEDG', unit='Occurances',
+                                               template=item_query,
                                                return_type='int',
                                                description='number of falling edges that fall from above the threshold '
                                                            'upper limit to below the threshold lower limit')
     rising_delay_time = Driver.Measurement(name='rising_delay_time', command='RDEL', unit='Seconds',
+                                           template=double_item_query,
                                            return_type='string',
                                            description='time difference between the falling edges of'
                                                        'source 1 and source 2. '
@@ -106,6 +144,7 @@ class RigolDS1054z(Driver):
                                                        'edge of source 1 '
                                                        'occurred after that of source 2')
     falling_delay_time = Driver.Measurement(name='falling_delay_time', command='FDEL', unit='Seconds',
+                                            template=double_item_query,
                                             return_type='string',
                                             description='time difference between the falling edges'
                                                         'of source 1 and source 2. '
@@ -113,26 +152,32 @@ class RigolDS1054z(Driver):
                                                         'falling edge of source 1 '
                                                         'occurred after that of source 2')
     rising_phase_ratio = Driver.Measurement(name='rising_phase_ratio', command='RPH', unit='Degrees',
+                                            template=double_item_query,
                                             return_type='float',
                                             description='rising_delay_time / period_time x 360 degrees')
     falling_phase_ratio = Driver.Measurement(name='falling_phase_ratio', command='FPH', unit='Degrees',
+                                             template=double_item_query,
                                              return_type='float',
                                              description='falling_delay_time / period_time x 360 degrees')
     positive_slew_rate = Driver.Measurement(name='positive_slew_rate', command='PSLEW', unit='Volts / Second',
+                                            template=item_query,
                                             return_type='float',
                                             description='divide the difference of the upper value'
                                                         'and lower value on the '
                                                         'rising edge by the corresponding time')
     negative_slew_rate = Driver.Measurement(name='negative_slew_rate', command='NSLEW', unit='Volts / Second',
+                                            template=item_query,
                                             return_type='float',
                                             description='divide the difference of the lower value'
                                                         'and upper value on the '
                                                         'falling edge by the corresponding time')
     waveform_area = Driver.Measurement(name='waveform_area', command='MAR', unit='Volt Seconds', return_type='float',
+                                       template=item_query,
                                        description='algebraic sum of the area of the whole waveform within the screen. '
                                                    'area of the waveform above the zero reference is positive and the '
                                                    'area of the waveform below the zero reference is negative')
     first_period_area = Driver.Measurement(name='first_period_area', command='MPAR', unit='Volt Seconds',
+                                           template=item_query,
                                            return_type='float',
                                            description='algebraic sum of the area of the first period of the waveform '
                                                        'on the screen. area of the waveform above'
@@ -154,6 +199,20 @@ class RigolDS1054z(Driver):
 
     double_measurement_list = [rising_phase_ratio, falling_phase_ratio, rising_delay_time, falling_delay_time]
 
+    # bytes of the scope's input buffer, every message sent to it has to fit
+    input_buffer_size = 256
+    # longest ';' joined message sent by batch(), the write termination takes the last byte
+    max_message_length = input_buffer_size - 1
+    # largest number of ;-joined :MEAS:ITEM? queries get_measurements sends in one message,
+    # as many of the longest query, its ';' or the final newline as fit the input buffer
+    longest_item_query = max(max(len(item.query(1)) for item in single_measurement_list),
+                             max(len(item.query((1, 2))) for item in double_measurement_list))
+    max_compound_queries = input_buffer_size // (longest_item_query + 1)
+    # largest number of points the scope returns for one :WAV:DATA? query in BYTE format
+    max_waveform_chunk = 250000
+    # seconds between :TRIG:STAT? polls in acquire_single_shots, kept short since every poll adds dead time
+    trigger_poll_interval = 0.001
+
     def powerise10(self, x):
         """ Returns x as a*10**b with 0 <= a < 10"""
         if x == 0:
@@ -177,67 +236,142 @@ class RigolDS1054z(Driver):
         return "%.4gE%s" % (a, b)
 
     def get_measurement(self, channel=1, meas_type=max_voltage):
-        self.instrument.write(':MEAS:ITEM? ' + meas_type.command + ',CHAN' + str(channel))
-        fullreading = self.instrument.read_raw()
-        readinglines = fullreading.splitlines()
-        if (meas_type.return_type == 'float'):
-            reading = float(readinglines[0])
-            if (meas_type.unit == '%'):
-                percentage_reading = reading * 100
-                print("Channel " + str(
-                    channel) + " " + meas_type.name + " value is " + str(percentage_reading) + " " + meas_type.unit)
+        with self.transaction():
+            self.instrument.write(meas_type.query(channel))
+            reading = meas_type.reading(self.instrument.read_raw().splitlines()[0].decode("utf-8"), channel)
+        self.log_reading(reading)
+        return reading
 
-            else:
-                eng_reading = self.eng_notation(reading)
-                print("Channel " + str(
-                    channel) + " " + meas_type.name + " value is " + eng_reading + " " + meas_type.unit)
-        elif (meas_type.return_type == 'int'):
-            reading = int(float(readinglines[0]))
-            print("Channel " + str(channel) + " " + meas_type.name + " value is " + str(reading) + " " + meas_type.unit)
+    def format_reading(self, reading):
+        if reading.unit == '%':
+            value = str(reading.value * 100)
+        elif isinstance(reading.value, float):
+            value = self.eng_notation(reading.value)
         else:
-            reading = readinglines[0].decode("utf-8")
-            print("Channel " + str(channel) + " " + meas_type.name + " value is " + reading + " " + meas_type.unit)
-        return reading
+            value = str(reading.value)
+        return "Channel " + str(reading.channel) + " " + reading.name + " value is " + value + " " + reading.unit
+
+    # channels holds channel numbers for the single source items and (source1, source2) tuples for the
+    # double source items, e.g. channels=(1, 2, (1, 2)); items defaults to both measurement lists
+    def get_measurements(self, channels=(1,), items=None):
+        """Returns {channel: {name: value}}, with up to max_compound_queries items per SCPI transaction"""
+        if items is None:
+            items = self.single_measurement_list + self.double_measurement_list
+        queries = [(channel, meas_type) for channel in channels for meas_type in items
+                   if isinstance(channel, tuple) == (meas_type in self.double_measurement_list)]
+
+        results = dict((channel, {}) for channel in channels)
+        for first in range(0, len(queries), self.max_compound_queries):
+            batch = queries[first:first + self.max_compound_queries]
+            with self.transaction():
+                self.instrument.write(';'.join(meas_type.query(channel) for channel, meas_type in batch))
+                replies = re.split(r"[;\r\n]+", self.instrument.read_raw().decode("utf-8").strip())
+            if len(replies) != len(batch):
+                raise ValueError("Expected {} measurement replies, got {}: set max_compound_queries = 1 if the "
+                                 "scope does not answer compound queries".format(len(batch), len(replies)))
+            for (channel, meas_type), reply in zip(batch, replies):
+                results[channel][meas_type.name] = meas_type.parse(reply, channel)
+        return results
+
+    # same arguments as get_measurements, the values are computed from one :WAV:DATA? transfer per channel
+    # instead of a :MEAS:ITEM? query per item, measurements the waveform does not support are NaN
+    def compute_measurements(self, channels=(1,), items=None, mode='NORM'):
+        """Returns {channel: {name: value}} measured on the host, see electronics_lab.analysis"""
+        if items is None:
+            items = self.single_measurement_list + self.double_measurement_list
+        analyses = {}
+        for channel in channels:
+            for source in (channel if isinstance(channel, tuple) else (channel,)):
+                if source not in analyses:
+                    time_axis, volts = self.read_waveform(source, mode)
+                    analyses[source] = WaveformAnalysis(volts, time_axis[1] - time_axis[0], time_axis[0])
+        results = dict((channel, {}) for channel in channels)
+        for channel in channels:
+            if isinstance(channel, tuple):
+                commands = [meas_type for meas_type in items if meas_type in self.double_measurement_list]
+                values = analyses[channel[0]].measure_pair(analyses[channel[1]],
+                                                           [meas_type.command for meas_type in commands])
+            else:
+                commands = [meas_type for meas_type in items if meas_type not in self.double_measurement_list]
+                values = analyses[channel].measure([meas_type.command for meas_type in commands])
+            for meas_type in commands:
+                results[channel][meas_type.name] = values[meas_type.command]
+        return results
+
+    def read_screen_capture(self):
+        """Returns the PNG image of the screen"""
+        with self.transaction():
+            self.instrument.write(':DISP:DATA? ON,OFF,PNG')
+            return self.read_block().tobytes()
 
     # if no filename is provided, the timestamp will be the filename
     def write_screen_capture(self, filename=''):
-        self.instrument.write(':DISP:DATA? ON,OFF,PNG')
-        raw_data = self.instrument.read_raw()[11:]  # strip off first 11 bytes
         # save image file
         if (filename == ''):
             filename = "rigol_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".png"
-        fid = open(filename, 'wb')
-        fid.write(raw_data)
-        fid.close()
+        with self.transaction():
+            self.instrument.write(':DISP:DATA? ON,OFF,PNG')
+            with open(filename, 'wb') as fid:
+                for chunk in self.iter_block():
+                    fid.write(chunk)
+            self.wait_for_opc()
         print("Wrote screen capture to filename " + '\"' + filename + '\"')
-        time.sleep(5)
 
     def close(self):
-        self.instrument.close()
-        print("Closed USB session to oscilloscope")
+        Driver.close(self)
+        print("Released session to oscilloscope")
 
-    def reset(self):
+    # the scope does not answer while it resets, so errors are retried until the timeout
+    def reset(self, timeout=20.0):
+        self.invalidate()
         self.instrument.write('*RST')
+        self.wait_for_opc(timeout, ignore_errors=True)
         print("Reset oscilloscope")
-        time.sleep(8)
 
     # probe should either be 10.0 or 1.0, per the setting on the physical probe
     def setup_channel(self, channel=1, on=1, offset_divs=0.0, volts_per_div=1.0, probe=10.0):
-        if on == 1:
-            self.instrument.write(':CHAN' + str(channel) + ':DISP ' + 'ON')
-            self.instrument.write(':CHAN' + str(channel) + ':SCAL ' + str(volts_per_div))
-            self.instrument.write(':CHAN' + str(channel) + ':OFFS ' + str(offset_divs * volts_per_div))
-            self.instrument.write(':CHAN' + str(channel) + ':PROB ' + str(probe))
-            print(
-                "Turned on CH" + str(channel) + ", position is " + str(offset_divs) + " divisions from center, " + str(
-                    volts_per_div) + " volts/div, scope is " + str(probe) + "x")
-        else:
-            self.instrument.write(':CHAN' + str(channel) + ':DISP OFF')
-            print("Turned off channel " + str(channel))
+        with self.batch():
+            if on == 1:
+                self.write_setting(':CHAN' + str(channel) + ':DISP', 'ON')
+                self.write_setting(':CHAN' + str(channel) + ':SCAL', volts_per_div)
+                self.write_setting(':CHAN' + str(channel) + ':OFFS', offset_divs * volts_per_div)
+                self.write_setting(':CHAN' + str(channel) + ':PROB', probe)
+                print("Turned on CH{}, position is {} divisions from center, {} volts/div, scope is {}x".format(
+                    channel, offset_divs, volts_per_div, probe))
+            else:
+                self.write_setting(':CHAN' + str(channel) + ':DISP', 'OFF')
+                print("Turned off channel " + str(channel))
 
+    def settings_digest(self):
+        """Returns the SHA-1 of the :SYST:SET? blob, which changes with any setting on the scope"""
+        digest = hashlib.sha1()
+        with self.transaction():
+            self.instrument.write(':SYST:SET?')
+            for chunk in self.iter_block():
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    # one :SYST:SET? transfer tells whether anything changed, instead of querying every cached setting,
+    # the digest is only taken after a full resync compared every cached key
+    def resync(self, keys=None):
+        with self.transaction():
+            digest = self.settings_digest()
+            if keys is None and digest == self.cache.digest:
+                return []
+            changed = Driver.resync(self, keys)
+            if keys is None:
+                self.cache.digest = digest
+        return changed
+
+    # numbers are taken as seconds or volts already, strings such as '500mv' or '2.5us' are converted
     def val_and_unit_to_real_val(self, val_with_unit='1s'):
-        number = int(re.search(r"([0-9]+)", val_with_unit).group(0))
-        unit = re.search(r"([a-z]+)", val_with_unit).group(0).lower()
+        if not isinstance(val_with_unit, str):
+            return val_with_unit
+        number = float(re.search(r"(-?[0-9.]+)", val_with_unit).group(0))
+        if number == int(number):
+            number = int(number)
+        unit_match = re.search(r"([a-zA-Z]+)", val_with_unit)
+        unit = unit_match.group(0).lower() if unit_match else ''
         if unit == 's' or unit == 'v':
             real_val_no_units = number
         elif unit == 'ms' or unit == 'mv':
@@ -250,111 +384,288 @@ class RigolDS1054z(Driver):
             real_val_no_units = number
         return real_val_no_units
 
-    # remember to always use lowercase time_per_div units, the regex look for lowercase
+    # time_per_div and delay are seconds or strings with units, e.g. '1ms'
     def setup_timebase(self, time_per_div='1ms', delay='1ms'):
-        time_per_div_real = self.val_and_unit_to_real_val(time_per_div)
-        self.instrument.write(':TIM:MAIN:SCAL ' + str(time_per_div_real))
-        print("Timebase was set to " + time_per_div + " per division")
-        delay_real = self.val_and_unit_to_real_val(delay)
-        self.instrument.write(':TIM:MAIN:OFFS ' + str(delay_real))
+        with self.batch():
+            time_per_div_real = self.val_and_unit_to_real_val(time_per_div)
+            self.write_setting(':TIM:MAIN:SCAL', time_per_div_real)
+            print("Timebase was set to " + str(time_per_div) + " per division")
+            delay_real = self.val_and_unit_to_real_val(delay)
+            self.write_setting(':TIM:MAIN:OFFS', delay_real)
 
-    # remember to always use lowercase level units, the regex look for lowercase
+    # level is volts or a string with units, e.g. '100mv'
     def setup_trigger(self, channel=1, slope_pos=1, level='100mv'):
-        level_real = self.val_and_unit_to_real_val(level)
-        self.instrument.write(':TRIG:EDG:SOUR CHAN' + str(channel))
-        if slope_pos == 0:
-            self.instrument.write(':TRIG:EDG:SLOP NEG')
-        else:
-            self.instrument.write(':TRIG:EDG:SLOP POS')
-        self.instrument.write(':TRIG:EDG:LEV ' + str(level_real))
-        if slope_pos == 1:
-            print("Triggering on CH" + str(channel) + " positive edge with level of " + level)
-        else:
-            print("Triggering on CH" + str(channel) + " negative edge with level of " + level)
+        with self.batch():
+            level_real = self.val_and_unit_to_real_val(level)
+            self.write_setting(':TRIG:EDG:SOUR', 'CHAN' + str(channel))
+            if slope_pos == 0:
+                self.write_setting(':TRIG:EDG:SLOP', 'NEG')
+            else:
+                self.write_setting(':TRIG:EDG:SLOP', 'POS')
+            self.write_setting(':TRIG:EDG:LEV', level_real)
+            if slope_pos == 1:
+                print("Triggering on CH" + str(channel) + " positive edge with level of " + str(level))
+            else:
+                print("Triggering on CH" + str(channel) + " negative edge with level of " + str(level))
 
     # decode channel is either 1 or 2, only two decodes can be present at any time
     # use uppercase for encoding, valid choices are HEX, ASC, DEC, BIN, LINE
     # position_divs is the number of division (from bottom) to position the decode
     def setup_i2c_decode(self, decode_channel=1, on=1, sda_channel=1, scl_channel=2, encoding='HEX', position_divs=1.0):
-        if on == 0:
-            self.instrument.write(':DEC' + str(decode_channel) + ':CONF:LINE OFF')
-        else:
-            self.instrument.write(':DEC' + str(decode_channel) + ':MODE IIC')
-            self.instrument.write(':DEC' + str(decode_channel) + ':DISP ON')
-            self.instrument.write(':DEC' + str(decode_channel) + ':FORM ' + encoding)
-            self.instrument.write(':DEC' + str(decode_channel) + ':POS ' + str(400 - position_divs * 50))
-            self.instrument.write(':DEC' + str(decode_channel) + ':THRE AUTO')
-            self.instrument.write(':DEC' + str(decode_channel) + ':CONF:LINE ON')
-            self.instrument.write(':DEC' + str(decode_channel) + ':IIC:CLK CHAN' + str(scl_channel))
-            self.instrument.write(':DEC' + str(decode_channel) + ':IIC:DATA CHAN' + str(sda_channel))
-            self.instrument.write(':DEC' + str(decode_channel) + ':IIC:ADDR RW')
-
-    def single_trigger(self):
+        with self.batch():
+            if on == 0:
+                self.write_setting(':DEC' + str(decode_channel) + ':CONF:LINE', 'OFF')
+            else:
+                self.write_setting(':DEC' + str(decode_channel) + ':MODE', 'IIC')
+                self.write_setting(':DEC' + str(decode_channel) + ':DISP', 'ON')
+                self.write_setting(':DEC' + str(decode_channel) + ':FORM', encoding)
+                self.write_setting(':DEC' + str(decode_channel) + ':POS', 400 - position_divs * 50)
+                self.write_setting(':DEC' + str(decode_channel) + ':THRE', 'AUTO')
+                self.write_setting(':DEC' + str(decode_channel) + ':CONF:LINE', 'ON')
+                self.write_setting(':DEC' + str(decode_channel) + ':IIC:CLK', 'CHAN' + str(scl_channel))
+                self.write_setting(':DEC' + str(decode_channel) + ':IIC:DATA', 'CHAN' + str(sda_channel))
+                self.write_setting(':DEC' + str(decode_channel) + ':IIC:ADDR', 'RW')
+
+    # returns one of TD, WAIT, RUN, AUTO or STOP
+    def trigger_status(self):
+        return self.query(':TRIG:STAT?').strip()
+
+    def wait_for_trigger_status(self, states=('STOP',), timeout=10.0):
+        self.wait_until(lambda: self.trigger_status() in states, timeout,
+                        'trigger status ' + '/'.join(states))
+
+    # returns once the scope is armed, or has already captured
+    def single_trigger(self, timeout=10.0):
         self.instrument.write(':SING')
-        time.sleep(3)
+        self.wait_for_opc(timeout)
+        self.wait_for_trigger_status(('WAIT', 'TD', 'STOP'), timeout)
 
-    def force_trigger(self):
+    def force_trigger(self, timeout=10.0):
         self.instrument.write(':TFOR')
-        time.sleep(3)
+        self.wait_for_opc(timeout)
 
-    def run_trigger(self):
+    def run_trigger(self, timeout=10.0):
         self.instrument.write(':RUN')
-        time.sleep(3)
+        self.wait_for_opc(timeout)
+        self.wait_for_trigger_status(('RUN', 'AUTO', 'WAIT', 'TD'), timeout)
+
+    # arms with :SING, waits for *OPC? and polls :TRIG:STAT? until STOP, reads the channels in BYTE format
+    # and arms again, out may hold {channel: (count, points) uint8 array} buffers to reuse from an earlier run
+    def acquire_single_shots(self, count, channels=(1,), mode='RAW', timeout=10.0, out=None):
+        """Returns a SingleShots with count triggered captures of each channel, see SingleShots"""
+        codes = dict(out or {})
+        preambles = {}
+        armed = np.zeros(count)
+        triggered = np.zeros(count)
+        stopped = np.zeros(count)
+        with self.transaction():
+            self.instrument.write(':WAV:MODE ' + mode)
+            self.instrument.write(':WAV:FORM BYTE')
+            started = time.monotonic()
+            for index in range(count):
+                self.instrument.write(':SING')
+                armed[index] = time.monotonic()
+                # until :SING is processed the status still reads STOP from the previous capture
+                self.wait_for_opc(timeout)
+                self._wait_for_stop(timeout)
+                stopped[index] = time.monotonic()
+                triggered[index] = time.time()
+                for channel in channels:
+                    self.instrument.write(':WAV:SOUR CHAN' + str(channel))
+                    if channel not in preambles:
+                        # the points of a RAW read are only known once the first capture stopped
+                        preambles[channel] = self.read_waveform_preamble()
+                        points = preambles[channel]['points']
+                        if codes.get(channel) is None or codes[channel].shape != (count, points):
+                            codes[channel] = np.empty((count, points), dtype=np.uint8)
+                    for _ in self._iter_waveform_blocks(codes[channel].shape[1], codes[channel][index]):
+                        pass
+            elapsed = time.monotonic() - started
+        return SingleShots(codes, preambles, triggered, armed[1:] - stopped[:-1], elapsed)
+
+    def _wait_for_stop(self, timeout):
+        # a fixed short interval rather than wait_until's backoff, a late poll is dead time on every capture
+        deadline = time.monotonic() + timeout
+        while self.query(':TRIG:STAT?').strip() != 'STOP':
+            if time.monotonic() > deadline:
+                raise InstrumentTimeout("Timed out after {} s waiting for trigger status STOP".format(timeout))
+            time.sleep(self.trigger_poll_interval)
 
     # only allowed values are 6e3, 6e4, 6e5, 6e6, 12e6 for single channels
     # only allowed values are 6e3, 6e4, 6e5, 6e6, 12e6 for   dual channels
     # only allowed values are 3e3, 3e4, 3e5, 3e6, 6e6  for 3 or 4 channels
     # the int conversion is needed for scientific notation values
     def setup_mem_depth(self, memory_depth=12e6):
-        self.instrument.write(':ACQ:MDEP ' + str(int(memory_depth)))
+        self.write_setting(':ACQ:MDEP', int(memory_depth))
         print
         "Acquire memory depth set to %d samples" % memory_depth
 
     def write_waveform_data(self, channel=1, filename=''):
-        self.instrument.write(':WAV:SOUR: CHAN' + str(channel))
-        time.sleep(1)
-        self.instrument.write(':WAV:MODE NORM')
-        self.instrument.write(':WAV:FORM ASC')
-        self.instrument.write(':WAV:STAR 1')
-        self.instrument.write(':WAV:STAR 15625')
-
         if filename == '':
             filename = "rigol_waveform_data_channel_" + str(channel) + "_" + datetime.datetime.now().strftime(
                 "%Y-%m-%d_%H-%M-%S") + ".csv"
-        fid = open(filename, 'w')
         print(
             "Started saving waveform data for channel " + str(channel) + " samples to filename " + filename)
-        data = self.instrument.query(':WAV:DATA?')
-        data = data[11:]
-        data = data.replace(",", "\n")
-        fid.write(data)
-        fid.close()
+        with self.transaction(), open(filename, 'wb') as fid:
+            self.instrument.write(':WAV:SOUR CHAN' + str(channel))
+            self.wait_for_opc()
+            self.instrument.write(':WAV:MODE NORM')
+            self.instrument.write(':WAV:FORM ASC')
+            self.instrument.write(':WAV:STAR 1')
+            self.instrument.write(':WAV:STOP 1200')
+            self.instrument.write(':WAV:DATA?')
+            for chunk in self.iter_block():
+                fid.write(chunk.replace(b",", b"\n"))
 
     def write_scope_settings_to_file(self, filename=''):
-        self.instrument.write(':SYST:SET?')
-        raw_data = self.instrument.read_raw()[11:]  # strip off first 11 bytes
-
         if filename == '':
             filename = "rigol_settings_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".stp"
-        fid = open(filename, 'wb')
-        fid.write(raw_data)
-        fid.close()
+        with self.transaction():
+            self.instrument.write(':SYST:SET?')
+            with open(filename, 'wb') as fid:
+                for chunk in self.iter_block():
+                    fid.write(chunk)
+            self.wait_for_opc()
         print("Wrote oscilloscope settings to filename " + '\"' + filename + '\"')
-        time.sleep(5)
 
-    def restore_scope_settings_from_file(self, filename=''):
+    def restore_scope_settings_from_file(self, filename='', timeout=20.0):
         if filename == '':
-            print
-            "ERROR: must specify filename\n"
+            print("ERROR: must specify filename")
         else:
-            with open(filename, mode='rb') as file:  # b is important -> binary
-                fileContent = file.read()
-                valList = list()
-                # alter ending to append new CRLF
-                fileContent = fileContent + chr(13) + chr(10)
-                # convert to a list that write_binary_values can iterate
-                for x in range(0, len(fileContent) - 1):
-                    valList.append(ord(fileContent[x]))
-                self.instrument.write_binary_values(':SYST:SET ', valList, datatype='B', is_big_endian=True)
+            self.invalidate()
+            with open(filename, mode='rb') as fid:
+                self.write_block(':SYST:SET ', fid.read())
+            self.wait_for_opc(timeout, ignore_errors=True)
             print("Wrote oscilloscope settings to scope")
-            time.sleep(8)
+
+    def read_waveform_preamble(self):
+        """Returns the :WAV:PRE? fields as a dict"""
+        fields = self.instrument.query(':WAV:PRE?').strip().split(',')
+        return {'format': int(fields[0]), 'type': int(fields[1]), 'points': int(fields[2]),
+                'count': int(fields[3]), 'xincrement': float(fields[4]), 'xorigin': float(fields[5]),
+                'xreference': float(fields[6]), 'yincrement': float(fields[7]), 'yorigin': float(fields[8]),
+                'yreference': float(fields[9])}
+
+    # mode is NORM for the screen points, RAW for the full acquisition memory
+    # RAW reads need the scope stopped, so the acquisition is stopped first
+    def read_waveform(self, channel=1, mode='RAW'):
+        """Returns (time, volts) numpy arrays for the channel, transferred in binary chunks"""
+        with self.transaction():
+            preamble = self._setup_waveform_transfer(channel, mode)
+            codes = np.empty(preamble['points'], dtype=np.uint8)
+            received = 0
+            for start, block in self._iter_waveform_blocks(len(codes), codes):
+                received = start + len(block)
+        return waveform_time_axis(preamble, received), scale_waveform_codes(codes[:received], preamble)
+
+    # if no filename is provided, the timestamp will be the filename
+    # the codes are written as they arrive, so memory use does not grow with the memory depth
+    def stream_waveform_to_file(self, channel=1, filename='', mode='RAW'):
+        """Streams the raw byte codes into a .npy file with a .json sidecar holding the preamble"""
+        timestamp = datetime.datetime.now()
+        if filename == '':
+            filename = "rigol_waveform_data_channel_" + str(channel) + "_" + timestamp.strftime(
+                "%Y-%m-%d_%H-%M-%S") + ".npy"
+        received = 0
+        with self.transaction(), open(filename, 'wb') as fid:
+            preamble = self._setup_waveform_transfer(channel, mode)
+            points = preamble['points']
+            np.lib.format.write_array_header_1_0(fid, {'descr': '|u1', 'fortran_order': False, 'shape': (points,)})
+            data_offset = fid.tell()
+            # preallocate so every chunk is written in place
+            fid.truncate(data_offset + points)
+            for start, block in self._iter_waveform_blocks(points):
+                fid.seek(data_offset + start)
+                fid.write(block)
+                received = start + len(block)
+        header = {'channel': channel, 'mode': mode, 'timestamp': timestamp.isoformat(), 'points': received,
+                  'preamble': preamble}
+        with open(waveform_header_filename(filename), 'w') as fid:
+            json.dump(header, fid, indent=2)
+        print("Wrote {} waveform points for channel {} to filename \"{}\"".format(received, channel, filename))
+        return filename
+
+    def _setup_waveform_transfer(self, channel, mode):
+        if mode == 'RAW':
+            self.instrument.write(':STOP')
+        self.instrument.write(':WAV:SOUR CHAN' + str(channel))
+        self.instrument.write(':WAV:MODE ' + mode)
+        self.instrument.write(':WAV:FORM BYTE')
+        return self.read_waveform_preamble()
+
+    # with out, a uint8 array of at least points codes, every window is read in place
+    def _iter_waveform_blocks(self, points, out=None):
+        """Yields (zero based start index, payload memoryview) for each :WAV:STAR/:WAV:STOP window"""
+        for start in range(1, points + 1, self.max_waveform_chunk):
+            stop = min(start + self.max_waveform_chunk - 1, points)
+            self.instrument.write(':WAV:STAR ' + str(start))
+            self.instrument.write(':WAV:STOP ' + str(stop))
+            self.instrument.write(':WAV:DATA?')
+            yield start - 1, self.read_block(None if out is None else out[start - 1:stop])
+
+
+class SingleShots(object):
+    """Captures taken by RigolDS1054z.acquire_single_shots
+
+    codes[channel] holds one capture per row as raw byte codes, scale them
+    with volts(). triggered is time.time() when each capture was seen
+    stopped, dead_times the seconds from one capture stopping until the
+    scope was armed for the next, while a glitch goes unseen.
+    """
+
+    def __init__(self, codes, preambles, triggered, dead_times, elapsed):
+        self.codes = codes
+        self.preambles = preambles
+        self.triggered = triggered
+        self.dead_times = dead_times
+        self.elapsed = elapsed
+
+    def __len__(self):
+        return len(self.triggered)
+
+    @property
+    def captures_per_second(self):
+        return len(self) / self.elapsed if self.elapsed > 0 else float('inf')
+
+    @property
+    def dead_time_fraction(self):
+        """Share of the run the scope was not armed, between the first and the last capture"""
+        return float(self.dead_times.sum() / self.elapsed) if self.elapsed > 0 else 0.0
+
+    def volts(self, channel, index=slice(None)):
+        return scale_waveform_codes(self.codes[channel][index], self.preambles[channel])
+
+    def time_axis(self, channel):
+        return waveform_time_axis(self.preambles[channel], self.codes[channel].shape[1])
+
+    def __str__(self):
+        return "{} captures in {:.3f} s, {:.1f} captures/s, mean dead time {:.2f} ms".format(
+            len(self), self.elapsed, self.captures_per_second,
+            1e3 * self.dead_times.mean() if len(self.dead_times) else 0.0)
+
+
+def waveform_header_filename(filename):
+    return re.sub(r"\.npy$", "", filename) + ".json"
+
+
+def waveform_time_axis(preamble, points, start=0):
+    """Returns the time of each point from the :WAV:PRE? fields"""
+    return (np.arange(start, start + points) - preamble['xreference']) * preamble['xincrement'] + preamble['xorigin']
+
+
+def scale_waveform_codes(codes, preamble):
+    """Converts raw byte codes to volts as float32"""
+    volts = np.subtract(codes, preamble['yorigin'] + preamble['yreference'], dtype=np.float32)
+    volts *= preamble['yincrement']
+    return volts
+
+
+def load_waveform_file(filename):
+    """Opens a file written by stream_waveform_to_file, returning (memory mapped codes, header dict)
+
+    Nothing is read until the codes are sliced, scale slices with scale_waveform_codes.
+    """
+    with open(waveform_header_filename(filename)) as fid:
+        header = json.load(fid)
+    codes = np.load(filename, mmap_mode='r')[:header['points']]
+    return codes, header
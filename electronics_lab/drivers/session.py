@@ -0,0 +1,312 @@
+import atexit
+import functools
+import importlib
+import sys
+import threading
+import time
+
+from .state import StateCache
+
+_resource_manager = None
+
+# instrumentation.Recorder timing every Session.call, None while instrumentation is disabled
+recorder = None
+
+
+def import_visa():
+    try:
+        import pyvisa as visa
+    except ImportError:
+        import visa
+    return visa
+
+
+def get_resource_manager():
+    """Returns the process wide VISA resource manager, pyvisa is imported on first use"""
+    global _resource_manager
+    if _resource_manager is None:
+        _resource_manager = import_visa().ResourceManager()
+    return _resource_manager
+
+
+def open_visa(resource_string):
+    return get_resource_manager().open_resource(resource_string)
+
+
+def open_vxi11(host):
+    import vxi11
+    return vxi11.Instrument(host)
+
+
+# resource string prefix -> 'module:function' opening it, used instead of the driver's own transport
+transports = {'SIM': 'electronics_lab.drivers.sim:open_resource'}
+
+
+def transport_opener(key):
+    """Returns the opener registered in transports for the key's prefix, or None"""
+    target = transports.get(key.split('::', 1)[0].upper()) if '::' in key else None
+    if isinstance(target, str):
+        module_name, _, attribute = target.partition(':')
+        target = getattr(importlib.import_module(module_name), attribute)
+    return target
+
+
+# VISA status codes that mean the link is gone rather than the command failed
+_lost_connection_codes = ('VI_ERROR_CONN_LOST', 'VI_ERROR_INV_OBJECT', 'VI_ERROR_IO', 'VI_ERROR_RSRC_NFOUND')
+
+
+def is_connection_error(error):
+    # a VisaIOError can only have been raised if pyvisa was imported already
+    pyvisa = sys.modules.get('pyvisa')
+    if pyvisa is not None and isinstance(error, pyvisa.errors.VisaIOError):
+        return error.error_code in [getattr(pyvisa.constants, code) for code in _lost_connection_codes]
+    return isinstance(error, (OSError, EOFError))
+
+
+class WriteBatch(object):
+    """Writes collected by Session.begin_batch, sent as ';' joined messages of at most max_length characters"""
+
+    def __init__(self, max_length=512):
+        self.max_length = max_length
+        self.commands = []
+
+    # later commands in a compound message are relative to the previous header unless they start at the root
+    def add(self, command):
+        command = command.strip()
+        if not command.startswith((':', '*')):
+            command = ':' + command
+        self.commands.append(command)
+
+    def messages(self):
+        messages = []
+        for command in self.commands:
+            if messages and len(messages[-1]) + 1 + len(command) <= self.max_length:
+                messages[-1] += ';' + command
+            else:
+                messages.append(command)
+        return messages
+
+
+# calls that carry the whole exchange, so they can be repeated on a new connection
+retried_methods = ('query', 'ask', 'write', 'write_raw')
+
+
+class Session(object):
+    """Pooled instrument session that reconnects when the link drops
+
+    Attribute access is forwarded to the underlying pyvisa resource or
+    vxi11 instrument. A query or write that fails with a connection error
+    is retried once on a fresh connection, and attributes set on the session (e.g.
+    timeout) are reapplied after every reconnect. cache mirrors the
+    instrument settings for every driver on the session, it is cleared on
+    reconnect since the instrument may have restarted. Between
+    begin_batch() and end_batch() plain writes are buffered and sent as
+    compound messages, before any other call and at the end.
+    """
+
+    _fields = ('key', 'opener', 'instrument', 'lock', 'users', 'last_used', 'settings', 'cache', 'batch')
+
+    def __init__(self, key, opener=open_visa):
+        self.key = key
+        self.opener = opener
+        self.instrument = None
+        self.lock = threading.RLock()
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.settings = {}
+        self.cache = StateCache()
+        self.batch = None
+        self.connect()
+
+    def connect(self):
+        with self.lock:
+            self.instrument = self.opener(self.key)
+            for name, value in self.settings.items():
+                setattr(self.instrument, name, value)
+
+    def close(self):
+        with self.lock:
+            if self.instrument is not None:
+                try:
+                    self.instrument.close()
+                except Exception as error:
+                    if not is_connection_error(error):
+                        raise
+                self.instrument = None
+
+    def reconnect(self):
+        with self.lock:
+            self.cache.invalidate()
+            self.close()
+            self.connect()
+
+    def call(self, name, *args, **kwargs):
+        if self.batch is not None:
+            with self.lock:
+                # only the thread that began the batch gets here while it is open
+                if self.batch is not None:
+                    if name == 'write' and len(args) == 1 and not kwargs:
+                        self.batch.add(args[0])
+                        return len(args[0])
+                    self.flush()
+        if recorder is not None:
+            return recorder.call(self, name, args, kwargs)
+        return self._call(name, args, kwargs)
+
+    def _call(self, name, args, kwargs):
+        with self.lock:
+            if self.instrument is None:
+                self.connect()
+            self.last_used = time.monotonic()
+            try:
+                return getattr(self.instrument, name)(*args, **kwargs)
+            except Exception as error:
+                # a read waits for the reply to a write sent on the old link, on a new link it could only time out
+                if not is_connection_error(error) or name not in retried_methods:
+                    raise
+            self.reconnect()
+            return getattr(self.instrument, name)(*args, **kwargs)
+
+    def begin_batch(self, max_length=512):
+        """Starts buffering writes, returns False if a batch is already open"""
+        with self.lock:
+            if self.batch is not None:
+                return False
+            self.batch = WriteBatch(max_length)
+            return True
+
+    def flush(self):
+        """Sends the buffered writes, the batch stays open"""
+        with self.lock:
+            batch, self.batch = self.batch, None
+            if batch is None:
+                return
+            try:
+                for message in batch.messages():
+                    self.call('write', message)
+            finally:
+                batch.commands = []
+                self.batch = batch
+
+    def end_batch(self, discard=False):
+        with self.lock:
+            if not discard:
+                self.flush()
+            self.batch = None
+
+    def is_alive(self):
+        """Sends *IDN? on the current connection without retrying"""
+        with self.lock:
+            if self.instrument is None:
+                return False
+            try:
+                if hasattr(self.instrument, 'query'):
+                    self.instrument.query('*IDN?')
+                else:
+                    self.instrument.ask('*IDN?')
+            except Exception as error:
+                if not is_connection_error(error):
+                    raise
+                return False
+            self.last_used = time.monotonic()
+            return True
+
+    def __getattr__(self, name):
+        if name in Session._fields:
+            raise AttributeError(name)
+        if self.instrument is None:
+            self.connect()
+        attribute = getattr(self.instrument, name)
+        if not callable(attribute):
+            return attribute
+        return functools.partial(self.call, name)
+
+    def __setattr__(self, name, value):
+        if name in Session._fields:
+            object.__setattr__(self, name, value)
+        else:
+            self.settings[name] = value
+            setattr(self.instrument, name, value)
+
+
+class SessionPool(object):
+    """Open instrument sessions keyed by resource string, shared by every driver in the process
+
+    Released sessions stay open so the next driver on the same resource
+    does not pay the connection setup again.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self._keepalive = None
+        self._stop_keepalive = threading.Event()
+
+    def acquire(self, key, opener=open_visa):
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = Session(key, transport_opener(key) or opener)
+            session.users += 1
+        return session
+
+    def release(self, session):
+        with self.lock:
+            session.users = max(session.users - 1, 0)
+
+    def close_idle(self):
+        """Closes the sessions no driver is using"""
+        with self.lock:
+            idle = [key for key, session in self.sessions.items() if session.users == 0]
+            for key in idle:
+                self.sessions.pop(key).close()
+        return idle
+
+    def close_all(self):
+        self.stop_keepalive()
+        with self.lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def health_check(self, idle_for=0.0):
+        """Reconnects every session idle for at least idle_for seconds that fails *IDN?, returns their keys"""
+        reconnected = []
+        now = time.monotonic()
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            if now - session.last_used < idle_for or session.is_alive():
+                continue
+            try:
+                session.reconnect()
+            except Exception as error:
+                if not is_connection_error(error):
+                    raise
+                # the instrument is still unreachable, the next call retries
+                session.instrument = None
+                continue
+            reconnected.append(session.key)
+        return reconnected
+
+    def start_keepalive(self, interval=30.0):
+        """Checks sessions idle for interval seconds from a background thread, keeping LAN links open"""
+        self.stop_keepalive()
+        self._stop_keepalive.clear()
+
+        def run():
+            while not self._stop_keepalive.wait(interval):
+                self.health_check(idle_for=interval)
+
+        self._keepalive = threading.Thread(target=run, name='electronics_lab-keepalive', daemon=True)
+        self._keepalive.start()
+
+    def stop_keepalive(self):
+        if self._keepalive is not None:
+            self._stop_keepalive.set()
+            self._keepalive.join()
+            self._keepalive = None
+
+
+pool = SessionPool()
+atexit.register(pool.close_all)
@@ -1,7 +1,159 @@
+import hashlib
+import re
+import numpy as np
 from .driver import Driver
 
 
+def parse_parameters(reply):
+    """Returns the NAME,value pairs of a reply such as 'C1:BSWV WVTP,SINE,FRQ,1000HZ' as a dict"""
+    fields = [field.strip() for field in reply.strip().split(' ', 1)[-1].split(',')]
+    return dict(zip(fields[::2], fields[1::2]))
+
+
+def parse_output(reply):
+    """Returns the state and the NAME,value pairs of 'C1:OUTP ON,LOAD,HZ,PLRT,NOR' as ('ON', {'LOAD': 'HZ', ...})"""
+    fields = [field.strip() for field in reply.strip().split(' ', 1)[-1].split(',')]
+    return fields[0], dict(zip(fields[1::2], fields[2::2]))
+
+
+def strip_unit(value):
+    """Returns '1000' for '1000HZ', '4' for '4V', other values unchanged"""
+    match = re.match(r'^([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)[A-Za-z]*$', value)
+    return match.group(1) if match else value
+
+
+def arb_codes(samples):
+    """Returns samples as contiguous little endian int16 codes, floats from -1.0 to 1.0 span the full range"""
+    samples = np.asarray(samples)
+    if samples.dtype.kind == 'f':
+        return np.round(np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    if samples.dtype.kind in 'iu' and len(samples) and (samples.min() < -32768 or samples.max() > 32767):
+        raise ValueError("arbitrary waveform codes must fit in int16")
+    return np.ascontiguousarray(samples, dtype='<i2')
+
+
 class SiglentSDG1032X(Driver):
-    """
+    """Two channel function generator
 
+    Basic waves are set one parameter at a time through the state cache, so
+    only changed parameters are sent. Arbitrary waveforms are uploaded as
+    raw int16 samples and remembered by content hash, an identical waveform
+    is selected again instead of being uploaded twice.
     """
+
+    waveforms = ('SINE', 'SQUARE', 'RAMP', 'PULSE', 'NOISE', 'ARB', 'DC', 'PRBS')
+
+    frequency = Driver.Measurement(name='frequency', command='FRQ', unit='Hz', return_type='float',
+                                   template='C{channel}:BSWV?',
+                                   parser=lambda text, channel: float(strip_unit(parse_parameters(text)['FRQ'])),
+                                   description='frequency of the basic wave')
+    amplitude = Driver.Measurement(name='amplitude', command='AMP', unit='Vpp', return_type='float',
+                                   template='C{channel}:BSWV?',
+                                   parser=lambda text, channel: float(strip_unit(parse_parameters(text)['AMP'])),
+                                   description='peak to peak amplitude of the basic wave')
+    offset = Driver.Measurement(name='offset', command='OFST', unit='Volts', return_type='float',
+                                template='C{channel}:BSWV?',
+                                parser=lambda text, channel: float(strip_unit(parse_parameters(text)['OFST'])),
+                                description='DC offset of the basic wave')
+    waveform = Driver.Measurement(name='waveform', command='WVTP', unit=None, return_type='str',
+                                  template='C{channel}:BSWV?',
+                                  parser=lambda text, channel: parse_parameters(text)['WVTP'],
+                                  description='basic wave type, one of waveforms')
+    out = Driver.Measurement(name='out', command='OUTP', unit=None, return_type='int',
+                             template='C{channel}:OUTP?',
+                             parser=lambda text, channel: int(text.split(' ', 1)[-1].split(',')[0].strip() == 'ON'),
+                             description='channel ON (1) or OFF (0)')
+
+    def get_measurement(self, channel=1, meas_type=frequency):
+        reading = meas_type.reading(self.instrument.query(meas_type.query(channel)), channel)
+        self.log_reading(reading)
+        return reading
+
+    def set_waveform(self, channel=1, shape='SINE'):
+        if shape.upper() not in self.waveforms:
+            raise ValueError("shape must be one of {}, not {!r}".format(', '.join(self.waveforms), shape))
+        self.write_setting('C' + str(channel) + ':BSWV WVTP', shape.upper())
+
+    def set_frequency(self, channel=1, frequency=1000.0):
+        self.write_setting(self.frequency_key(channel), frequency)
+
+    # the cache key of set_frequency, for forgetting only the frequency
+    def frequency_key(self, channel=1):
+        return 'C' + str(channel) + ':BSWV FRQ'
+
+    # amplitude is peak to peak into the configured load
+    def set_amplitude(self, channel=1, amplitude=1.0):
+        self.write_setting('C' + str(channel) + ':BSWV AMP', amplitude)
+
+    def set_offset(self, channel=1, offset=0.0):
+        self.write_setting('C' + str(channel) + ':BSWV OFST', offset)
+
+    def set_phase(self, channel=1, phase=0.0):
+        self.write_setting('C' + str(channel) + ':BSWV PHSE', phase)
+
+    # state is ON/OFF or 1/0
+    def set_output(self, channel=1, state='ON'):
+        self.write_setting('C' + str(channel) + ':OUTP', {1: 'ON', 0: 'OFF'}.get(state, state))
+
+    # load is HZ for high impedance or the load in ohms, e.g. 50
+    def set_load(self, channel=1, load='HZ'):
+        self.write_setting('C' + str(channel) + ':OUTP LOAD', load)
+
+    def setup_basic_wave(self, channel=1, shape='SINE', frequency=1000.0, amplitude=1.0, offset=0.0, phase=0.0):
+        with self.batch():
+            self.set_waveform(channel, shape)
+            self.set_frequency(channel, frequency)
+            self.set_amplitude(channel, amplitude)
+            self.set_offset(channel, offset)
+            self.set_phase(channel, phase)
+
+    def basic_wave(self, channel=1):
+        """Returns the C<n>:BSWV? parameters as a dict, e.g. {'WVTP': 'SINE', 'FRQ': '1000HZ', ...}"""
+        return parse_parameters(self.query('C' + str(channel) + ':BSWV?'))
+
+    # 'C1:BSWV FRQ' is sent as 'C1:BSWV FRQ,1000', plain headers such as 'C1:OUTP' as 'C1:OUTP ON'
+    def setting_command(self, key, value):
+        if ' ' in key:
+            return key + ',' + str(value)
+        return Driver.setting_command(self, key, value)
+
+    def read_setting(self, key):
+        header, _, parameter = key.partition(' ')
+        reply = self.query(header + '?')
+        # the OUTP reply starts with the bare state, the NAME,value pairs follow it
+        if header.upper().endswith(':OUTP'):
+            state, parameters = parse_output(reply)
+            return parameters.get(parameter.upper(), '') if parameter else state
+        return strip_unit(parse_parameters(reply).get(parameter.upper(), ''))
+
+    # samples are int16 codes, or floats from -1.0 to 1.0 scaled to the full code range
+    # the samples go out in one binary write, the instrument's arbitrary waveform memory limits their number
+    def upload_arb(self, channel, samples, name=None, frequency=1000.0, amplitude=1.0, offset=0.0, phase=0.0):
+        """Uploads and selects an arbitrary waveform, returns its name on the instrument
+
+        A waveform with the same samples that was uploaded on this session
+        before is selected by name without transferring it again.
+        """
+        codes = arb_codes(samples)
+        digest = hashlib.sha1(codes.data).hexdigest()
+        cache = self.cache
+        with self.transaction():
+            stored = cache.uploads.get(digest)
+            if stored is None or (name is not None and stored != name):
+                stored = name or 'wave_' + digest[:10]
+                header = 'C{}:WVDT WVNM,{},FREQ,{},AMPL,{},OFST,{},PHASE,{},WAVEDATA,'.format(
+                    channel, stored, frequency, amplitude, offset, phase)
+                # the samples are copied once, straight from the array into the message
+                self.instrument.write_raw(b''.join((header.encode(), codes.data)))
+                cache.uploads[digest] = stored
+                for parameter, value in (('FRQ', frequency), ('AMP', amplitude), ('OFST', offset), ('PHSE', phase)):
+                    cache.set('C{}:BSWV {}'.format(channel, parameter), value)
+            self.write_setting('C' + str(channel) + ':ARWV NAME', stored)
+            # selecting the waveform switches the channel to ARB
+            cache.set('C' + str(channel) + ':BSWV WVTP', 'ARB')
+            with self.batch():
+                self.set_frequency(channel, frequency)
+                self.set_amplitude(channel, amplitude)
+                self.set_offset(channel, offset)
+                self.set_phase(channel, phase)
+        return stored
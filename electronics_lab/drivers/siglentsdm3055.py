@@ -1,49 +1,119 @@
-from .driver import Driver
+import contextlib
+import time
+import numpy as np
+from .driver import Driver, block_span
 
 
 class SiglentSDM3055(Driver):
     dc_voltage = Driver.Measurement(name='dc_voltage', command='DC', unit='Volts', return_type='float',
-                                    description='DC voltage value')
+                                    template='MEAS:VOLT:{command}?', description='DC voltage value')
     ac_voltage = Driver.Measurement(name='ac_voltage', command='AC', unit='Volts', return_type='float',
-                                    description='AC voltage value')
+                                    template='MEAS:VOLT:{command}?', description='AC voltage value')
     dc_current = Driver.Measurement(name='dc_current', command='DC', unit='Amperes', return_type='float',
-                                    description='DC current value')
+                                    template='MEAS:CURR:{command}?', description='DC current value')
     ac_current = Driver.Measurement(name='ac_current', command='AC', unit='Amperes', return_type='float',
-                                    description='AC current value')
+                                    template='MEAS:CURR:{command}?', description='AC current value')
     capacitance = Driver.Measurement(name='capacitance', command='CAP', unit='Farads', return_type='float',
-                                     description='Measures capacitance')
+                                     template='MEAS:{command}?', description='Measures capacitance')
     twow_resistance = Driver.Measurement(name='twow_resistance', command='RES', unit='Ohms', return_type='float',
-                                         description='Two wire resistance in Ohms')
+                                         template='MEAS:{command}?', description='Two wire resistance in Ohms')
     frequency = Driver.Measurement(name='frequency', command='FREQ', unit='Hz', return_type='float',
-                                   description='Signal frequency in Hz')
+                                   template='MEAS:{command}?', description='Signal frequency in Hz')
     period = Driver.Measurement(name='period', command='PER', unit='Seconds', return_type='float',
-                                description='Signal period in seconds')
+                                template='MEAS:{command}?', description='Signal period in seconds')
 
     def get_measurement(self, meas_type=dc_voltage):
+        reading = meas_type.reading(self.instrument.query(meas_type.template))
+        self.log_reading(reading)
+        return reading
 
-        if meas_type.unit == 'Volts':
-            reading = float(self.instrument.query('MEAS:VOLT:{}?'.format(meas_type.command)))
-            print(" value is " + str(reading) + " " + meas_type.unit)
+    # CONF function for each measurement, used by the buffered sampling mode
+    sampling_functions = {'dc_voltage': 'VOLT:DC', 'ac_voltage': 'VOLT:AC', 'dc_current': 'CURR:DC',
+                          'ac_current': 'CURR:AC', 'capacitance': 'CAP', 'twow_resistance': 'RES',
+                          'frequency': 'FREQ', 'period': 'PER'}
+    sample_count = 1
+    last_fetch = None
+    nplc = None
+    # mains frequency in Hz, one reading takes nplc / line_frequency seconds
+    line_frequency = 50.0
+    # seconds per reading assumed for the functions without an NPLC setting
+    reading_seconds = 0.1
 
-        if meas_type.unit == 'Amperes':
-            reading = float(self.instrument.query('MEAS:CURR?'.format(meas_type.command)))
-            print(" value is " + str(reading) + " " + meas_type.unit)
+    # the function and range are configured once, READ?/R? then return many readings per transfer
+    # nplc is 0.3, 1 or 10 and only applies to dc voltage, dc current and resistance, 0.3 is the fastest
+    # trigger_source is IMM, EXT or BUS
+    def configure_sampling(self, meas_type=dc_voltage, sample_count=1000, nplc=0.3, measurement_range='AUTO',
+                           trigger_source='IMM'):
+        function = self.sampling_functions[meas_type.name]
+        if function in ('FREQ', 'PER'):
+            self.instrument.write('CONF:' + function)
+        else:
+            self.instrument.write('CONF:' + function + ' ' + str(measurement_range))
+        if function in ('VOLT:DC', 'CURR:DC', 'RES'):
+            self.instrument.write(function + ':NPLC ' + str(nplc))
+        self.instrument.write('TRIG:SOUR ' + trigger_source)
+        self.instrument.write('SAMP:COUN ' + str(int(sample_count)))
+        self.sample_count = int(sample_count)
+        self.nplc = nplc if function in ('VOLT:DC', 'CURR:DC', 'RES') else None
+        self.last_fetch = None
 
-        if meas_type.unit == 'Farads':
-            reading = float(self.instrument.query('MEAS:CAP?'))
-            print(" value is " + str(reading) + " " + meas_type.unit)
+    def sampling_seconds(self):
+        """Returns the estimated seconds the meter takes for sample_count readings"""
+        per_reading = self.reading_seconds if self.nplc is None else float(self.nplc) / self.line_frequency
+        return self.sample_count * per_reading
 
-        if meas_type.unit == 'Ohms':
-            if meas_type.name == 'twow_resistance':
-                reading = float(self.instrument.query('MEAS:RES?'))
-                print(" value is " + str(reading) + " " + meas_type.unit)
+    # READ? answers once every reading is taken, the VISA timeout (milliseconds) is raised by twice
+    # the estimated sampling time for the call and restored afterwards
+    @contextlib.contextmanager
+    def sampling_timeout(self):
+        timeout = self.instrument.timeout
+        if timeout is not None:
+            self.instrument.timeout = timeout + int(2000 * self.sampling_seconds())
+        try:
+            yield
+        finally:
+            self.instrument.timeout = timeout
 
-        if meas_type.unit == 'Hz':
-            reading = float(self.instrument.query('MEAS:FREQ?'))
-            print(" value is " + str(reading) + " " + meas_type.unit)
+    def read_samples(self):
+        """Takes sample_count readings with READ?, returns (timestamps, values) numpy arrays
 
-        if meas_type.unit == 'Seconds':
-            reading = float(self.instrument.query('MEAS:PER?'))
-            print(" value is " + str(reading) + " " + meas_type.unit)
+        The meter does not timestamp readings, so they are spread evenly over the time the transfer took.
+        """
+        started = time.time()
+        with self.transaction(), self.sampling_timeout():
+            reply = self.instrument.query('READ?')
+        values = self.parse_samples(reply)
+        return np.linspace(started, time.time(), len(values)), values
 
-        return reading
+    # start_sampling then fetch_samples drains the reading memory while the meter keeps measuring,
+    # with trigger_source='BUS' the readings start on trigger()
+    def start_sampling(self):
+        self.instrument.write('INIT')
+        self.last_fetch = time.time()
+
+    def trigger(self):
+        self.instrument.write('*TRG')
+
+    def fetch_samples(self, max_readings=None):
+        """Removes up to max_readings (all if None) from the reading memory with R?, returns (timestamps, values)
+
+        The readings are spread evenly over the time since the previous fetch.
+        """
+        if max_readings is None:
+            reply = self.instrument.query('R?')
+        else:
+            reply = self.instrument.query('R? ' + str(int(max_readings)))
+        now = time.time()
+        started = now if self.last_fetch is None else self.last_fetch
+        self.last_fetch = now
+        # R? answers with a definite length block (#<N><length><readings>)
+        start, stop = block_span(reply)
+        values = self.parse_samples(reply[start:stop])
+        timestamps = np.linspace(started, now, len(values) + 1)[1:]
+        return timestamps, values
+
+    def parse_samples(self, reply):
+        reply = reply.strip().rstrip(',')
+        if not reply:
+            return np.empty(0)
+        return np.array(reply.split(','), dtype=float)
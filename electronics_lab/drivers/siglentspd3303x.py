@@ -1,77 +1,199 @@
-import vxi11
-from .driver import Driver
+import logging
+import threading
+import time
+import numpy as np
+from .driver import Driver, log
+from .session import open_vxi11, pool
+
+
+def output_state(status, channel):
+    """Returns 1 if the channel output is on in a SYST:STAT? status word, bit 4 is CH1 and bit 5 is CH2"""
+    return (status >> (channel + 3)) & 1
+
+
+telemetry_dtype = np.dtype([('time', 'f8'),
+                            ('ch1_voltage', 'f8'), ('ch1_current', 'f8'), ('ch1_power', 'f8'), ('ch1_output', 'u1'),
+                            ('ch2_voltage', 'f8'), ('ch2_current', 'f8'), ('ch2_power', 'f8'), ('ch2_output', 'u1')])
 
 
 class SiglentSPD3303X(Driver):
+    transport = 'vxi11'
 
     def __init__(self, ip_string, debug=False):
-        self.instrument = vxi11.Instrument(ip_string)
+        self.instrument = pool.acquire(ip_string, open_vxi11)
         self.debug = debug
 
     def print_info(self):
         print("Instrument information: {}".format(self.instrument.ask("*IDN?")))
 
-    voltage = Driver.Measurement(name='voltage', command='DC', unit='Volts', return_type='float',
-                                 description='DC voltage value')
-    current = Driver.Measurement(name='current', command='DC', unit='Amperes', return_type='float',
-                                 description='DC current value')
-    power = Driver.Measurement(name='power', command='DC', unit='Watts', return_type='float',
-                               description='DC power value')
-    out = Driver.Measurement(name='out', command='DC', unit=None, return_type='str',
-                             description='channel ON or OFF')
-
-    def get_measurement(self, channel=1, meas_type=voltage):
-
-        if meas_type.unit == 'Volts':
-            reading = float(self.instrument.ask('MEAS:VOLT? CH{}'.format(channel)))
-            print("Channel " + str(channel) + " value is " + str(reading) + " " + meas_type.unit)
+    def query(self, command):
+        return self.instrument.ask(command)
 
-        if meas_type.unit == 'Amperes':
-            reading = float(self.instrument.ask('MEAS:CURR? CH{}'.format(channel)))
-            print("Channel " + str(channel) + " value is " + str(reading) + " " + meas_type.unit)
+    voltage = Driver.Measurement(name='voltage', command='VOLT', unit='Volts', return_type='float',
+                                 template='MEAS:{command}? CH{channel}', description='DC voltage value')
+    current = Driver.Measurement(name='current', command='CURR', unit='Amperes', return_type='float',
+                                 template='MEAS:{command}? CH{channel}', description='DC current value')
+    power = Driver.Measurement(name='power', command='POWE', unit='Watts', return_type='float',
+                               template='MEAS:{command}? CH{channel}', description='DC power value')
+    out = Driver.Measurement(name='out', command='SYST:STAT', unit=None, return_type='int',
+                             template='{command}?', parser=lambda text, channel: output_state(int(text, 16), channel),
+                             description='channel ON (1) or OFF (0)')
 
-        if meas_type.unit == 'Watts':
-            reading = float(self.instrument.ask('MEAS:POWE? CH{}'.format(channel)))
-            print("Channel " + str(channel) + " value is " + str(reading) + " " + meas_type.unit)
-
-        if meas_type.unit is None:
-            reading = int(self.instrument.ask('SYST:STAT?'), 16)
-            reading = str(format(reading, '10b'))
-            if channel == 1:
-                reading = str(reading[5])
-
-            if channel == 2:
-                reading = str(reading[6])
-
-            if reading == '1':
-                out = "ON"
-            else:
-                out = "OFF"
-            print("Channel " + str(channel) + " is " + str(out) + " ")
-
-            try:
-                reading = int(reading)
-            except TypeError:
-                reading = None
+    # setting key written by set_param for each parameter name, the output state is never cached
+    setting_keys = {'voltage': 'CH{channel}:VOLT', 'current': 'CH{channel}:CURR', 'out': 'OUTP CH{channel}'}
+    output_values = {1: 'ON', '1': 'ON', 'ON': 'ON', 0: 'OFF', '0': 'OFF', 'OFF': 'OFF'}
 
+    def get_measurement(self, channel=1, meas_type=voltage):
+        reading = meas_type.reading(self.instrument.ask(meas_type.query(channel)), channel)
+        self.log_reading(reading)
         return reading
 
-    def set_param(self, channel=1, param=voltage, value=0):
+    def format_reading(self, reading):
+        if reading.name == 'out':
+            return "Channel " + str(reading.channel) + " is " + self.output_values[reading.value]
+        return str(reading)
 
-        if param.name == 'voltage':
-            self.instrument.write('CH' + str(channel) + ':VOLT ' + str(value))
-            print("Set Channel " + str(channel) + " value as " + str(value) + " " + param.unit)
-
-        if param.name == 'current':
-            self.instrument.write('CH' + str(channel) + ':CURR ' + str(value))
-            print("Set Channel " + str(channel) + " value as " + str(value) + " " + param.unit)
-
-        if param.unit is None:
-            if value == 1 or value == '1' or value == 'ON':
-                self.instrument.write('OUTP CH' + str(channel) + ',ON')
-                print("Set Channel " + str(channel) + " state as ON ")
-            elif value == 0 or value == '0' or value == 'OFF':
-                self.instrument.write('OUTP CH' + str(channel) + ',OFF')
-                print("Set Channel " + str(channel) + " state as OFF ")
-            else:
-                print("INVALID command")
+    def set_param(self, channel=1, param=voltage, value=0):
+        key = self.setting_keys[param.name].format(channel=channel)
+        if param.name == 'out':
+            if value not in self.output_values:
+                log.warning("INVALID command: output state %r", value)
+                return
+            value = self.output_values[value]
+            # OVP, OCP and the front panel switch outputs off behind the cache, so the output state is always sent
+            self.instrument.write(self.setting_command(key, value))
+        elif not self.write_setting(key, value):
+            return
+        if log.isEnabledFor(logging.INFO):
+            log.info("Set Channel %s %s as %s %s", channel, param.name, value, param.unit or '')
+
+    # outputs are switched with 'OUTP CH1,ON' and read back from the status word
+    def setting_command(self, key, value):
+        if key.upper().startswith('OUTP '):
+            return key + ',' + str(value)
+        return Driver.setting_command(self, key, value)
+
+    def read_setting(self, key):
+        if key.upper().startswith('OUTP '):
+            status = int(self.query('SYST:STAT?'), 16)
+            return 'ON' if output_state(status, int(key.upper().split('CH')[-1])) else 'OFF'
+        return Driver.read_setting(self, key)
+
+    def telemetry(self, rate=10.0, capacity=36000):
+        """Returns a SupplyTelemetry logger for both channels, call start() on it to begin polling"""
+        return SupplyTelemetry(self, rate, capacity)
+
+
+class SupplyTelemetry(object):
+    """Polls both channels of a SiglentSPD3303X at a fixed rate into a ring buffer
+
+    Each cycle reads voltage and current per channel and the status word
+    once for both outputs, power is computed as voltage * current instead
+    of two more MEAS:POWE? round trips. The newest capacity samples are
+    kept in a telemetry_dtype structured array. A poll that raises stops
+    the logger, the exception is kept in error and raised by iteration.
+    """
+
+    def __init__(self, supply, rate=10.0, capacity=36000):
+        self.supply = supply
+        self.period = 1.0 / rate
+        self.buffer = np.zeros(capacity, dtype=telemetry_dtype)
+        self.count = 0
+        self.missed_deadlines = 0
+        self.first_time = None
+        self.condition = threading.Condition()
+        self.running = False
+        self.error = None
+        self._thread = None
+
+    def poll_once(self):
+        status = int(self.supply.query('SYST:STAT?'), 16)
+        sample = [time.time()]
+        for channel in (1, 2):
+            voltage = float(self.supply.query('MEAS:VOLT? CH' + str(channel)))
+            current = float(self.supply.query('MEAS:CURR? CH' + str(channel)))
+            sample += [voltage, current, voltage * current, output_state(status, channel)]
+        with self.condition:
+            self.buffer[self.count % len(self.buffer)] = tuple(sample)
+            if self.first_time is None:
+                self.first_time = sample[0]
+            self.count += 1
+            self.condition.notify_all()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='spd3303x-telemetry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            self._poll_forever()
+        except Exception as error:
+            log.exception("Supply telemetry stopped")
+            self.error = error
+        finally:
+            # wakes the iterators, which raise error
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def _poll_forever(self):
+        deadline = time.monotonic()
+        while self.running:
+            self.poll_once()
+            deadline += self.period
+            now = time.monotonic()
+            if now > deadline:
+                # the poll overran, skip the deadlines that have already passed
+                skipped = int((now - deadline) / self.period) + 1
+                self.missed_deadlines += skipped
+                deadline += skipped * self.period
+            with self.condition:
+                if self.running:
+                    self.condition.wait(deadline - now)
+
+    @property
+    def achieved_rate(self):
+        """Samples per second since the first sample"""
+        with self.condition:
+            if self.count < 2:
+                return 0.0
+            last = self.buffer[(self.count - 1) % len(self.buffer)]['time']
+            return (self.count - 1) / (last - self.first_time)
+
+    def samples_since(self, count):
+        """Returns (samples recorded after the first count, new count), samples already overwritten are lost"""
+        with self.condition:
+            first = max(count, self.count - len(self.buffer))
+            indices = np.arange(first, self.count) % len(self.buffer)
+            return self.buffer[indices], self.count
+
+    def snapshot(self):
+        """Returns a copy of the buffered samples, oldest first"""
+        return self.samples_since(0)[0]
+
+    def __iter__(self):
+        """Yields every new sample as it is recorded until stop() is called, raises the error that stopped polling"""
+        seen = self.count
+        while True:
+            with self.condition:
+                while self.count == seen and self.running:
+                    self.condition.wait()
+                if self.count == seen:
+                    if self.error is not None:
+                        raise self.error
+                    return
+            samples, seen = self.samples_since(seen)
+            for sample in samples:
+                yield sample
@@ -0,0 +1,502 @@
+"""
+Simulated instruments for running the drivers without hardware
+
+Open them through the normal drivers with a SIM:: resource string, e.g.
+
+    scope = RigolDS1054z('SIM::DS1054Z?latency=0.002&bandwidth=5e6&memory_depth=600000')
+    supply = SiglentSPD3303X('SIM::SPD3303X')
+
+Each model is described pyvisa-sim style by its dialogues (fixed replies)
+and properties (settings that are stored on write and returned on query),
+plus handlers for the commands that generate data: synthetic waveforms,
+measurements and IEEE 488.2 binary blocks of configurable size. The same
+object serves the pyvisa resource calls (write/query/read_raw/read_bytes/
+write_raw/write_binary_values) and the vxi11.Instrument calls (ask/write).
+latency adds seconds per transaction and bandwidth limits bytes per second.
+"""
+
+import json
+import re
+import struct
+import time
+import zlib
+from urllib.parse import parse_qsl
+import numpy as np
+from .driver import block_header, block_payload
+
+
+class UnknownCommand(Exception):
+    pass
+
+
+def make_block(payload):
+    """Wraps payload in an IEEE 488.2 definite length block header"""
+    return block_header(len(payload)) + payload
+
+
+def parse_block(data):
+    """Returns the payload of a definite length block"""
+    return bytes(block_payload(data))
+
+
+class SimInstrument(object):
+    idn = 'electronics_lab,Simulated Instrument,SIM0000,1.0'
+    # query -> fixed reply
+    dialogues = {}
+    # header -> value returned by 'header?' until 'header value' changes it
+    properties = {}
+    # (regular expression matched against the upper case header, method name)
+    handlers = []
+
+    def __init__(self, latency=0.0, bandwidth=0.0, **options):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.options = options
+        self.timeout = 2000
+        self.chunk_size = 20 * 1024
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.commands = []
+        self.errors = []
+        self.closed = False
+        self._output = b''
+        self._handlers = [(re.compile(pattern + '$'), getattr(self, name)) for pattern, name in self.handlers]
+        self.reset()
+
+    def reset(self):
+        self.state = dict(self.properties)
+
+    # transport calls
+
+    def write(self, message):
+        self._transaction(len(message))
+        replies = []
+        for command in message.strip().split(';'):
+            if command.strip():
+                reply = self.handle(command.strip())
+                if reply is not None:
+                    replies.append(reply)
+        self._queue(replies)
+        return len(message)
+
+    def write_raw(self, data):
+        self._transaction(len(data))
+        header, _, arguments = bytes(data).partition(b' ')
+        reply = self.handle_binary(header.decode().upper().lstrip(':'), arguments)
+        self._queue([] if reply is None else [reply])
+        return len(data)
+
+    def write_binary_values(self, message, values, datatype='B', is_big_endian=False):
+        payload = struct.pack(('>' if is_big_endian else '<') + datatype * len(values), *values)
+        return self.write_raw(message.encode() + make_block(payload) + b'\n')
+
+    def read_raw(self, size=None):
+        data, self._output = self._output, b''
+        self._transfer(len(data))
+        return data
+
+    def read_bytes(self, count, chunk_size=None, break_on_termchar=False):
+        data, self._output = self._output[:count], self._output[count:]
+        self._transfer(len(data))
+        return data
+
+    def read(self):
+        return self.read_raw().decode().rstrip('\r\n')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    ask = query
+
+    def close(self):
+        self.closed = True
+
+    # command handling
+
+    def handle(self, command):
+        self.commands.append(command)
+        header, _, arguments = command.partition(' ')
+        header = header.upper().lstrip(':')
+        arguments = arguments.strip()
+        for pattern, handler in self._handlers:
+            match = pattern.match(header)
+            if match:
+                return handler(arguments, *match.groups())
+        if command.upper() in self.dialogues:
+            return self.dialogues[command.upper()]
+        if header == '*IDN?':
+            return self.idn
+        if header == '*OPC?':
+            return '1'
+        if header == '*RST':
+            self.reset()
+            return None
+        if header == 'SYST:ERR?':
+            return self.errors.pop(0) if self.errors else '0,"No error"'
+        if header.endswith('?'):
+            if header[:-1] in self.state:
+                return self.state[header[:-1]]
+            self.errors.append('-113,"Undefined header"')
+            raise UnknownCommand("{} has no reply for {!r}".format(type(self).__name__, command))
+        self.state[header] = arguments
+        return None
+
+    def handle_binary(self, header, data):
+        self.commands.append(header)
+        raise UnknownCommand("{} does not accept binary data for {}".format(type(self).__name__, header))
+
+    def _queue(self, replies):
+        if not replies:
+            return
+        if len(replies) == 1 and isinstance(replies[0], bytes):
+            self._output += replies[0] + b'\n'
+        else:
+            self._output += ';'.join(replies).encode() + b'\n'
+
+    def _transaction(self, size):
+        if self.latency:
+            time.sleep(self.latency)
+        self._transfer(size)
+
+    def _transfer(self, size):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+
+def synthetic_signal(shape, frequency, amplitude, offset, phase, time_axis):
+    """Returns the volts of a sine or square wave at each time"""
+    angle = 2 * np.pi * frequency * time_axis + np.radians(phase)
+    if shape == 'square':
+        return offset + amplitude * np.where(np.sin(angle) >= 0, 1.0, -1.0)
+    return offset + amplitude * np.sin(angle)
+
+
+def rigol_properties():
+    properties = {
+        'TIM:MAIN:SCAL': '1.000000e-03', 'TIM:MAIN:OFFS': '0.000000e+00',
+        'TRIG:EDG:SOUR': 'CHAN1', 'TRIG:EDG:SLOP': 'POS', 'TRIG:EDG:LEV': '0.000000e+00',
+        'ACQ:MDEP': 'AUTO', 'WAV:SOUR': 'CHAN1', 'WAV:MODE': 'NORM', 'WAV:FORM': 'BYTE',
+        'WAV:STAR': '1', 'WAV:STOP': '1200',
+    }
+    for channel in range(1, 5):
+        properties.update({'CHAN{}:DISP'.format(channel): '1' if channel < 3 else '0',
+                           'CHAN{}:SCAL'.format(channel): '1.000000e+00',
+                           'CHAN{}:OFFS'.format(channel): '0.000000e+00',
+                           'CHAN{}:PROB'.format(channel): '1.000000e+01'})
+    for channel in range(1, 3):
+        properties.update({'DEC{}:MODE'.format(channel): 'PAR', 'DEC{}:DISP'.format(channel): '0',
+                           'DEC{}:CONF:LINE'.format(channel): '0'})
+    return properties
+
+
+class SimRigolDS1054z(SimInstrument):
+    idn = 'RIGOL TECHNOLOGIES,DS1054Z,DS1ZA000000001,00.04.04.SP3'
+    properties = rigol_properties()
+    handlers = [(r'RUN', 'run'), (r'STOP', 'stop'), (r'SING', 'single'), (r'TFOR', 'force'),
+                (r'TRIG:STAT\?', 'trigger_status'), (r'MEAS:ITEM\?', 'measure_item'),
+                (r'WAV:PRE\?', 'waveform_preamble'), (r'WAV:DATA\?', 'waveform_data'),
+                (r'DISP:DATA\?', 'screen_data'), (r'SYST:SET\?', 'settings_data')]
+    # points per :WAV:DATA? in BYTE format, as on the scope
+    max_byte_points = 250000
+    screen_points = 1200
+
+    def __init__(self, latency=0.0, bandwidth=0.0, memory_depth=12000, screen_bytes=60000, trigger_delay=0.0,
+                 **options):
+        self.memory_depth = int(memory_depth)
+        self.screen_bytes = int(screen_bytes)
+        self.trigger_delay = trigger_delay
+        # channel -> (shape, frequency, amplitude, offset, phase in degrees)
+        self.signals = {1: ('sine', 1e3, 1.0, 0.0, 0.0), 2: ('square', 1e3, 1.65, 1.65, 0.0),
+                        3: ('sine', 1e3, 0.5, 0.0, -45.0), 4: ('sine', 1e4, 0.2, 0.0, 0.0)}
+        self.frames = 0
+        SimInstrument.__init__(self, latency, bandwidth, **options)
+
+    def reset(self):
+        SimInstrument.reset(self)
+        self.status = 'AUTO'
+        self.armed_at = None
+        self.held = None
+
+    # a stopped scope keeps measuring the signals it captured, even when the inputs change afterwards
+    def captured_signals(self):
+        return self.held if self.status == 'STOP' and self.held is not None else self.signals
+
+    # trigger state machine, a single acquisition stops trigger_delay seconds after it was armed
+
+    def run(self, arguments):
+        self.status, self.armed_at = 'AUTO', None
+        self.frames += 1
+
+    def stop(self, arguments):
+        if self.status != 'STOP':
+            self.held = dict(self.signals)
+        self.status, self.armed_at = 'STOP', None
+
+    def single(self, arguments):
+        self.status, self.armed_at = 'WAIT', time.monotonic()
+
+    def force(self, arguments):
+        if self.status == 'WAIT':
+            self.status, self.armed_at, self.held = 'STOP', None, dict(self.signals)
+            self.frames += 1
+
+    def trigger_status(self, arguments):
+        if self.status == 'WAIT' and time.monotonic() - self.armed_at >= self.trigger_delay:
+            self.status, self.armed_at, self.held = 'STOP', None, dict(self.signals)
+            self.frames += 1
+        elif self.status in ('AUTO', 'TD', 'RUN'):
+            self.frames += 1
+        return self.status
+
+    # waveforms
+
+    def raw_points(self):
+        depth = self.state['ACQ:MDEP']
+        return int(float(depth)) if depth != 'AUTO' else self.memory_depth
+
+    def preamble(self):
+        points = self.raw_points() if self.state['WAV:MODE'] in ('RAW', 'MAX') else self.screen_points
+        source = self.state['WAV:SOUR']
+        scale = float(self.state.get(source + ':SCAL', '1')) if source.startswith('CHAN') else 1.0
+        time_scale = float(self.state['TIM:MAIN:SCAL'])
+        return {'points': points, 'xincrement': time_scale * 12 / points,
+                'xorigin': -6 * time_scale + float(self.state['TIM:MAIN:OFFS']), 'xreference': 0,
+                'yincrement': scale / 25, 'yorigin': 0, 'yreference': 127}
+
+    def waveform_preamble(self, arguments):
+        preamble = self.preamble()
+        format_code = {'WORD': 1, 'ASC': 2}.get(self.state['WAV:FORM'], 0)
+        mode_code = {'MAX': 1, 'RAW': 2}.get(self.state['WAV:MODE'], 0)
+        return '{},{},{},1,{:e},{:e},{},{:e},{},{}'.format(
+            format_code, mode_code, preamble['points'], preamble['xincrement'], preamble['xorigin'],
+            preamble['xreference'], preamble['yincrement'], preamble['yorigin'], preamble['yreference'])
+
+    def channel_volts(self, channel, time_axis):
+        return synthetic_signal(*(self.captured_signals()[channel] + (time_axis,)))
+
+    def waveform_data(self, arguments):
+        preamble = self.preamble()
+        start = max(int(self.state['WAV:STAR']), 1)
+        stop = min(int(self.state['WAV:STOP']), preamble['points'])
+        if self.state['WAV:FORM'] == 'BYTE':
+            stop = min(stop, start + self.max_byte_points - 1)
+        time_axis = (np.arange(start - 1, stop) - preamble['xreference']) * preamble['xincrement'] + \
+            preamble['xorigin']
+        volts = self.channel_volts(int(self.state['WAV:SOUR'][4:]), time_axis)
+        if self.state['WAV:FORM'] == 'ASC':
+            return make_block(','.join('{:e}'.format(volt) for volt in volts).encode())
+        codes = np.round(volts / preamble['yincrement']) + preamble['yorigin'] + preamble['yreference']
+        return make_block(np.clip(codes, 0, 255).astype(np.uint8).tobytes())
+
+    # measurements are computed from the screen waveform of each source
+
+    def measure_item(self, arguments):
+        fields = [field.strip().upper() for field in arguments.split(',')]
+        item, sources = fields[0], [int(field[4:]) for field in fields[1:]]
+        time_scale = float(self.state['TIM:MAIN:SCAL'])
+        time_axis = (np.arange(self.screen_points) * 12.0 / self.screen_points - 6) * time_scale
+        signals = self.captured_signals()
+        shape, frequency, amplitude, offset, phase = signals[sources[0]]
+        volts = self.channel_volts(sources[0], time_axis)
+        period = 1.0 / frequency
+        edges = int(frequency * 12 * time_scale)
+        if len(sources) > 1:
+            delay = (phase - signals[sources[1]][4]) / 360.0 * period
+        values = {
+            'VMAX': volts.max(), 'VMIN': volts.min(), 'VPP': volts.max() - volts.min(),
+            'VTOP': offset + amplitude, 'VBAS': offset - amplitude, 'VAMP': 2 * amplitude,
+            'VAVG': volts.mean(), 'VRMS': np.sqrt(np.mean(volts ** 2)), 'PVRMS': np.sqrt(np.mean(volts ** 2)),
+            'VARI': volts.var(), 'VUP': offset + 0.8 * amplitude, 'VMID': offset, 'VLOW': offset - 0.8 * amplitude,
+            'OVER': 0.0, 'PRES': 0.0, 'PER': period, 'FREQ': frequency,
+            'PWID': period / 2, 'NWID': period / 2, 'PDUT': 0.5, 'NDUT': 0.5,
+            'TVMAX': time_axis[volts.argmax()], 'TVMIN': time_axis[volts.argmin()],
+            'PPUL': edges, 'NPUL': edges, 'PEDG': edges, 'NEDG': edges,
+            'MAR': volts.mean() * 12 * time_scale, 'MPAR': 0.0,
+        }
+        if shape == 'square':
+            values.update({'RTIM': 0.0, 'FTIM': 0.0})
+        else:
+            # 10 % to 90 % of a sine takes 0.2952 of a period, the slew is taken over that span
+            slew = 1.6 * amplitude / (0.2952 * period)
+            values.update({'RTIM': 0.2952 * period, 'FTIM': 0.2952 * period, 'PSLEW': slew, 'NSLEW': -slew})
+        if len(sources) > 1:
+            values.update({'RDEL': delay, 'FDEL': delay, 'RPH': delay / period * 360, 'FPH': delay / period * 360})
+        # the scope answers 9.9E37 for items it cannot measure
+        return '{:e}'.format(values.get(item, 9.9e37))
+
+    # screen captures change whenever the settings change or a new acquisition is taken
+
+    def screen_data(self, arguments):
+        seed = zlib.crc32(json.dumps(self.state, sort_keys=True).encode()) ^ self.frames
+        body = np.random.RandomState(seed & 0xffffffff).bytes(max(self.screen_bytes - 8, 0))
+        return make_block(b'\x89PNG\r\n\x1a\n' + body)
+
+    def settings_data(self, arguments):
+        return make_block(json.dumps(self.state, sort_keys=True).encode())
+
+    def handle_binary(self, header, data):
+        self.commands.append(header)
+        if header == 'SYST:SET':
+            self.state.update(json.loads(parse_block(data).decode()))
+            return None
+        return SimInstrument.handle_binary(self, header, data)
+
+
+class SimSiglentSDM3055(SimInstrument):
+    idn = 'Siglent Technologies,SDM3055,SDM35HBQ000000,1.01.01.25'
+    properties = {'SAMP:COUN': '1', 'TRIG:SOUR': 'IMM', 'VOLT:DC:NPLC': '10', 'CURR:DC:NPLC': '10',
+                  'RES:NPLC': '10'}
+    handlers = [(r'MEAS:(VOLT:DC|VOLT:AC|CURR:DC|CURR:AC|CAP|RES|FREQ|PER)\?', 'measure'),
+                (r'CONF:(VOLT:DC|VOLT:AC|CURR:DC|CURR:AC|CAP|RES|FREQ|PER)', 'configure'),
+                (r'READ\?', 'read_readings'), (r'INIT', 'initiate'), (r'\*TRG', 'trigger'),
+                (r'R\?', 'remove_readings')]
+
+    def __init__(self, latency=0.0, bandwidth=0.0, noise=1e-4, **options):
+        # function -> nominal reading, noise is relative
+        self.readings = {'VOLT:DC': 5.0, 'VOLT:AC': 0.707, 'CURR:DC': 0.1, 'CURR:AC': 0.05, 'CAP': 1e-6,
+                         'RES': 1e3, 'FREQ': 1e3, 'PER': 1e-3}
+        self.noise = noise
+        self.random = np.random.RandomState(0)
+        SimInstrument.__init__(self, latency, bandwidth, **options)
+
+    def reset(self):
+        SimInstrument.reset(self)
+        self.function = 'VOLT:DC'
+        self.memory = []
+        self.initiated = False
+
+    def sample(self, function, count=1):
+        return self.readings[function] * (1 + self.noise * self.random.standard_normal(count))
+
+    def format(self, values):
+        return ','.join('{:+.8E}'.format(value) for value in values)
+
+    def measure(self, arguments, function):
+        self.function = function
+        return self.format(self.sample(function))
+
+    def configure(self, arguments, function):
+        self.function = function
+
+    def read_readings(self, arguments):
+        return self.format(self.sample(self.function, int(self.state['SAMP:COUN'])))
+
+    # with the BUS trigger source INIT only arms the meter, *TRG takes the readings
+    def initiate(self, arguments):
+        self.initiated = True
+        if self.state['TRIG:SOUR'] != 'BUS':
+            self.trigger(arguments)
+
+    def trigger(self, arguments):
+        if self.initiated:
+            self.initiated = False
+            self.memory.extend(self.sample(self.function, int(self.state['SAMP:COUN'])))
+
+    def remove_readings(self, arguments):
+        count = int(arguments) if arguments else len(self.memory)
+        readings, self.memory = self.memory[:count], self.memory[count:]
+        return make_block(self.format(readings).encode())
+
+
+class SimSiglentSPD3303X(SimInstrument):
+    idn = 'Siglent Technologies,SPD3303X-E,SPD3XIDD000000,1.01.01.02.05,V3.0'
+    properties = {'CH1:VOLT': '0.000', 'CH1:CURR': '3.200', 'CH2:VOLT': '0.000', 'CH2:CURR': '3.200'}
+    handlers = [(r'MEAS:(VOLT|CURR|POWE)\?', 'measure'), (r'OUTP', 'output'), (r'SYST:STAT\?', 'status')]
+
+    def __init__(self, latency=0.0, bandwidth=0.0, load=10.0, **options):
+        # resistive load in ohms on both outputs
+        self.load = load
+        SimInstrument.__init__(self, latency, bandwidth, **options)
+
+    def reset(self):
+        SimInstrument.reset(self)
+        self.outputs = {1: False, 2: False}
+
+    def output_values(self, channel):
+        if not self.outputs[channel]:
+            return 0.0, 0.0
+        voltage = float(self.state['CH{}:VOLT'.format(channel)])
+        # constant current once the load would draw more than the limit
+        current = min(voltage / self.load, float(self.state['CH{}:CURR'.format(channel)]))
+        return current * self.load, current
+
+    def measure(self, arguments, quantity):
+        voltage, current = self.output_values(int(arguments.upper().replace('CH', '')))
+        return '{:.3f}'.format({'VOLT': voltage, 'CURR': current, 'POWE': voltage * current}[quantity])
+
+    def output(self, arguments):
+        channel, state = arguments.upper().split(',')
+        self.outputs[int(channel.replace('CH', ''))] = state.strip() == 'ON'
+
+    def status(self, arguments):
+        return '0x{:X}'.format(self.outputs[1] << 4 | self.outputs[2] << 5)
+
+
+class SimSiglentSDG1032X(SimInstrument):
+    idn = 'Siglent Technologies,SDG1032X,SDG1XCAQ000000,1.01.01.33R1'
+    handlers = [(r'C([12]):BSWV', 'basic_wave'), (r'C([12]):BSWV\?', 'basic_wave_query'),
+                (r'C([12]):OUTP', 'output'), (r'C([12]):OUTP\?', 'output_query'),
+                (r'C([12]):ARWV', 'select_arb'), (r'C([12]):ARWV\?', 'arb_query')]
+
+    def reset(self):
+        SimInstrument.reset(self)
+        self.waves = dict((channel, {'WVTP': 'SINE', 'FRQ': '1000HZ', 'AMP': '4V', 'OFST': '0V', 'PHSE': '0'})
+                          for channel in '12')
+        self.outputs = {'1': 'OFF', '2': 'OFF'}
+        self.output_settings = dict((channel, {'LOAD': 'HZ', 'PLRT': 'NOR'}) for channel in '12')
+        self.arbs = {}
+        self.selected_arbs = {'1': None, '2': None}
+
+    def basic_wave(self, arguments, channel):
+        fields = [field.strip() for field in arguments.split(',')]
+        self.waves[channel].update(zip(fields[::2], fields[1::2]))
+
+    def basic_wave_query(self, arguments, channel):
+        wave = self.waves[channel]
+        return 'C{}:BSWV '.format(channel) + ','.join(key + ',' + value for key, value in wave.items())
+
+    # 'ON', 'LOAD,50' and 'OFF,LOAD,HZ,PLRT,NOR' are all valid, the state is the only unpaired field
+    def output(self, arguments, channel):
+        fields = [field.strip().upper() for field in arguments.split(',')]
+        if len(fields) % 2:
+            self.outputs[channel] = fields.pop(0)
+        self.output_settings[channel].update(zip(fields[::2], fields[1::2]))
+
+    def output_query(self, arguments, channel):
+        settings = self.output_settings[channel]
+        return 'C{}:OUTP {},LOAD,{},PLRT,{}'.format(channel, self.outputs[channel], settings['LOAD'], settings['PLRT'])
+
+    def select_arb(self, arguments, channel):
+        name = arguments.split(',')[1].strip()
+        self.selected_arbs[channel] = name
+        self.waves[channel]['WVTP'] = 'ARB'
+
+    def arb_query(self, arguments, channel):
+        return 'C{}:ARWV NAME,{}'.format(channel, self.selected_arbs[channel])
+
+    def handle_binary(self, header, data):
+        match = re.match(r'C([12]):WVDT$', header)
+        if not match:
+            return SimInstrument.handle_binary(self, header, data)
+        self.commands.append(header)
+        parameters, _, samples = data.partition(b'WAVEDATA,')
+        fields = [field.strip() for field in parameters.decode().rstrip(',').split(',')]
+        settings = dict(zip(fields[::2], fields[1::2]))
+        self.arbs[settings['WVNM']] = np.frombuffer(samples, dtype='<i2').copy()
+        wave = self.waves[match.group(1)]
+        for name, field in (('FREQ', 'FRQ'), ('AMPL', 'AMP'), ('OFST', 'OFST'), ('PHASE', 'PHSE')):
+            if name in settings:
+                wave[field] = settings[name]
+        return None
+
+
+models = {'DS1054Z': SimRigolDS1054z, 'SDM3055': SimSiglentSDM3055, 'SPD3303X': SimSiglentSPD3303X,
+          'SDG1032X': SimSiglentSDG1032X}
+
+
+def open_resource(resource_string):
+    """Opens 'SIM::<model>[?option=value&...]', options are passed to the model as floats"""
+    model, _, options = resource_string.split('::', 1)[1].partition('?')
+    options = dict((name, float(value)) for name, value in parse_qsl(options))
+    return models[model.upper()](**options)
@@ -0,0 +1,64 @@
+"""Client side mirror of instrument settings, so writes that change nothing can be skipped
+
+Keys are SCPI setting headers, e.g. ':CHAN1:SCAL'. Values are compared
+after normalization: numbers by value ('1.0' == '1.000000e+00' == 1),
+everything else case insensitively, with ON/OFF equal to 1/0.
+"""
+
+scpi_booleans = {'ON': '1', 'OFF': '0'}
+
+
+def normalize_key(key):
+    return ' '.join(key.split()).upper().lstrip(':')
+
+
+def normalize_value(value):
+    text = str(value).strip()
+    try:
+        return '{:.9g}'.format(float(text))
+    except ValueError:
+        pass
+    text = text.upper()
+    return scpi_booleans.get(text, text)
+
+
+class StateCache(object):
+    """Settings last written to or read from one instrument
+
+    digest identifies the instrument state the cache was last known to
+    match, e.g. the hash of the scope's :SYST:SET? blob, it is cleared by
+    every write so only an unchanged instrument can skip a resync.
+    uploads maps the content hash of data stored on the instrument, e.g.
+    an arbitrary waveform, to the name it was stored under.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.uploads = {}
+        self.digest = None
+        self.skipped = 0
+        self.written = 0
+
+    def matches(self, key, value):
+        return self.values.get(normalize_key(key)) == normalize_value(value)
+
+    def get(self, key, default=None):
+        return self.values.get(normalize_key(key), default)
+
+    def set(self, key, value):
+        self.values[normalize_key(key)] = normalize_value(value)
+
+    def invalidate(self, key=None):
+        """Forgets one setting, or every setting when key is None"""
+        if key is None:
+            self.values.clear()
+            self.uploads.clear()
+        else:
+            self.values.pop(normalize_key(key), None)
+        self.digest = None
+
+    def __contains__(self, key):
+        return normalize_key(key) in self.values
+
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,177 @@
+"""Frequency response sweeps across a function generator and an oscilloscope
+
+The generator drives the device under test, the scope measures its input
+and output, e.g.
+
+    sweep = FrequencySweep(SiglentSDG1032X(...), RigolDS1054z(...), input_channel=1, output_channel=2)
+    results = sweep.run(frequency_plan(10, 100e3, 61))
+    plot(results['frequency'], results['gain_db'])
+
+Each point waits settle_cycles periods of its own frequency, so the sweep
+time follows the signal and the instruments' latency rather than a worst
+case sleep. Once a capture has stopped the next frequency is sent to the
+generator on a worker thread while the scope reads back the current point.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from math import floor, log10
+
+import numpy as np
+
+sweep_dtype = np.dtype([('frequency', 'f8'), ('input_vpp', 'f8'), ('output_vpp', 'f8'), ('gain_db', 'f8'),
+                        ('phase', 'f8'), ('measured_frequency', 'f8'), ('time', 'f8'), ('acquisitions', 'u2')])
+
+# the scope answers this for measurements it cannot make, e.g. a phase without edges
+invalid_measurement = 9.9e37
+
+
+def frequency_plan(start, stop, points, spacing='log'):
+    """Returns the sweep frequencies, spacing is 'log' or 'linear'"""
+    if spacing == 'log':
+        return np.geomspace(start, stop, points)
+    if spacing == 'linear':
+        return np.linspace(start, stop, points)
+    raise ValueError("spacing must be 'log' or 'linear', not {!r}".format(spacing))
+
+
+def timebase_for(frequency, cycles=3.0, divisions=12):
+    """Returns the smallest 1-2-5 step time/div showing at least cycles periods across the screen"""
+    target = cycles / frequency / divisions
+    exponent = floor(log10(target))
+    for mantissa in (1, 2, 5, 10):
+        value = round(mantissa * 10.0 ** exponent, 15)
+        if value >= target * (1 - 1e-9):
+            return value
+
+
+def valid(value):
+    return float('nan') if abs(value) >= invalid_measurement else value
+
+
+class FrequencySweep(object):
+    """Measures gain and phase from input_channel to output_channel of the scope at each frequency
+
+    generator needs setup_basic_wave, set_frequency, frequency_key and set_output, e.g.
+    SiglentSDG1032X, scope is a RigolDS1054z triggering on input_channel.
+    A capture whose measured input frequency is off by more than tolerance
+    was taken before the generator changed, it is repeated and settle_cycles
+    doubled, every good point relaxes it again down to min_settle_cycles.
+    """
+
+    def __init__(self, generator, scope, generator_channel=1, input_channel=1, output_channel=2, amplitude=1.0,
+                 offset=0.0, cycles=3.0, settle_cycles=4.0, min_settle_cycles=1.0, tolerance=0.02,
+                 max_acquisitions=4, timeout=10.0):
+        self.generator = generator
+        self.scope = scope
+        self.generator_channel = generator_channel
+        self.input_channel = input_channel
+        self.output_channel = output_channel
+        self.amplitude = amplitude
+        self.offset = offset
+        self.cycles = cycles
+        self.settle_cycles = settle_cycles
+        self.min_settle_cycles = min_settle_cycles
+        self.tolerance = tolerance
+        self.max_acquisitions = max_acquisitions
+        self.timeout = timeout
+        self.results = np.zeros(0, dtype=sweep_dtype)
+        self.count = 0
+        self.condition = threading.Condition()
+        self._executor = None
+
+    def run(self, frequencies, on_point=None):
+        """Sweeps the frequencies, returns the results array, on_point(row) is called as each point arrives"""
+        frequencies = np.asarray(frequencies, dtype=float)
+        with self.condition:
+            self.results = np.zeros(len(frequencies), dtype=sweep_dtype)
+            self.results['frequency'] = frequencies
+            self.count = 0
+        if not len(frequencies):
+            return self.results
+        self.generator.setup_basic_wave(self.generator_channel, 'SINE', frequencies[0], self.amplitude, self.offset)
+        self.generator.set_output(self.generator_channel, 'ON')
+        self.scope.setup_trigger(channel=self.input_channel, slope_pos=1, level=self.offset)
+        applied = time.monotonic()
+        try:
+            for index, frequency in enumerate(frequencies):
+                next_frequency = frequencies[index + 1] if index + 1 < len(frequencies) else None
+                row, applied = self.measure_point(frequency, applied, next_frequency)
+                with self.condition:
+                    self.results[index] = row
+                    self.count = index + 1
+                    self.condition.notify_all()
+                if on_point is not None:
+                    on_point(self.results[index])
+        finally:
+            self.close()
+        return self.results
+
+    def measure_point(self, frequency, applied, next_frequency=None):
+        """Captures one point, returns (result row, time the next frequency was applied)"""
+        self.scope.setup_timebase(time_per_div=timebase_for(frequency, self.cycles), delay=0)
+        acquisitions = 0
+        while True:
+            settled = applied + self.settle_cycles / frequency
+            if settled > time.monotonic():
+                time.sleep(settled - time.monotonic())
+            self.scope.single_trigger(self.timeout)
+            self.scope.wait_for_trigger_status(('STOP',), self.timeout)
+            acquisitions += 1
+            # the scope holds the capture, so the generator moves on while it is read back
+            pending = None
+            if next_frequency is not None:
+                pending = self._submit(self._apply_frequency, next_frequency)
+            values = self.read_point()
+            measured = valid(values[self.input_channel]['frequency'])
+            if abs(measured - frequency) <= self.tolerance * frequency or acquisitions >= self.max_acquisitions:
+                break
+            # the capture saw the previous frequency, the generator has not settled yet
+            self.settle_cycles *= 2
+            if pending is not None:
+                pending.result()
+            # the generator's cache may already hold the frequency, forgetting it makes the write go out again
+            self.generator.invalidate(self.generator.frequency_key(self.generator_channel))
+            applied = self._apply_frequency(frequency)
+        if acquisitions == 1:
+            self.settle_cycles = max(self.settle_cycles * 0.8, self.min_settle_cycles)
+        applied = pending.result() if pending is not None else time.monotonic()
+        input_vpp = valid(values[self.input_channel]['peak_to_peak_voltage'])
+        output_vpp = valid(values[self.output_channel]['peak_to_peak_voltage'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain_db = 20 * np.log10(output_vpp / input_vpp)
+        phase = valid(values[(self.input_channel, self.output_channel)]['rising_phase_ratio'])
+        row = (frequency, input_vpp, output_vpp, gain_db, phase, measured, time.time(), acquisitions)
+        return row, applied
+
+    def read_point(self):
+        items = [self.scope.peak_to_peak_voltage, self.scope.frequency, self.scope.rising_phase_ratio]
+        channels = (self.input_channel, self.output_channel, (self.input_channel, self.output_channel))
+        return self.scope.get_measurements(channels=channels, items=items)
+
+    def _apply_frequency(self, frequency):
+        self.generator.set_frequency(self.generator_channel, frequency)
+        return time.monotonic()
+
+    def results_since(self, count):
+        """Returns (points measured after the first count, new count), for reading from another thread"""
+        with self.condition:
+            return self.results[count:self.count].copy(), self.count
+
+    # the generator worker is started for a sweep and stopped when it ends, so no thread outlives run()
+    def _submit(self, function, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='electronics_lab-sweep')
+        return self._executor.submit(function, *args)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
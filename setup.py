@@ -11,7 +11,7 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['pyvisa', 'numpy', 'python-vxi11']
+requirements = ['pyvisa', 'numpy', 'python-vxi11', 'importlib_metadata; python_version<"3.8"']
 
 setup_requirements = []
 
@@ -25,13 +25,13 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description="Drivers and tools for my personal eldectronics lab equipment",
     install_requires=requirements,
@@ -41,6 +41,8 @@ setup(
     keywords='electronics_lab',
     name='electronics_lab',
     packages=find_packages(include=['electronics_lab']),
+    # the lazy driver registry needs module __getattr__ (PEP 562)
+    python_requires='>=3.7',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
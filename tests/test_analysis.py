@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the host side scope measurements."""
+
+
+import unittest
+
+import numpy as np
+
+from electronics_lab.analysis import WaveformAnalysis, double_commands, measure, measure_pair, single_commands
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+
+xincrement = 1e-6
+
+
+def trapezoid(periods=4, high=2.0, ramp=50, width=250, period=1000, spike=0.0):
+    """Pulse train from 0 V to high with linear ramps, times in samples of xincrement"""
+    phase = np.arange(periods * period) % period
+    volts = np.interp(phase, [0, 100, 100 + ramp, 100 + ramp + width, 100 + 2 * ramp + width, period],
+                      [0, 0, high, high, 0, 0])
+    # one sample of overshoot right after each rising ramp
+    volts[phase == 100 + ramp] += spike
+    return volts
+
+
+def sine(frequency=1e3, amplitude=1.0, phase=0.0, points=4000):
+    time_axis = np.arange(points) * xincrement
+    return amplitude * np.sin(2 * np.pi * frequency * time_axis + np.radians(phase))
+
+
+class TestLevels(unittest.TestCase):
+
+    def test_pulse_levels(self):
+        commands = ['VMAX', 'VMIN', 'VPP', 'VTOP', 'VBAS', 'VAMP', 'OVER', 'PRES', 'VUP', 'VMID', 'VLOW']
+        results = measure(trapezoid(spike=0.2), xincrement, commands)
+        self.assertAlmostEqual(results['VMAX'], 2.2)
+        self.assertAlmostEqual(results['VPP'], 2.2)
+        # the flat top wins over the overshoot, to within one histogram bin
+        self.assertAlmostEqual(results['VTOP'], 2.0, delta=2.2 / 255)
+        self.assertEqual(results['VBAS'], 0.0)
+        self.assertAlmostEqual(results['OVER'], 0.1, delta=0.01)
+        self.assertEqual(results['PRES'], 0.0)
+        self.assertAlmostEqual(results['VMID'], results['VAMP'] / 2)
+        self.assertAlmostEqual(results['VUP'] - results['VLOW'], 0.8 * results['VAMP'])
+
+    def test_sine_statistics(self):
+        results = measure(sine(amplitude=2.0, points=4000), xincrement)
+        self.assertEqual(set(results), set(single_commands))
+        self.assertAlmostEqual(results['VRMS'], 2.0 / np.sqrt(2), places=6)
+        self.assertAlmostEqual(results['VARI'], 2.0, places=6)
+        self.assertAlmostEqual(results['VAVG'], 0.0, places=9)
+        # without a flat top the extremes are top and base
+        self.assertEqual(results['VTOP'], results['VMAX'])
+        self.assertAlmostEqual(results['PVRMS'], 2.0 / np.sqrt(2), places=3)
+        self.assertAlmostEqual(results['MAR'], 0.0, places=9)
+        self.assertAlmostEqual(results['MPAR'], 0.0, places=6)
+        self.assertAlmostEqual(results['TVMAX'], 250e-6)
+        self.assertAlmostEqual(results['TVMIN'], 750e-6)
+
+
+class TestTiming(unittest.TestCase):
+
+    def test_pulse_timing(self):
+        results = measure(trapezoid(), xincrement)
+        self.assertAlmostEqual(results['PER'], 1e-3, places=9)
+        self.assertAlmostEqual(results['FREQ'], 1e3, places=3)
+        # 10 % to 90 % of a 50 sample ramp
+        self.assertAlmostEqual(results['RTIM'], 40e-6, places=9)
+        self.assertAlmostEqual(results['FTIM'], 40e-6, places=9)
+        self.assertAlmostEqual(results['PSLEW'], 1.6 / 40e-6, delta=1.0)
+        self.assertAlmostEqual(results['NSLEW'], -1.6 / 40e-6, delta=1.0)
+        self.assertAlmostEqual(results['PWID'], 300e-6, places=9)
+        self.assertAlmostEqual(results['NWID'], 700e-6, places=9)
+        self.assertAlmostEqual(results['PDUT'], 0.3, places=6)
+        self.assertAlmostEqual(results['NDUT'], 0.7, places=6)
+        self.assertEqual((results['PEDG'], results['NEDG'], results['PPUL'], results['NPUL']), (4, 4, 4, 3))
+        self.assertAlmostEqual(results['MPAR'], 2.0 * 300e-6, places=7)
+
+    def test_pulse_from_a_high_start(self):
+        # the first rising edge is incomplete, the widths start at the first full one
+        volts = trapezoid()[300:]
+        results = measure(volts, xincrement, ['PEDG', 'NEDG', 'PWID', 'NWID'])
+        self.assertEqual((results['PEDG'], results['NEDG']), (3, 4))
+        self.assertAlmostEqual(results['PWID'], 300e-6, places=9)
+        self.assertAlmostEqual(results['NWID'], 700e-6, places=9)
+
+    def test_unmeasurable(self):
+        results = measure(np.full(1000, 0.5), xincrement)
+        self.assertEqual((results['VTOP'], results['VBAS']), (0.5, 0.5))
+        for command in ('PER', 'FREQ', 'RTIM', 'FTIM', 'PWID', 'NWID', 'PDUT', 'MPAR', 'PVRMS', 'OVER'):
+            self.assertTrue(np.isnan(results[command]), command)
+        self.assertEqual((results['PEDG'], results['NPUL']), (0, 0))
+
+    def test_phase_between_sources(self):
+        results = measure_pair(sine(), sine(phase=-45), xincrement)
+        self.assertEqual(set(results), set(double_commands))
+        self.assertAlmostEqual(results['RPH'], 45.0, places=1)
+        self.assertAlmostEqual(results['FPH'], 45.0, places=1)
+        self.assertAlmostEqual(results['RDEL'], 125e-6, places=8)
+        # a leading source 2 is found before the source 1 edge rather than a period later
+        self.assertAlmostEqual(measure_pair(sine(), sine(phase=30), xincrement, ['RPH'])['RPH'], -30.0, places=1)
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_rows_match_single_captures(self):
+        captures = np.array([sine(frequency=1e3 * (row + 1), amplitude=row + 1, phase=17 * row) for row in range(6)])
+        captures[5] = 0.25
+        batch = measure(captures, xincrement)
+        for row in range(len(captures)):
+            single = measure(captures[row], xincrement)
+            for command in single_commands:
+                np.testing.assert_allclose(batch[command][row], single[command], rtol=1e-9, atol=1e-12,
+                                           err_msg=command)
+        np.testing.assert_allclose(batch['FREQ'][:5], 1e3 * np.arange(1, 6), rtol=1e-4)
+        # a row starting between the outer thresholds has an incomplete first edge, it is not counted
+        np.testing.assert_array_equal(batch['PEDG'], [3, 7, 11, 15, 20, 0])
+
+    def test_pair_batch(self):
+        phases = np.array([-10.0, -45.0, 20.0])
+        source1 = np.array([sine() for phase in phases])
+        source2 = np.array([sine(phase=phase) for phase in phases])
+        results = measure_pair(source1, source2, xincrement, ['RPH'])
+        np.testing.assert_allclose(results['RPH'], -phases, atol=0.1)
+
+    def test_shapes(self):
+        with self.assertRaises(ValueError):
+            WaveformAnalysis(np.zeros((2, 2, 2)), xincrement)
+        with self.assertRaises(ValueError):
+            measure_pair(np.zeros(10), np.zeros(20), xincrement)
+        # integer codes are measured as they are
+        self.assertEqual(measure(np.array([0, 10, 0, 10], dtype=np.uint8), xincrement, ['VPP'])['VPP'], 10.0)
+
+
+class TestScopeMeasurements(unittest.TestCase):
+
+    def tearDown(self):
+        pool.close_all()
+
+    def test_matches_scope_queries(self):
+        scope = RigolDS1054z('SIM::DS1054Z')
+        scope.setup_timebase(time_per_div=5e-4, delay=0)
+        items = [RigolDS1054z.peak_to_peak_voltage, RigolDS1054z.rms_voltage, RigolDS1054z.frequency,
+                 RigolDS1054z.rise_time, RigolDS1054z.positive_duty_percent, RigolDS1054z.rising_phase_ratio]
+        computed = scope.compute_measurements(channels=(1, 2, (1, 2)), items=items)
+        queried = scope.get_measurements(channels=(1, 2, (1, 2)), items=items)
+        for channel in (1, 2):
+            for name in ('peak_to_peak_voltage', 'rms_voltage', 'frequency', 'positive_duty_ratio'):
+                self.assertAlmostEqual(computed[channel][name], float(queried[channel][name]),
+                                       delta=0.02 * abs(float(queried[channel][name])), msg=(channel, name))
+        self.assertAlmostEqual(computed[1]['rise_time'], float(queried[1]['rise_time']), delta=5e-6)
+        self.assertAlmostEqual(computed[(1, 2)]['rising_phase_ratio'], 0.0, delta=1.0)
+        self.assertEqual(set(computed[(1, 2)]), {'rising_phase_ratio'})
+
+
+if __name__ == '__main__':
+    unittest.main()
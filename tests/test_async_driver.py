@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `AsyncDriver`."""
+
+
+import asyncio
+import threading
+import time
+import unittest
+
+from electronics_lab.drivers.async_driver import AsyncDriver
+
+
+class SlowInstrument(object):
+
+    def __init__(self):
+        self.active = 0
+        self.most_active = 0
+        self.guard = threading.Lock()
+
+
+class SlowDriver(object):
+    """Takes 50 ms per measurement and records how many calls overlap on its session."""
+
+    value = 'definition'
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+
+    def get_measurement(self, channel=1):
+        with self.instrument.guard:
+            self.instrument.active += 1
+            self.instrument.most_active = max(self.instrument.most_active, self.instrument.active)
+        time.sleep(0.05)
+        with self.instrument.guard:
+            self.instrument.active -= 1
+        return channel
+
+    def set_param(self, channel=1, value=0):
+        return value
+
+
+class TestAsyncDriver(unittest.TestCase):
+
+    def test_different_instruments_run_in_parallel(self):
+        drivers = [AsyncDriver(SlowDriver(SlowInstrument())) for _ in range(4)]
+
+        async def poll():
+            return await asyncio.gather(*[driver.get_measurement(n) for n, driver in enumerate(drivers)])
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(poll()), [0, 1, 2, 3])
+        self.assertLess(time.monotonic() - started, 0.15)
+
+    def test_one_session_is_never_interleaved(self):
+        instrument = SlowInstrument()
+        first, second = AsyncDriver(SlowDriver(instrument)), AsyncDriver(SlowDriver(instrument))
+
+        async def poll():
+            return await asyncio.gather(first.get_measurement(1), second.get_measurement(2),
+                                        first.set_param(1, 5))
+
+        self.assertEqual(asyncio.run(poll()), [1, 2, 5])
+        self.assertEqual(instrument.most_active, 1)
+
+    def test_session_is_shared_across_event_loops(self):
+        instrument = SlowInstrument()
+        first, second = AsyncDriver(SlowDriver(instrument)), AsyncDriver(SlowDriver(instrument))
+
+        async def poll():
+            return await asyncio.gather(first.get_measurement(1), second.get_measurement(2))
+
+        # a pooled session outlives the loop, the second run must not find the first loop's lock
+        self.assertEqual(asyncio.run(poll()), [1, 2])
+        self.assertEqual(asyncio.run(poll()), [1, 2])
+        self.assertEqual(instrument.most_active, 1)
+
+    def test_other_methods_and_attributes_pass_through(self):
+        driver = AsyncDriver(SlowDriver(SlowInstrument()))
+        self.assertEqual(driver.value, 'definition')
+        self.assertEqual(asyncio.run(driver.call('get_measurement', channel=3)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the instrument broker."""
+
+
+import importlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from electronics_lab import broker
+from electronics_lab.broker import Broker, BrokerClient, BrokerError
+from electronics_lab.drivers.driver import Reading
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentsdm3055 import SiglentSDM3055
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X
+
+
+def shared_files():
+    return set(name for name in os.listdir(broker.shared_memory_directory()) if name.startswith('electronics_lab-'))
+
+
+class TestBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.broker = Broker(os.path.join(self.directory, 'broker.sock')).start()
+        self.client = BrokerClient(self.broker.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.broker.close()
+        pool.close_all()
+        shutil.rmtree(self.directory)
+
+    def test_readings(self):
+        meter = self.client.instrument('SiglentSDM3055', 'SIM::SDM3055')
+        reading = meter.get_measurement(SiglentSDM3055.dc_current)
+        self.assertIsInstance(reading, Reading)
+        self.assertEqual((reading.name, reading.unit), ('dc_current', 'Amperes'))
+        scope = self.client.instrument('RigolDS1054z', 'SIM::DS1054Z')
+        items = [RigolDS1054z.frequency, RigolDS1054z.rising_delay_time]
+        results = scope.get_measurements(channels=(1, (1, 2)), items=items)
+        self.assertEqual(sorted(results, key=str), [(1, 2), 1])
+        self.assertIn('frequency', results[1])
+        self.assertEqual(len(self.broker.instruments), 2)
+
+    def test_waveform_through_shared_memory(self):
+        before = shared_files()
+        scope = self.client.instrument('RigolDS1054z', 'SIM::DS1054Z')
+        time_axis, volts = scope.read_waveform(1)
+        self.assertIsInstance(volts, np.ndarray)
+        self.assertGreater(volts.nbytes, broker.inline_limit)
+        local = RigolDS1054z('SIM::DS1054Z')
+        np.testing.assert_array_equal(local.read_waveform(1)[1], volts)
+        image = scope.read_screen_capture()
+        self.assertIsInstance(image, bytes)
+        self.assertEqual(image, local.read_screen_capture())
+        # the client mapped the payloads and removed their names
+        self.assertEqual(shared_files(), before)
+
+    def test_small_buffers_travel_raw(self):
+        encoder = broker.Encoder()
+        samples = np.arange(100, dtype='<i2')
+        body = encoder.encode({'samples': samples, 'data': b'\x00\x01'})
+        self.assertNotIn('data', body['samples']['__buffer__'])
+        parts = broker.encode_message(broker.REQUEST, 1, body, encoder.payloads)
+        self.assertIn(samples.tobytes(), b''.join(parts))
+        decoded = broker.Encoder(payload=bytearray(b''.join(encoder.payloads))).decode(body)
+        np.testing.assert_array_equal(decoded['samples'], samples)
+        self.assertEqual(decoded['data'], b'\x00\x01')
+
+    def test_instruments_run_in_parallel(self):
+        meter = self.client.instrument('SiglentSDM3055', 'SIM::SDM3055?latency=0.2')
+        other = BrokerClient(self.broker.path)
+        self.addCleanup(other.close)
+        supply = other.instrument('SiglentSPD3303X', 'SIM::SPD3303X?latency=0.2')
+        meter.get_measurement()
+        supply.get_measurement(1)
+        durations = {}
+
+        def measure(instrument, *args):
+            started = time.monotonic()
+            instrument.get_measurement(*args)
+            durations[threading.current_thread().name] = time.monotonic() - started
+
+        threads = [threading.Thread(target=measure, args=(meter,), name='meter'),
+                   threading.Thread(target=measure, args=(supply, 1, SiglentSPD3303X.current), name='supply'),
+                   threading.Thread(target=measure, args=(meter,), name='meter again')]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        # the two meter calls wait for each other, the supply call runs beside them
+        self.assertGreater(elapsed, 0.35)
+        self.assertLess(elapsed, 0.55)
+        self.assertLess(durations['supply'], 0.35)
+
+    def test_busy_instrument_does_not_starve_the_others(self):
+        meter = self.client.instrument('SiglentSDM3055', 'SIM::SDM3055?latency=0.1')
+        supply = self.client.instrument('SiglentSPD3303X', 'SIM::SPD3303X')
+        meter.get_measurement()
+        supply.get_measurement(1)
+        # more queued meter calls than a shared pool would have threads
+        threads = [threading.Thread(target=meter.get_measurement) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        supply.get_measurement(1)
+        self.assertLess(time.monotonic() - started, 0.3)
+        for thread in threads:
+            thread.join()
+
+    def test_payloads_of_a_closed_client_are_removed(self):
+        before = shared_files()
+        client = BrokerClient(self.broker.path)
+        scope = client.instrument('RigolDS1054z', 'SIM::DS1054Z?latency=0.2')
+
+        def read():
+            try:
+                scope.read_screen_capture()
+            except (EOFError, OSError):
+                pass
+        thread = threading.Thread(target=read)
+        thread.start()
+        time.sleep(0.05)
+        # the client goes away while the broker is still reading the screen
+        client.close()
+        thread.join()
+        # calls on one instrument run in order, this one returns after the abandoned read finished
+        self.client.instrument('RigolDS1054z', 'SIM::DS1054Z?latency=0.2').get_measurement(1)
+        deadline = time.monotonic() + 5.0
+        while shared_files() != before and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(shared_files(), before)
+
+    def test_errors(self):
+        scope = self.client.instrument('RigolDS1054z', 'SIM::DS1054Z')
+        with self.assertRaises(BrokerError) as context:
+            scope.no_such_method()
+        self.assertEqual(context.exception.type, 'AttributeError')
+        with self.assertRaises(BrokerError):
+            self.client.call('RigolDS1054z', 'SIM::DS1054Z', 'close')
+        with self.assertRaises(BrokerError):
+            self.client.instrument('NoSuchDriver', 'SIM::DS1054Z').get_measurement()
+        scope.close()
+        self.assertEqual(scope.get_measurement(1, RigolDS1054z.frequency).name, 'frequency')
+
+    def test_unencodable_result(self):
+        scope = self.client.instrument('RigolDS1054z', 'SIM::DS1054Z')
+        started = time.monotonic()
+        # a context manager can not be sent back, the call fails instead of waiting for the client timeout
+        with self.assertRaises(BrokerError) as context:
+            scope.transaction()
+        self.assertLess(time.monotonic() - started, 5.0)
+        self.assertEqual(context.exception.type, 'TypeError')
+        self.assertEqual(scope.get_measurement(1, RigolDS1054z.frequency).name, 'frequency')
+
+    def test_opening_does_not_hold_up_other_instruments(self):
+        opening = threading.Event()
+        release = threading.Event()
+
+        class SlowMeter(SiglentSDM3055):
+            def __init__(self, resource):
+                opening.set()
+                release.wait(5.0)
+                SiglentSDM3055.__init__(self, resource)
+
+        drivers = importlib.import_module('electronics_lab.drivers')
+        drivers.SlowMeter = SlowMeter
+        self.addCleanup(delattr, drivers, 'SlowMeter')
+        thread = threading.Thread(target=self.broker.instrument, args=('SlowMeter', 'SIM::SDM3055'))
+        thread.start()
+        self.assertTrue(opening.wait(5.0))
+        try:
+            scope = self.client.instrument('RigolDS1054z', 'SIM::DS1054Z')
+            started = time.monotonic()
+            self.assertEqual(scope.get_measurement(1, RigolDS1054z.frequency).name, 'frequency')
+            self.assertFalse(release.is_set())
+            self.assertLess(time.monotonic() - started, 2.0)
+        finally:
+            release.set()
+            thread.join()
+        self.assertIsInstance(self.broker.instrument('SlowMeter', 'SIM::SDM3055'), SlowMeter)
+
+    def test_closed_broker(self):
+        meter = self.client.instrument('SiglentSDM3055', 'SIM::SDM3055')
+        self.broker.close()
+        with self.assertRaises((EOFError, OSError)):
+            meter.get_measurement()
+        self.assertFalse(os.path.exists(self.broker.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
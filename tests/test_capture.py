@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the background screen capture service."""
+
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from electronics_lab.capture import CaptureService
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+
+
+class TestCaptureService(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scope = RigolDS1054z('SIM::DS1054Z?screen_bytes=5000')
+
+    def tearDown(self):
+        pool.close_all()
+        shutil.rmtree(self.directory)
+
+    def test_timelapse_skips_identical_frames(self):
+        with CaptureService(self.scope, self.directory, interval=0.01) as service:
+            time.sleep(0.1)
+            # a new acquisition changes the screen
+            self.scope.trigger_status()
+            time.sleep(0.05)
+            self.scope.get_measurement(1, RigolDS1054z.frequency)
+
+        self.assertGreater(service.captured, 5)
+        self.assertEqual(service.written, 2)
+        self.assertEqual(service.duplicates, service.captured - 2)
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(len(files), 2)
+        with open(os.path.join(self.directory, files[0]), 'rb') as fid:
+            self.assertEqual(fid.read(8), b'\x89PNG\r\n\x1a\n')
+
+    def test_on_demand_capture(self):
+        frames = []
+        service = CaptureService(self.scope, dedup=False, writer=frames.append).start()
+        service.capture()
+        while service.captured < 1:
+            time.sleep(0.001)
+        service.stop()
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(len(frames[0].data), 5000)
+
+    def check_policy(self, policy, captures=8):
+        release = threading.Event()
+        frames = []
+
+        def slow_writer(frame):
+            release.wait()
+            frames.append(frame.index)
+        service = CaptureService(self.scope, interval=0.001, queue_size=2, policy=policy, dedup=False,
+                                 writer=slow_writer).start()
+        while service.captured < captures:
+            time.sleep(0.001)
+        release.set()
+        service.stop()
+        return service, frames
+
+    def test_drop_newest_keeps_the_first_frames(self):
+        service, frames = self.check_policy('drop_newest')
+        self.assertGreater(service.dropped, 0)
+        self.assertEqual(frames[:3], [1, 2, 3])
+        self.assertEqual(len(frames) + service.dropped, service.captured)
+
+    def test_drop_oldest_keeps_the_latest_frames(self):
+        service, frames = self.check_policy('drop_oldest')
+        self.assertGreater(service.dropped, 0)
+        self.assertEqual(frames[-1], service.captured)
+        self.assertEqual(len(frames) + service.dropped, service.captured)
+
+    def test_block_loses_nothing(self):
+        # the writer holds one frame and the queue two, the worker blocks on the fourth
+        service, frames = self.check_policy('block', captures=4)
+        self.assertEqual(service.dropped, 0)
+        self.assertEqual(frames, list(range(1, service.captured + 1)))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            CaptureService(self.scope, policy='drop_all')
+
+
+if __name__ == '__main__':
+    unittest.main()
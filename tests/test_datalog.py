@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the columnar data log."""
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from electronics_lab.datalog import DataLog, DataLogger, encode_block, file_magic, scan_blocks
+from electronics_lab.drivers import driver
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X
+
+
+class TestDataLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'soak.eldlog')
+
+    def tearDown(self):
+        pool.close_all()
+        shutil.rmtree(self.directory)
+
+    def test_blocks_round_trip(self):
+        with DataLogger(self.path, block_size=100) as logger:
+            for index in range(1050):
+                logger.write('supply/CH1/current', 1000.0 + index, index * 0.01)
+                if index % 3 == 0:
+                    logger.write('meter/dc_voltage', 1000.0 + index, -index)
+        self.assertEqual(logger.points_written, 1050 + 350)
+        with DataLog(self.path) as log:
+            self.assertEqual(log.series(), ['meter/dc_voltage', 'supply/CH1/current'])
+            self.assertEqual(len(log.blocks['supply/CH1/current']), 11)
+            times, values = log.query('supply/CH1/current')
+            np.testing.assert_array_equal(times, 1000.0 + np.arange(1050))
+            times, values = log.query('supply/CH1/current', 1250.5, 1420)
+            np.testing.assert_array_equal(times, np.arange(1251, 1421))
+            np.testing.assert_allclose(values, np.arange(251, 421) * 0.01)
+            self.assertEqual(log.extrema('meter/dc_voltage', 1010, 2000), (-999.0, -12.0))
+            self.assertEqual(log.time_range('meter/dc_voltage'), (1000.0, 2047.0))
+            self.assertEqual(log.query('supply/CH1/current', 5000, 6000)[0].size, 0)
+            with self.assertRaises(KeyError):
+                log.query('scope/CH1/frequency')
+
+    def test_query_touches_only_overlapping_blocks(self):
+        with DataLogger(self.path, block_size=10) as logger:
+            for index in range(1000):
+                logger.write('series', float(index), float(index))
+        with DataLog(self.path) as log:
+            self.assertEqual(len(log._overlapping('series', 500, 519)), 2)
+            # a wholly covered block is answered from its header
+            self.assertEqual(log.extrema('series', 0, 999), (0.0, 999.0))
+
+    def test_torn_block_is_dropped(self):
+        with DataLogger(self.path, block_size=10) as logger:
+            for index in range(25):
+                logger.write('series', float(index), float(index))
+        size = os.path.getsize(self.path)
+        # a crash in the middle of writing the next block
+        with open(self.path, 'ab') as fid:
+            fid.write(encode_block('series', [25.0, 26.0], [25.0, 26.0])[:40])
+        with DataLog(self.path) as log:
+            self.assertEqual(log.query('series')[0].size, 25)
+        with DataLogger(self.path) as logger:
+            self.assertEqual(os.path.getsize(self.path), size)
+            logger.write('series', 30.0, 30.0)
+        with DataLog(self.path) as log:
+            self.assertEqual(log.query('series')[0][-1], 30.0)
+        with open(self.path, 'rb') as fid:
+            self.assertEqual(len(scan_blocks(fid.read())[0]), 4)
+
+    def test_corrupt_last_block_is_dropped(self):
+        with DataLogger(self.path, block_size=10) as logger:
+            for index in range(20):
+                logger.write('series', float(index), float(index))
+        size = os.path.getsize(self.path)
+        # a whole header whose columns never reached the disk
+        block = encode_block('series', [20.0, 21.0], [20.0, 21.0])
+        with open(self.path, 'ab') as fid:
+            fid.write(block[:-16] + b'\0' * 16)
+        with open(self.path, 'rb') as fid:
+            data = fid.read()
+        self.assertEqual(scan_blocks(data, verify=False), scan_blocks(data))
+        with DataLogger(self.path):
+            self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_partial_blocks_are_flushed_in_the_background(self):
+        logger = DataLogger(self.path, block_size=1000, flush_interval=0.05)
+        try:
+            logger.write('series', 1.0, 2.0)
+            deadline = time.monotonic() + 5
+            while logger.points_written == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with DataLog(self.path) as log:
+                self.assertEqual(log.query('series')[1].tolist(), [2.0])
+                logger.write('series', 2.0, 3.0)
+                logger.flush()
+                log.refresh()
+                self.assertEqual(log.query('series')[1].tolist(), [2.0, 3.0])
+        finally:
+            logger.close()
+
+    def test_driver_readings(self):
+        supply = SiglentSPD3303X('SIM::SPD3303X')
+        supply.name = 'bench_supply'
+        with DataLogger(self.path).attach() as logger:
+            self.assertIn(logger, driver.sinks)
+            for index in range(3):
+                supply.get_measurement(1, SiglentSPD3303X.current)
+            supply.get_measurement(2, SiglentSPD3303X.out)
+        self.assertNotIn(logger, driver.sinks)
+        with DataLog(self.path) as log:
+            self.assertEqual(log.series(), ['bench_supply/CH1/current', 'bench_supply/CH2/out'])
+            self.assertEqual(log.query('bench_supply/CH1/current')[0].size, 3)
+
+    def test_not_a_data_log(self):
+        with open(self.path, 'wb') as fid:
+            fid.write(b'something else')
+        with self.assertRaises(ValueError):
+            DataLog(self.path)
+        with self.assertRaises(ValueError):
+            DataLogger(self.path)
+        self.assertEqual(len(file_magic), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the host side protocol decoders."""
+
+
+import unittest
+
+import numpy as np
+
+from electronics_lab.decode import I2CDecoder, SPIDecoder, UARTDecoder, digitize
+
+
+def i2c_bus(transactions, half_bit=4):
+    """Returns (sda, scl) of transactions given as (address, read, data bytes, acks, repeated start)"""
+    levels = [(1, 1)] * (2 * half_bit)
+    for index, (address, read, data, acks, repeated) in enumerate(transactions):
+        if repeated:
+            levels += [(1, 0)] * half_bit + [(1, 1)] * half_bit
+        levels += [(0, 1)] * half_bit + [(0, 0)] * half_bit
+        for byte, ack in zip([address << 1 | read] + list(data), acks):
+            for bit in [(byte >> shift) & 1 for shift in range(7, -1, -1)] + [0 if ack else 1]:
+                levels += [(bit, 0)] * half_bit + [(bit, 1)] * half_bit
+        levels += [(0, 0)] * half_bit
+        # STOP, unless the next transaction follows with a repeated START
+        if index + 1 == len(transactions) or not transactions[index + 1][4]:
+            levels += [(0, 1)] * half_bit + [(1, 1)] * (2 * half_bit)
+    sda, scl = np.array(levels, dtype=bool).T
+    return sda, scl
+
+
+def spi_bus(frames, half_bit=3, word_bits=8, cpol=0):
+    """Returns (sclk, mosi, miso, cs) of frames given as lists of (mosi, miso) words, mode 0 or 3"""
+    idle = bool(cpol)
+    levels = [(idle, 0, 0, 1)] * (2 * half_bit)
+    for words in frames:
+        levels += [(idle, 0, 0, 0)] * half_bit
+        for mosi, miso in words:
+            for shift in range(word_bits - 1, -1, -1):
+                bits = ((mosi >> shift) & 1, (miso >> shift) & 1)
+                # both modes change the data while the clock is low and sample it on the rising edge
+                levels += [(False,) + bits + (0,)] * half_bit + [(True,) + bits + (0,)] * half_bit
+        levels += [(idle, 0, 0, 0)] * half_bit + [(idle, 0, 0, 1)] * (2 * half_bit)
+    return tuple(np.array(levels, dtype=bool).T)
+
+
+def uart_line(data, samples_per_bit=8, parity=None, gap=5):
+    bits = []
+    for byte in data:
+        word = [(byte >> shift) & 1 for shift in range(8)]
+        if parity is not None:
+            word.append((sum(word) + (parity == 'odd')) % 2)
+        bits += [1] * gap + [0] + word + [1]
+    bits += [1] * gap
+    return np.repeat(np.array(bits, dtype=bool), samples_per_bit)
+
+
+class TestI2CDecoder(unittest.TestCase):
+
+    transactions = [(0x50, 0, [0x12, 0x34], [True, True, True], False),
+                    (0x50, 0, [0x00], [True, True], False),
+                    (0x50, 1, [0xAB, 0xCD], [True, True, False], True)]
+
+    def test_decode(self):
+        sda, scl = i2c_bus(self.transactions)
+        frames = I2CDecoder(xincrement=1e-6).decode(sda, scl)
+        self.assertEqual(frames['data'].tolist(), [0xA0, 0x12, 0x34, 0xA0, 0x00, 0xA1, 0xAB, 0xCD])
+        self.assertEqual(frames['is_address'].tolist(), [True, False, False, True, False, True, False, False])
+        self.assertEqual(frames['transaction'].tolist(), [0, 0, 0, 1, 1, 2, 2, 2])
+        self.assertEqual(set(frames['address']), {0x50})
+        self.assertEqual(frames['read'].tolist(), [False] * 5 + [True] * 3)
+        self.assertEqual(frames['ack'].tolist(), [True] * 7 + [False])
+        self.assertTrue(np.all(frames['end'] > frames['start']))
+        np.testing.assert_allclose(frames['time'], frames['start'] * 1e-6)
+
+    def test_chunks_match_whole_capture(self):
+        sda, scl = i2c_bus(self.transactions)
+        whole = I2CDecoder().decode(sda, scl)
+        for chunk_size in (1, 7, 64, 1000):
+            np.testing.assert_array_equal(I2CDecoder().decode(sda, scl, chunk_size=chunk_size), whole)
+
+    def test_codes_with_threshold(self):
+        sda, scl = i2c_bus(self.transactions[:1])
+        decoder = I2CDecoder(threshold=128)
+        frames = decoder.decode(np.where(sda, 200, 20).astype(np.uint8), np.where(scl, 210, 15).astype(np.uint8))
+        self.assertEqual(frames['data'].tolist(), [0xA0, 0x12, 0x34])
+        # the state carries on into the next capture until reset
+        self.assertEqual(decoder.offset, len(sda))
+        decoder.reset()
+        self.assertEqual((decoder.offset, decoder.transaction), (0, -1))
+
+    def test_ringing_edges_with_hysteresis(self):
+        sda, scl = i2c_bus(self.transactions)
+        lines = []
+        for levels in (sda, scl):
+            volts = np.where(levels, 3.3, 0.0)
+            # every edge rings around the 1.65 V threshold for two samples
+            edges = np.flatnonzero(levels[1:] != levels[:-1]) + 1
+            volts[edges] = np.where(levels[edges], 1.8, 1.5)
+            volts[edges + 1] = np.where(levels[edges], 1.5, 1.8)
+            lines.append(volts)
+        expected = I2CDecoder().decode(sda, scl)['data'].tolist()
+        self.assertNotEqual(I2CDecoder(threshold=1.65).decode(*lines)['data'].tolist(), expected)
+        whole = I2CDecoder(threshold=1.65, hysteresis=0.6).decode(*lines)
+        self.assertEqual(whole['data'].tolist(), expected)
+        for chunk_size in (1, 7, 64):
+            np.testing.assert_array_equal(
+                I2CDecoder(threshold=1.65, hysteresis=0.6).decode(*lines, chunk_size=chunk_size), whole)
+
+
+class TestSPIDecoder(unittest.TestCase):
+
+    frames = [[(0x9F, 0x00), (0x00, 0xEF), (0x00, 0x40)], [(0x03, 0x11)]]
+
+    def test_decode(self):
+        sclk, mosi, miso, cs = spi_bus(self.frames)
+        frames = SPIDecoder().decode(sclk, mosi, miso, cs)
+        self.assertEqual(frames['mosi'].tolist(), [0x9F, 0x00, 0x00, 0x03])
+        self.assertEqual(frames['miso'].tolist(), [0x00, 0xEF, 0x40, 0x11])
+        self.assertEqual(frames['frame'].tolist(), [1, 1, 1, 2])
+
+    def test_mode_3_and_chunks(self):
+        sclk, mosi, miso, cs = spi_bus(self.frames, cpol=1)
+        whole = SPIDecoder(cpol=1, cpha=1).decode(sclk, mosi, miso, cs)
+        self.assertEqual(whole['miso'].tolist(), [0x00, 0xEF, 0x40, 0x11])
+        for chunk_size in (1, 5, 100):
+            np.testing.assert_array_equal(SPIDecoder(cpol=1, cpha=1).decode(sclk, mosi, miso, cs,
+                                                                            chunk_size=chunk_size), whole)
+
+    def test_words_without_chip_select(self):
+        sclk, mosi, miso, cs = spi_bus([[(0x1234, 0), (0xBEEF, 0)]], word_bits=16)
+        frames = SPIDecoder(word_bits=16).decode(sclk, mosi)
+        self.assertEqual(frames['mosi'].tolist(), [0x1234, 0xBEEF])
+        lsb_first = SPIDecoder(word_bits=16, msb_first=False).decode(sclk, mosi)
+        self.assertEqual(lsb_first['mosi'][0], int('{:016b}'.format(0x1234)[::-1], 2))
+
+    def test_short_word_is_dropped(self):
+        sclk, mosi, miso, cs = spi_bus([[(0xA5, 0)], [(0x5A, 0)]])
+        # deassert chip select half way through the first word
+        first_word = np.flatnonzero(~cs)[0]
+        cs[first_word + 24:first_word + 60] = True
+        frames = SPIDecoder().decode(sclk, mosi, miso, cs)
+        self.assertEqual(frames['mosi'].tolist(), [0x5A])
+
+
+class TestUARTDecoder(unittest.TestCase):
+
+    def test_decode(self):
+        line = uart_line(b'Hello')
+        frames = UARTDecoder(8).decode(line)
+        self.assertEqual(bytes(bytearray(frames['data'].tolist())), b'Hello')
+        self.assertFalse(frames['framing_error'].any())
+        self.assertEqual(frames['end'][0] - frames['start'][0], int(round(9.5 * 8)))
+
+    def test_parity_and_chunks(self):
+        line = uart_line(b'\x00\x01\xff\x7f', samples_per_bit=10, parity='odd')
+        whole = UARTDecoder(10, parity='odd').decode(line)
+        self.assertEqual(whole['data'].tolist(), [0, 1, 255, 127])
+        self.assertFalse(whole['parity_error'].any())
+        self.assertTrue(UARTDecoder(10, parity='even').decode(line)['parity_error'].all())
+        for chunk_size in (1, 13, 95, 1000):
+            np.testing.assert_array_equal(UARTDecoder(10, parity='odd').decode(line, chunk_size=chunk_size), whole)
+
+    def test_glitch_and_framing_error(self):
+        line = uart_line(b'AB')
+        # a one sample dip on the idle line is not a start bit
+        line[2] = False
+        # a low stop bit, the second character's start bit follows the first character and the idle gap
+        second = uart_line(b'A').size
+        line[second + 9 * 8:second + 10 * 8] = False
+        frames = UARTDecoder(8).decode(line)
+        self.assertEqual(frames['data'].tolist()[0], ord('A'))
+        self.assertEqual(frames['framing_error'].tolist()[:2], [False, True])
+
+    def test_noisy_line_with_hysteresis(self):
+        line = uart_line(b'Hi')
+        volts = np.where(line, 3.3, 0.0) + np.random.RandomState(0).uniform(-2.0, 2.0, len(line))
+        self.assertNotEqual(UARTDecoder(8, threshold=1.65).decode(volts)['data'].tolist(), list(b'Hi'))
+        frames = UARTDecoder(8, threshold=1.65, hysteresis=1.0).decode(volts, chunk_size=50)
+        self.assertEqual(bytes(bytearray(frames['data'].tolist())), b'Hi')
+        self.assertFalse(frames['framing_error'].any())
+
+    def test_fractional_bit_length(self):
+        # 1 MSa/s at 115200 baud
+        samples_per_bit = 1e6 / 115200
+        bits = np.concatenate([[1] * 3, [0], [(0x55 >> shift) & 1 for shift in range(8)], [1] * 4]).astype(bool)
+        line = bits[(np.arange(int(len(bits) * samples_per_bit)) / samples_per_bit).astype(int)]
+        self.assertEqual(UARTDecoder(samples_per_bit).decode(line)['data'].tolist(), [0x55])
+
+
+class TestDigitize(unittest.TestCase):
+
+    def test_hysteresis(self):
+        volts = np.array([0.0, 1.6, 1.7, 1.6, 3.3, 1.7, 1.6, 1.7, 0.0, 1.7])
+        plain = [False, False, True, False, True, True, False, True, False, True]
+        self.assertEqual(digitize(volts, 1.65).tolist(), plain)
+        self.assertEqual(digitize(volts, 1.65, hysteresis=0.5).tolist(), [False] * 4 + [True] * 4 + [False] * 2)
+        self.assertEqual(digitize(volts[1:4], 1.65, hysteresis=0.5, initial=True).tolist(), [True] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for instrument discovery and the identity cache."""
+
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from electronics_lab.drivers.discovery import Discovery, Identity, driver_for, expand_hosts, parse_idn, portmapper_port
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X
+
+resources = ['SIM::DS1054Z?latency=0.2', 'SIM::SDM3055?latency=0.2', 'SIM::SPD3303X?latency=0.2',
+             'SIM::SDG1032X?latency=0.2', 'SIM::NOSUCHMODEL']
+
+
+class TestIdentities(unittest.TestCase):
+
+    def test_parse_idn(self):
+        self.assertEqual(parse_idn('RIGOL TECHNOLOGIES,DS1054Z,DS1ZA000000001,00.04.04.SP3\n'),
+                         ('RIGOL TECHNOLOGIES', 'DS1054Z', 'DS1ZA000000001', '00.04.04.SP3'))
+        self.assertEqual(parse_idn('Siglent Technologies,SPD3303X-E,SPD3X,1.01,V3.0')[3], '1.01,V3.0')
+        self.assertEqual(parse_idn('garbage'), ('garbage', '', '', ''))
+
+    def test_driver_for(self):
+        self.assertEqual(driver_for('DS1104Z'), 'RigolDS1054z')
+        self.assertEqual(driver_for('SPD3303X-E'), 'SiglentSPD3303X')
+        self.assertEqual(driver_for('SDM3045X'), 'SiglentSDM3055')
+        self.assertIsNone(driver_for('DSO-X 3034A'))
+
+    def test_hosts(self):
+        self.assertEqual(expand_hosts(['10.0.0.0/30', '10.0.0.9', 'scope.lab']),
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.9', 'scope.lab'])
+        identity = Identity('SN', 'DS1054Z', 'RIGOL', '1', 'RigolDS1054z', '10.0.0.9', 'vxi11', 0.0)
+        self.assertEqual(identity.resource_for('visa'), 'TCPIP0::10.0.0.9::INSTR')
+        self.assertEqual(identity.resource_for('vxi11'), '10.0.0.9')
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.directory, 'instruments', 'cache.json')
+
+    def tearDown(self):
+        pool.close_all()
+        shutil.rmtree(self.directory)
+
+    def discovery(self, resources=resources, **kwargs):
+        return Discovery(resources=resources, visa=False, cache_file=self.cache_file, **kwargs)
+
+    def test_cold_scan_is_parallel(self):
+        started = time.monotonic()
+        found = self.discovery().scan()
+        # every simulated *IDN? takes 0.2 s, one after the other they would take 0.8 s
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(sorted(identity.driver for identity in found),
+                         ['RigolDS1054z', 'SiglentSDG1032X', 'SiglentSDM3055', 'SiglentSPD3303X'])
+        with open(self.cache_file) as fid:
+            self.assertEqual(len(json.load(fid)['instruments']), 4)
+
+    def test_warm_start_opens_without_scanning(self):
+        self.discovery().scan()
+        discovery = self.discovery(resources=[])
+        scope = discovery.open('DS1ZA000000001')
+        self.assertIsInstance(scope, RigolDS1054z)
+        supply = discovery.open(model='SPD3303X')
+        self.assertIsInstance(supply, SiglentSPD3303X)
+        self.assertEqual(discovery.scans, 0)
+
+    def test_expired_cache_scans_again(self):
+        self.discovery().scan()
+        discovery = self.discovery(ttl=0.0)
+        self.assertEqual(discovery.identities, {})
+        discovery.open('DS1ZA000000001')
+        self.assertEqual(discovery.scans, 1)
+
+    def test_moved_instrument_is_found_again(self):
+        self.discovery(resources=['SIM::DS1054Z']).scan()
+        with open(self.cache_file) as fid:
+            cache = json.load(fid)
+        cache['instruments']['DS1ZA000000001']['resource'] = 'SIM::SDM3055'
+        with open(self.cache_file, 'w') as fid:
+            json.dump(cache, fid)
+        discovery = self.discovery(resources=['SIM::DS1054Z', 'SIM::SDM3055'])
+        scope = discovery.open('DS1ZA000000001')
+        self.assertEqual(scope.instrument.key, 'SIM::DS1054Z')
+        self.assertEqual(discovery.scans, 1)
+
+    def test_unknown_serial(self):
+        discovery = self.discovery(resources=['SIM::DS1054Z'])
+        with self.assertRaises(LookupError):
+            discovery.open('NOSUCHSERIAL')
+        self.assertEqual(discovery.scans, 1)
+
+    def test_probe_uses_open_session(self):
+        scope = RigolDS1054z('SIM::DS1054Z')
+        identity = self.discovery().probe('SIM::DS1054Z')
+        self.assertEqual(identity.serial, 'DS1ZA000000001')
+        self.assertFalse(scope.instrument.instrument.closed)
+
+    def test_failed_check_closes_the_instrument(self):
+        self.discovery(resources=['SIM::DS1054Z']).scan()
+        closed = []
+
+        class BrokenScope(RigolDS1054z):
+            def query(self, command):
+                raise ValueError('garbled reply')
+
+            def close(self):
+                closed.append(self.instrument.key)
+                RigolDS1054z.close(self)
+
+        with self.assertRaises(ValueError):
+            self.discovery(resources=[]).open('DS1ZA000000001', driver=BrokenScope)
+        self.assertEqual(closed, ['SIM::DS1054Z'])
+
+    def test_vxi11_host_without_portmapper(self):
+        try:
+            socket.create_connection(('127.0.0.1', portmapper_port), timeout=0.5).close()
+            self.skipTest('a portmapper is listening on this host')
+        except OSError:
+            pass
+        started = time.monotonic()
+        self.assertIsNone(self.discovery(timeout=0.5).probe('127.0.0.1', 'vxi11'))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the SCPI transaction instrumentation."""
+
+
+import json
+import unittest
+
+from electronics_lab.drivers import instrumentation, session
+from electronics_lab.drivers.instrumentation import LatencyHistogram, mnemonic
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentsdm3055 import SiglentSDM3055
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_are_within_bucket_precision(self):
+        histogram = LatencyHistogram()
+        for microseconds in range(1, 100001):
+            histogram.record(microseconds * 1e-6)
+        self.assertEqual(histogram.count, 100000)
+        for percent in (50, 90, 99):
+            self.assertAlmostEqual(histogram.percentile(percent), percent * 1e-3, delta=percent * 1e-3 * 0.016)
+        self.assertAlmostEqual(histogram.percentile(100), 0.1)
+        self.assertLess(len(histogram.counts), 1000)
+
+    def test_mnemonic(self):
+        self.assertEqual(mnemonic(':MEAS:ITEM? VMAX,CHAN1;:MEAS:ITEM? VMIN,CHAN1'), ':MEAS:ITEM?')
+        self.assertEqual(mnemonic(b'C1:WVDT WVNM,wave,WAVEDATA,\x00\x01'), 'C1:WVDT')
+        self.assertEqual(mnemonic('*OPC?'), '*OPC?')
+
+
+class TestRecorder(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+        pool.close_all()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(session.recorder)
+        meter = SiglentSDM3055('SIM::SDM3055')
+        meter.get_measurement(SiglentSDM3055.dc_voltage)
+        self.assertIsNone(instrumentation.get_recorder())
+
+    def test_reads_are_attributed_to_the_last_command(self):
+        recorder = instrumentation.enable()
+        scope = RigolDS1054z('SIM::DS1054Z?memory_depth=1200')
+        scope.read_waveform(channel=1)
+        scope.get_measurement(1, RigolDS1054z.frequency)
+        snapshot = recorder.snapshot()['SIM::DS1054Z?memory_depth=1200']
+
+        self.assertEqual(snapshot[':WAV:DATA?']['write']['count'], 1)
+        self.assertEqual(snapshot[':WAV:DATA?']['read']['count'], 1)
+        self.assertEqual(snapshot[':WAV:DATA?']['read']['bytes_in'], len(b'#41200') + 1200 + 1)
+        self.assertEqual(snapshot[':MEAS:ITEM?']['write']['count'], 1)
+        self.assertGreater(snapshot[':MEAS:ITEM?']['write']['bytes_out'], 0)
+        self.assertEqual(snapshot[':WAV:PRE?']['query']['count'], 1)
+        self.assertIn(':WAV:PRE?', snapshot)
+        self.assertNotIn('', snapshot)
+
+    def test_errors_and_exports(self):
+        recorder = instrumentation.enable()
+        scope = RigolDS1054z('SIM::DS1054Z')
+        with self.assertRaises(Exception):
+            scope.query(':NOSUCH?')
+        scope.query('*OPC?')
+
+        resources = json.loads(recorder.to_json())['resources']
+        self.assertEqual(resources['SIM::DS1054Z'][':NOSUCH?']['query']['errors'], 1)
+        text = recorder.to_prometheus()
+        self.assertIn('electronics_lab_scpi_errors_total{resource="SIM::DS1054Z",command=":NOSUCH?",'
+                      'operation="query"} 1', text)
+        self.assertIn('electronics_lab_scpi_latency_seconds_count{resource="SIM::DS1054Z",command="*OPC?",'
+                      'operation="query"} 1', text)
+        # each family is one contiguous block after its TYPE line
+        families = [line.split()[0].split('{')[0] for line in text.splitlines() if not line.startswith('#')]
+        families = [family.replace('_sum', '').replace('_count', '') for family in families]
+        changes = [family for index, family in enumerate(families) if index == 0 or family != families[index - 1]]
+        self.assertEqual(len(changes), len(set(changes)))
+        self.assertEqual(text.count('# TYPE'), 4)
+        self.assertIs(instrumentation.disable(), recorder)
+        scope.query('*OPC?')
+        self.assertEqual(recorder.snapshot()['SIM::DS1054Z']['*OPC?']['query']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
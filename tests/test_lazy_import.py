@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for lazy driver loading."""
+
+
+import os
+import subprocess
+import sys
+import unittest
+
+import electronics_lab
+from electronics_lab import drivers
+
+# `python -c` imports from its working directory, so the interpreter starts in the checkout
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def test_package_import_loads_no_transport(self):
+        check = ('import sys, electronics_lab; '
+                 'print(",".join(m for m in ("visa", "pyvisa", "vxi11", "numpy", "asyncio") if m in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', check], cwd=repository).decode().strip()
+        self.assertEqual(output, '')
+
+    def test_drivers_resolve_on_first_access(self):
+        from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+        self.assertIs(electronics_lab.RigolDS1054z, RigolDS1054z)
+        self.assertIn('SiglentSPD3303X', dir(electronics_lab))
+        with self.assertRaises(AttributeError):
+            electronics_lab.NoSuchDriver
+
+    def test_registered_driver(self):
+        drivers.register_driver('LoopbackDriver', 'electronics_lab.drivers.driver:Driver')
+        try:
+            self.assertIs(electronics_lab.LoopbackDriver, electronics_lab.Driver)
+            self.assertIn('LoopbackDriver', drivers.__all__)
+        finally:
+            drivers.registry.pop('LoopbackDriver')
+            drivers.__all__.remove('LoopbackDriver')
+            vars(drivers).pop('LoopbackDriver', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `RigolDS1054z` driver."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from electronics_lab.drivers.driver import InstrumentTimeout, block_header, block_payload, block_span
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z, load_waveform_file, scale_waveform_codes
+from electronics_lab.drivers.session import pool
+
+
+def block(payload):
+    length = str(len(payload))
+    return ('#' + str(len(length)) + length).encode() + payload + b'\n'
+
+
+class FakeScope(object):
+    """Answers the waveform commands from an array of raw byte codes."""
+
+    def __init__(self, codes):
+        self.codes = np.asarray(codes, dtype=np.uint8)
+        self.start = 1
+        self.stop = len(self.codes)
+        self.pending = b''
+        self.screen = b''
+        self.trigger_states = ['STOP']
+        self.commands = []
+
+    def write(self, command):
+        self.commands.append(command)
+        if command.startswith(':WAV:STAR '):
+            self.start = int(command.split()[1])
+        elif command.startswith(':WAV:STOP '):
+            self.stop = int(command.split()[1])
+        elif command == ':WAV:DATA?':
+            self.pending = block(self.codes[self.start - 1:self.stop].tobytes())
+        elif command == ':DISP:DATA? ON,OFF,PNG':
+            self.pending = block(self.screen)
+        elif command.startswith(':MEAS:ITEM? '):
+            # every item answers with its source count, e.g. 2 for RPH,CHAN1,CHAN2
+            replies = [str(query.count('CHAN')) + '.0e-03' for query in command.split(';')]
+            self.pending = ';'.join(replies).encode() + b'\n'
+
+    def query(self, command):
+        self.commands.append(command)
+        if command == ':WAV:PRE?':
+            return '0,2,{},1,1.000000e-06,-5.000000e-03,0,4.000000e-02,-28,127\n'.format(len(self.codes))
+        if command == '*OPC?':
+            return '1\n'
+        if command == ':TRIG:STAT?':
+            if len(self.trigger_states) > 1:
+                return self.trigger_states.pop(0) + '\n'
+            return self.trigger_states[0] + '\n'
+        return ''
+
+    def read_raw(self):
+        data, self.pending = self.pending, b''
+        return data
+
+    def read_bytes(self, count):
+        data, self.pending = self.pending[:count], self.pending[count:]
+        return data
+
+
+class ArmingScope(FakeScope):
+    """Reads STOP from the previous capture until *OPC? reports that :SING was processed"""
+
+    def __init__(self, codes):
+        FakeScope.__init__(self, codes)
+        self.armed = True
+        self.waits = 0
+
+    def write(self, command):
+        FakeScope.write(self, command)
+        if command == ':SING':
+            self.armed = False
+            self.trigger_states = ['WAIT', 'STOP']
+
+    def query(self, command):
+        if command == '*OPC?':
+            self.armed = True
+        elif command == ':TRIG:STAT?':
+            if not self.armed:
+                return 'STOP\n'
+            self.waits += self.trigger_states[0] == 'WAIT'
+        return FakeScope.query(self, command)
+
+
+def make_scope(instrument):
+    scope = RigolDS1054z.__new__(RigolDS1054z)
+    scope.instrument = instrument
+    scope.debug = False
+    return scope
+
+
+class TestReadWaveform(unittest.TestCase):
+
+    def test_chunked_binary_read_is_scaled(self):
+        codes = np.arange(1000) % 256
+        fake = FakeScope(codes)
+        scope = make_scope(fake)
+        scope.max_waveform_chunk = 300
+
+        time_axis, volts = scope.read_waveform(channel=2)
+
+        self.assertEqual(volts.dtype, np.float32)
+        self.assertEqual(len(volts), 1000)
+        expected = (codes - (-28 + 127)) * 0.04
+        np.testing.assert_allclose(volts, expected, rtol=1e-6)
+        self.assertAlmostEqual(time_axis[0], -5e-3)
+        self.assertAlmostEqual(time_axis[-1], -5e-3 + 999e-6)
+        self.assertEqual(fake.commands.count(':WAV:DATA?'), 4)
+        self.assertIn(':WAV:SOUR CHAN2', fake.commands)
+        self.assertIn(':WAV:FORM BYTE', fake.commands)
+        self.assertIn(':STOP', fake.commands)
+
+    def test_norm_mode_does_not_stop_acquisition(self):
+        scope = make_scope(FakeScope(np.zeros(1200)))
+        scope.read_waveform(channel=1, mode='NORM')
+        self.assertNotIn(':STOP', scope.instrument.commands)
+        self.assertIn(':WAV:MODE NORM', scope.instrument.commands)
+
+
+class TestGetMeasurement(unittest.TestCase):
+
+    def test_single_and_double_source_readings(self):
+        scope = make_scope(FakeScope(np.zeros(10)))
+
+        reading = scope.get_measurement(3, RigolDS1054z.positive_pulse_number)
+        phase = scope.get_measurement((1, 2), RigolDS1054z.rising_phase_ratio)
+
+        self.assertEqual(scope.instrument.commands, [':MEAS:ITEM? PPUL,CHAN3', ':MEAS:ITEM? RPH,CHAN1,CHAN2'])
+        self.assertEqual((reading.value, reading.channel, reading.unit), (0, 3, 'Occurances'))
+        self.assertEqual(phase.value, 2e-3)
+        self.assertEqual(scope.format_reading(phase), 'Channel (1, 2) rising_phase_ratio value is 2E-3 Degrees')
+
+    def test_measurements_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            RigolDS1054z.max_voltage.command = 'VMIN'
+
+
+class TestStreamToFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stream_waveform_round_trip(self):
+        codes = (np.arange(5000) * 7) % 256
+        scope = make_scope(FakeScope(codes))
+        scope.max_waveform_chunk = 1024
+        filename = os.path.join(self.directory, 'capture.npy')
+
+        scope.stream_waveform_to_file(channel=3, filename=filename)
+
+        stored, header = load_waveform_file(filename)
+        self.assertIsInstance(stored, np.memmap)
+        self.assertEqual(header['channel'], 3)
+        self.assertEqual(header['points'], 5000)
+        np.testing.assert_array_equal(stored, codes)
+        _, volts = scope.read_waveform(channel=3)
+        np.testing.assert_allclose(scale_waveform_codes(stored, header['preamble']), volts)
+
+    def test_screen_capture_is_streamed_in_chunks(self):
+        fake = FakeScope(np.zeros(10))
+        fake.screen = os.urandom(3000)
+        scope = make_scope(fake)
+        scope.stream_chunk_size = 512
+        filename = os.path.join(self.directory, 'screen.png')
+
+        scope.write_screen_capture(filename)
+
+        with open(filename, 'rb') as fid:
+            self.assertEqual(fid.read(), fake.screen)
+        self.assertEqual(fake.pending, b'')
+
+
+class TestTriggerCompletion(unittest.TestCase):
+
+    def test_single_trigger_returns_once_armed(self):
+        fake = FakeScope(np.zeros(10))
+        fake.trigger_states = ['AUTO', 'AUTO', 'WAIT']
+        scope = make_scope(fake)
+        scope.single_trigger(timeout=1.0)
+        self.assertEqual(fake.trigger_states, ['WAIT'])
+        self.assertIn(':SING', fake.commands)
+
+    def test_wait_for_trigger_status_times_out(self):
+        fake = FakeScope(np.zeros(10))
+        fake.trigger_states = ['WAIT']
+        scope = make_scope(fake)
+        with self.assertRaises(InstrumentTimeout):
+            scope.wait_for_trigger_status(('STOP',), timeout=0.05)
+
+    def test_reset_retries_while_the_scope_is_busy(self):
+        fake = FakeScope(np.zeros(10))
+        answers = [IOError('busy'), IOError('busy'), '1\n']
+
+        def query(command):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        fake.query = query
+        scope = make_scope(fake)
+        scope.reset(timeout=1.0)
+        self.assertEqual(answers, [])
+
+
+class TestSingleShots(unittest.TestCase):
+
+    def tearDown(self):
+        pool.close_all()
+
+    def test_repeated_single_shots(self):
+        scope = RigolDS1054z('SIM::DS1054Z?memory_depth=6000&trigger_delay=0.002')
+        scope.max_waveform_chunk = 4000
+        shots = scope.acquire_single_shots(20, channels=(1, 2))
+        self.assertEqual(len(shots), 20)
+        self.assertEqual(shots.codes[1].shape, (20, 6000))
+        self.assertEqual(shots.codes[1].dtype, np.uint8)
+        time_axis, volts = scope.read_waveform(channel=2)
+        np.testing.assert_allclose(shots.volts(2, 7), volts)
+        np.testing.assert_allclose(shots.time_axis(2), time_axis)
+        self.assertEqual(len(shots.dead_times), 19)
+        self.assertTrue(0 < shots.dead_time_fraction < 1)
+        self.assertGreater(shots.captures_per_second, 10)
+        self.assertEqual(scope.instrument.instrument.commands.count(':SING'), 20)
+        # a second run fills the same buffers
+        again = scope.acquire_single_shots(20, channels=(1, 2), out=shots.codes)
+        self.assertIs(again.codes[1], shots.codes[1])
+
+    def test_single_shot_timeout(self):
+        scope = RigolDS1054z('SIM::DS1054Z?trigger_delay=10')
+        with self.assertRaises(InstrumentTimeout):
+            scope.acquire_single_shots(2, timeout=0.05)
+
+    def test_stale_stop_is_not_a_capture(self):
+        fake = ArmingScope(np.arange(100))
+        scope = make_scope(fake)
+        shots = scope.acquire_single_shots(3, timeout=1.0)
+        self.assertEqual(len(shots), 3)
+        # every capture waited for the scope to arm and then to stop again
+        self.assertEqual(fake.waits, 3)
+
+
+class TestBlockCodec(unittest.TestCase):
+
+    def test_header_length_follows_the_payload(self):
+        self.assertEqual(block_header(7), b'#17')
+        self.assertEqual(block_header(1200), b'#41200')
+        self.assertEqual(block_span('#15abcde,\n'), (3, 8))
+        data = b'#9000000004' + b'\x00\x01\x02\x03\n'
+        payload = block_payload(data)
+        self.assertIs(payload.obj, data)
+        self.assertEqual(payload.tobytes(), b'\x00\x01\x02\x03')
+        for broken in (b'41200', b'#0abc\n', b'#41200abc'):
+            with self.assertRaises(ValueError):
+                block_span(broken)
+
+    def test_blocks_are_read_into_the_given_buffer(self):
+        fake = FakeScope(np.arange(100) % 256)
+        scope = make_scope(fake)
+        codes = np.zeros(150, dtype=np.uint8)
+        for start, block in scope._iter_waveform_blocks(100, codes[50:]):
+            self.assertIsInstance(block, memoryview)
+        np.testing.assert_array_equal(codes[50:], np.arange(100))
+        fake.write(':WAV:DATA?')
+        with self.assertRaises(ValueError):
+            scope.read_block(np.zeros(10, dtype=np.uint8))
+
+    def test_outgoing_block(self):
+        sent = []
+        fake = FakeScope(np.zeros(10))
+        fake.write_raw = sent.append
+        scope = make_scope(fake)
+        scope.write_block(':SYST:SET ', np.arange(3, dtype='<u2'))
+        self.assertEqual(sent, [b':SYST:SET #16\x00\x00\x01\x00\x02\x00\n'])
+
+
+class TestGetMeasurements(unittest.TestCase):
+
+    def test_all_items_are_batched_per_transaction(self):
+        fake = FakeScope(np.zeros(10))
+        scope = make_scope(fake)
+
+        results = scope.get_measurements(channels=(1, 2, 3, 4, (1, 2)))
+
+        queries = [command for command in fake.commands if command.startswith(':MEAS:ITEM?')]
+        count = 4 * len(RigolDS1054z.single_measurement_list) + len(RigolDS1054z.double_measurement_list)
+        self.assertEqual(len(queries), -(-count // scope.max_compound_queries))
+        self.assertLessEqual(max(len(query) + 1 for query in queries), scope.input_buffer_size)
+        self.assertEqual(len(results[1]), len(RigolDS1054z.single_measurement_list))
+        self.assertEqual(results[4]['max_voltage'], 1e-3)
+        self.assertEqual(results[3]['positive_edges_number'], 0)
+        self.assertEqual(results[(1, 2)]['rising_phase_ratio'], 2e-3)
+        self.assertEqual(results[(1, 2)]['rising_delay_time'], '2.0e-03')
+        self.assertNotIn('rising_phase_ratio', results[1])
+
+    def test_missing_replies_are_reported(self):
+        fake = FakeScope(np.zeros(10))
+        fake.write = lambda command: setattr(fake, 'pending', b'1.0\n')
+        scope = make_scope(fake)
+        with self.assertRaises(ValueError):
+            scope.get_measurements(channels=(1,), items=[RigolDS1054z.max_voltage, RigolDS1054z.min_voltage])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the pooled instrument sessions."""
+
+
+import threading
+import unittest
+
+from electronics_lab.drivers.driver import Driver
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import SessionPool, WriteBatch, pool
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X
+
+
+class FakeConnection(object):
+
+    def __init__(self, key, log):
+        self.key = key
+        self.log = log
+        self.timeout = 2000
+        self.dropped = False
+        self.closed = False
+
+    def query(self, command):
+        if self.dropped:
+            raise ConnectionResetError('link dropped')
+        self.log.append(command)
+        return 'reply to ' + command
+
+    def read_raw(self):
+        if self.dropped:
+            raise ConnectionResetError('link dropped')
+        return b'reply\n'
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpener(object):
+
+    def __init__(self):
+        self.connections = []
+        self.log = []
+
+    def __call__(self, key):
+        connection = FakeConnection(key, self.log)
+        self.connections.append(connection)
+        return connection
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SessionPool()
+        self.opener = FakeOpener()
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_sessions_are_reused_by_resource_string(self):
+        first = self.pool.acquire('USB0::1::INSTR', self.opener)
+        self.pool.release(first)
+        second = self.pool.acquire('USB0::1::INSTR', self.opener)
+        other = self.pool.acquire('USB0::2::INSTR', self.opener)
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(len(self.opener.connections), 2)
+
+    def test_dropped_link_reconnects_and_keeps_settings(self):
+        session = self.pool.acquire('TCPIP::10.0.0.2::INSTR', self.opener)
+        session.timeout = 5000
+        self.opener.connections[0].dropped = True
+
+        self.assertEqual(session.query('*IDN?'), 'reply to *IDN?')
+        self.assertEqual(len(self.opener.connections), 2)
+        self.assertTrue(self.opener.connections[0].closed)
+        self.assertEqual(self.opener.connections[1].timeout, 5000)
+
+    def test_reads_are_not_retried(self):
+        session = self.pool.acquire('USB0::1::INSTR', self.opener)
+        self.opener.connections[0].dropped = True
+        # the reply was pending on the dropped link, a read on a new one would only time out
+        with self.assertRaises(ConnectionResetError):
+            session.read_raw()
+        self.assertEqual(len(self.opener.connections), 1)
+        self.assertEqual(session.query('*IDN?'), 'reply to *IDN?')
+        self.assertEqual(len(self.opener.connections), 2)
+
+    def test_other_errors_are_not_retried(self):
+        session = self.pool.acquire('USB0::1::INSTR', self.opener)
+        self.opener.connections[0].query = lambda command: int('not a number')
+        with self.assertRaises(ValueError):
+            session.query('*IDN?')
+        self.assertEqual(len(self.opener.connections), 1)
+
+    def test_health_check_reconnects_dead_sessions(self):
+        self.pool.acquire('USB0::1::INSTR', self.opener)
+        self.pool.acquire('USB0::2::INSTR', self.opener)
+        self.opener.connections[1].dropped = True
+        self.assertEqual(self.pool.health_check(), ['USB0::2::INSTR'])
+        self.assertEqual(len(self.opener.connections), 3)
+
+    def test_close_idle_keeps_sessions_in_use(self):
+        used = self.pool.acquire('USB0::1::INSTR', self.opener)
+        idle = self.pool.acquire('USB0::2::INSTR', self.opener)
+        self.pool.release(idle)
+        self.assertEqual(self.pool.close_idle(), ['USB0::2::INSTR'])
+        self.assertTrue(self.opener.connections[1].closed)
+        self.assertFalse(self.opener.connections[0].closed)
+        self.assertIs(self.pool.acquire('USB0::1::INSTR', self.opener), used)
+
+
+class TestDriverSession(unittest.TestCase):
+
+    def test_driver_context_manager_releases_the_session(self):
+        opener = FakeOpener()
+        session = pool.acquire('FAKE::1', opener)
+        pool.release(session)
+        with Driver('FAKE::1') as driver:
+            self.assertIs(driver.instrument, session)
+            self.assertEqual(session.users, 1)
+        self.assertEqual(session.users, 0)
+        pool.close_idle()
+
+
+class TestWriteBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.scope = RigolDS1054z('SIM::DS1054Z')
+        self.sim = self.scope.instrument.instrument
+        self.messages = []
+        write = self.sim.write
+
+        def counting_write(message):
+            self.messages.append(message)
+            return write(message)
+        self.sim.write = counting_write
+
+    def tearDown(self):
+        pool.close_all()
+
+    def test_messages_are_joined_within_the_limit(self):
+        batch = WriteBatch(max_length=30)
+        for command in ('CH1:VOLT 5', ':CHAN1:SCAL 1', '*CLS', ':TIM:MAIN:SCAL 0.001'):
+            batch.add(command)
+        self.assertEqual(batch.messages(), [':CH1:VOLT 5;:CHAN1:SCAL 1;*CLS', ':TIM:MAIN:SCAL 0.001'])
+
+    def test_setup_helpers_send_one_message(self):
+        self.scope.setup_i2c_decode(decode_channel=1)
+        self.assertEqual(len(self.messages), 1)
+        self.assertEqual(self.sim.state['DEC1:IIC:ADDR'], 'RW')
+
+    def test_messages_fit_the_scope_input_buffer(self):
+        with self.scope.batch(opc=True):
+            for channel in (1, 2, 3, 4):
+                self.scope.setup_channel(channel=channel, volts_per_div=0.2)
+            self.scope.setup_i2c_decode(decode_channel=1)
+        self.assertGreater(len(self.messages), 1)
+        self.assertLessEqual(max(len(message) + 1 for message in self.messages), self.scope.input_buffer_size)
+
+    def test_queries_flush_first(self):
+        with self.scope.batch(opc=True):
+            self.scope.setup_channel(channel=2, volts_per_div=0.2)
+            self.scope.setup_timebase(time_per_div='5us', delay='0us')
+            self.assertEqual(self.messages, [])
+            self.assertEqual(self.scope.query(':CHAN2:SCAL?'), '0.2')
+            self.scope.setup_trigger(channel=2)
+        self.assertEqual(len(self.messages), 3)
+        self.assertTrue(self.messages[-1].endswith(';*OPC?'))
+        self.assertEqual(self.sim.read_raw(), b'')
+
+    def test_other_threads_wait_for_the_batch(self):
+        with self.scope.batch():
+            self.scope.setup_channel(channel=3)
+            thread = threading.Thread(target=self.scope.setup_channel, kwargs={'channel': 4})
+            thread.start()
+            thread.join(0.05)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(len(self.messages), 2)
+        self.assertNotIn('CHAN4', self.messages[0])
+
+    def test_failed_batch_is_discarded(self):
+        with self.assertRaises(RuntimeError):
+            with self.scope.batch():
+                self.scope.setup_mem_depth(6e3)
+                raise RuntimeError('abort')
+        self.assertEqual(self.messages, [])
+        self.assertEqual(len(self.scope.cache), 0)
+
+    def test_supply_settings(self):
+        supply = SiglentSPD3303X('SIM::SPD3303X')
+        with supply.batch():
+            supply.set_param(1, SiglentSPD3303X.voltage, 12)
+            supply.set_param(1, SiglentSPD3303X.current, 0.1)
+            supply.set_param(1, SiglentSPD3303X.out, 'ON')
+        self.assertEqual(supply.get_measurement(1, SiglentSPD3303X.current).value, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `SiglentSDG1032X` driver."""
+
+
+import unittest
+
+import numpy as np
+
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers import siglentsdg1032x
+from electronics_lab.drivers.siglentsdg1032x import SiglentSDG1032X, arb_codes, parse_parameters, strip_unit
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_parameters_and_units(self):
+        reply = 'C1:BSWV WVTP,SINE,FRQ,1000HZ,AMP,4V,OFST,-0.5V\n'
+        self.assertEqual(parse_parameters(reply), {'WVTP': 'SINE', 'FRQ': '1000HZ', 'AMP': '4V', 'OFST': '-0.5V'})
+        self.assertEqual(strip_unit('1.5e3HZ'), '1.5e3')
+        self.assertEqual(strip_unit('SINE'), 'SINE')
+        self.assertEqual(siglentsdg1032x.parse_output('C1:OUTP OFF,LOAD,50,PLRT,NOR\n'),
+                         ('OFF', {'LOAD': '50', 'PLRT': 'NOR'}))
+
+    def test_arb_codes(self):
+        codes = arb_codes([-1.0, 0.0, 0.5, 2.0])
+        self.assertEqual(codes.dtype, np.dtype('<i2'))
+        self.assertEqual(codes.tolist(), [-32767, 0, 16384, 32767])
+        with self.assertRaises(ValueError):
+            arb_codes(np.array([40000]))
+
+
+class TestSiglentSDG1032X(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = SiglentSDG1032X('SIM::SDG1032X')
+        self.sim = self.generator.instrument.instrument
+
+    def tearDown(self):
+        pool.close_all()
+
+    def test_basic_wave(self):
+        self.generator.setup_basic_wave(2, 'square', frequency=2e3, amplitude=3.3, offset=1.65)
+        self.generator.set_output(2, 1)
+        self.assertEqual(self.generator.get_measurement(2, SiglentSDG1032X.frequency).value, 2e3)
+        self.assertEqual(self.generator.get_measurement(2, SiglentSDG1032X.waveform).value, 'SQUARE')
+        self.assertEqual(self.generator.get_measurement(2, SiglentSDG1032X.out).value, 1)
+        self.assertEqual(self.generator.basic_wave(2)['OFST'], '1.65')
+        self.sim.commands = []
+        self.generator.setup_basic_wave(2, 'SQUARE', frequency=2000, amplitude=3.3, offset=1.65)
+        self.assertEqual(self.sim.commands, [])
+        with self.assertRaises(ValueError):
+            self.generator.set_waveform(1, 'TRIANGLE')
+
+    def test_output_load(self):
+        self.generator.set_output(1, 'ON')
+        self.generator.set_load(1, 50)
+        self.assertEqual(self.sim.outputs['1'], 'ON')
+        self.assertEqual(self.generator.read_setting('C1:OUTP'), 'ON')
+        self.assertEqual(self.generator.read_setting('C1:OUTP LOAD'), '50')
+        self.assertEqual(self.generator.resync(), [])
+        self.sim.output_settings['1']['LOAD'] = 'HZ'
+        self.assertEqual(self.generator.resync(), ['C1:OUTP LOAD'])
+
+    def test_arb_upload_is_binary_and_cached(self):
+        samples = (np.arange(4096) * 16 - 32768).astype(np.int16)
+        name = self.generator.upload_arb(1, samples, frequency=10e3, amplitude=2.0)
+        np.testing.assert_array_equal(self.sim.arbs[name], samples)
+        self.assertEqual(self.sim.selected_arbs['1'], name)
+        self.assertEqual(self.generator.basic_wave(1)['FRQ'], '10000.0')
+
+        self.sim.commands = []
+        self.assertEqual(self.generator.upload_arb(2, samples.copy(), frequency=10e3, amplitude=2.0), name)
+        self.assertNotIn('C2:WVDT', self.sim.commands)
+        self.assertEqual(self.sim.selected_arbs['2'], name)
+        self.assertEqual(self.generator.resync(), [])
+
+        self.generator.upload_arb(1, samples[::-1])
+        self.assertEqual(len(self.sim.arbs), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
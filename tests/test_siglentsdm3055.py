@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `SiglentSDM3055` driver."""
+
+
+import unittest
+
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentsdm3055 import SiglentSDM3055
+
+
+class FakeMeter(object):
+
+    def __init__(self):
+        self.commands = []
+        self.sample_count = 1
+        self.memory = []
+        self.timeout = 2000
+        self.timeouts = []
+
+    def write(self, command):
+        self.commands.append(command)
+        if command.startswith('SAMP:COUN '):
+            self.sample_count = int(command.split()[1])
+        elif command == 'INIT':
+            self.memory = [0.5 + n * 1e-3 for n in range(self.sample_count)]
+
+    def query(self, command):
+        self.commands.append(command)
+        if command == 'READ?':
+            self.timeouts.append(self.timeout)
+            return ','.join('{:+.8E}'.format(1.25 + n) for n in range(self.sample_count)) + '\n'
+        if command.startswith('R?'):
+            count = int(command.split()[1]) if ' ' in command else len(self.memory)
+            readings, self.memory = self.memory[:count], self.memory[count:]
+            payload = ','.join('{:+.8E}'.format(reading) for reading in readings)
+            length = str(len(payload))
+            return '#' + str(len(length)) + length + payload + '\n'
+        return ''
+
+
+def make_meter():
+    meter = SiglentSDM3055.__new__(SiglentSDM3055)
+    meter.instrument = FakeMeter()
+    meter.debug = False
+    return meter
+
+
+class TestGetMeasurement(unittest.TestCase):
+
+    def test_reading_from_template(self):
+        meter = make_meter()
+        meter.instrument.query = lambda command: meter.instrument.commands.append(command) or '-1.5E-03\n'
+
+        reading = meter.get_measurement(SiglentSDM3055.ac_current)
+
+        self.assertEqual(meter.instrument.commands, ['MEAS:CURR:AC?'])
+        self.assertEqual(reading.value, -1.5e-3)
+        self.assertEqual(reading.unit, 'Amperes')
+        self.assertEqual(reading.name, 'ac_current')
+        self.assertEqual(float(reading), -1.5e-3)
+
+
+class TestBufferedSampling(unittest.TestCase):
+
+    def test_configure_once_then_read(self):
+        meter = make_meter()
+        meter.configure_sampling(SiglentSDM3055.dc_current, sample_count=500, nplc=1)
+
+        timestamps, values = meter.read_samples()
+
+        self.assertEqual(meter.instrument.commands[:4],
+                         ['CONF:CURR:DC AUTO', 'CURR:DC:NPLC 1', 'TRIG:SOUR IMM', 'SAMP:COUN 500'])
+        self.assertEqual(len(values), 500)
+        self.assertEqual(values[2], 3.25)
+        self.assertTrue((timestamps[1:] >= timestamps[:-1]).all())
+
+    def test_read_timeout_covers_the_sampling_time(self):
+        meter = make_meter()
+        meter.configure_sampling(SiglentSDM3055.dc_voltage, sample_count=1000, nplc=0.3)
+        meter.read_samples()
+        # 1000 readings of 0.3 power line cycles at 50 Hz take 6 s, twice that is added
+        self.assertEqual(meter.instrument.timeouts, [2000 + 12000])
+        self.assertEqual(meter.instrument.timeout, 2000)
+        meter.configure_sampling(SiglentSDM3055.frequency, sample_count=10)
+        meter.read_samples()
+        self.assertEqual(meter.instrument.timeouts[-1], 2000 + 2000)
+
+    def test_bus_trigger(self):
+        meter = SiglentSDM3055('SIM::SDM3055')
+        self.addCleanup(pool.close_all)
+        meter.configure_sampling(SiglentSDM3055.dc_voltage, sample_count=20, trigger_source='BUS')
+        meter.start_sampling()
+        self.assertEqual(len(meter.fetch_samples()[1]), 0)
+        meter.trigger()
+        self.assertEqual(len(meter.fetch_samples()[1]), 20)
+
+    def test_fetch_drains_reading_memory(self):
+        meter = make_meter()
+        meter.configure_sampling(SiglentSDM3055.frequency, sample_count=300)
+        self.assertEqual(meter.instrument.commands[0], 'CONF:FREQ')
+
+        meter.start_sampling()
+        _, first = meter.fetch_samples(max_readings=200)
+        timestamps, rest = meter.fetch_samples()
+        _, empty = meter.fetch_samples()
+
+        self.assertEqual(len(first), 200)
+        self.assertEqual(len(rest), 100)
+        self.assertEqual(len(timestamps), 100)
+        self.assertAlmostEqual(rest[0], 0.7)
+        self.assertEqual(len(empty), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the `SiglentSPD3303X` driver."""
+
+
+import threading
+import unittest
+
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X, output_state
+
+
+class FakeSupply(object):
+
+    def __init__(self):
+        self.commands = []
+        self.status = 0x10
+
+    def ask(self, command):
+        self.commands.append(command)
+        if command == 'SYST:STAT?':
+            return '0x{:X}'.format(self.status)
+        if command.startswith('MEAS:VOLT? CH'):
+            return '{:.3f}'.format(3.3 * int(command[-1]))
+        if command.startswith('MEAS:CURR? CH'):
+            return '{:.3f}'.format(0.25 * int(command[-1]))
+        return ''
+
+    def write(self, command):
+        self.commands.append(command)
+
+
+def make_supply():
+    supply = SiglentSPD3303X.__new__(SiglentSPD3303X)
+    supply.instrument = FakeSupply()
+    supply.debug = False
+    return supply
+
+
+class TestOutputState(unittest.TestCase):
+
+    def test_status_bits(self):
+        self.assertEqual(output_state(0x10, 1), 1)
+        self.assertEqual(output_state(0x10, 2), 0)
+        self.assertEqual(output_state(0x20, 2), 1)
+        self.assertEqual(output_state(0x08, 2), 0)
+
+
+class TestGetMeasurement(unittest.TestCase):
+
+    def test_readings(self):
+        supply = make_supply()
+        self.assertEqual(supply.get_measurement(2, SiglentSPD3303X.current).value, 0.5)
+        out = supply.get_measurement(1, SiglentSPD3303X.out)
+        self.assertEqual((out.value, out.channel), (1, 1))
+        self.assertEqual(supply.format_reading(out), 'Channel 1 is ON')
+        self.assertEqual(supply.instrument.commands, ['MEAS:CURR? CH2', 'SYST:STAT?'])
+
+    def test_set_param(self):
+        supply = make_supply()
+        supply.set_param(2, SiglentSPD3303X.voltage, 5.0)
+        supply.set_param(2, SiglentSPD3303X.voltage, 5.0)
+        supply.set_param(1, SiglentSPD3303X.out, 'ON')
+        supply.set_param(1, SiglentSPD3303X.out, 'maybe')
+        # an output tripped by OCP since the last write is switched on again
+        supply.set_param(1, SiglentSPD3303X.out, 'ON')
+        self.assertEqual(supply.instrument.commands, ['CH2:VOLT 5.0', 'OUTP CH1,ON', 'OUTP CH1,ON'])
+        self.assertNotIn('OUTP CH1', supply.cache.values)
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_one_status_query_per_cycle(self):
+        supply = make_supply()
+        telemetry = supply.telemetry(rate=100.0, capacity=4)
+        for _ in range(6):
+            telemetry.poll_once()
+
+        self.assertEqual(supply.instrument.commands.count('SYST:STAT?'), 6)
+        self.assertEqual(len(supply.instrument.commands), 6 * 5)
+        samples = telemetry.snapshot()
+        self.assertEqual(len(samples), 4)
+        self.assertTrue((samples['time'][1:] >= samples['time'][:-1]).all())
+        self.assertAlmostEqual(samples['ch2_power'][0], 6.6 * 0.5)
+        self.assertEqual(list(samples['ch1_output']), [1, 1, 1, 1])
+        self.assertEqual(list(samples['ch2_output']), [0, 0, 0, 0])
+        self.assertEqual(len(telemetry.samples_since(5)[0]), 1)
+
+    def test_background_polling(self):
+        telemetry = make_supply().telemetry(rate=200.0, capacity=1000)
+        received = []
+
+        def consume():
+            for sample in telemetry:
+                received.append(sample)
+                if len(received) == 10:
+                    break
+
+        consumer = threading.Thread(target=consume)
+        telemetry.start()
+        consumer.start()
+        consumer.join(5)
+        telemetry.stop()
+
+        self.assertEqual(len(received), 10)
+        self.assertGreaterEqual(telemetry.count, 10)
+        self.assertGreater(telemetry.achieved_rate, 50)
+        self.assertGreaterEqual(telemetry.missed_deadlines, 0)
+
+    def test_failed_poll_ends_iteration(self):
+        supply = make_supply()
+        telemetry = supply.telemetry(rate=200.0)
+        ask = supply.instrument.ask
+
+        def drop_link(command):
+            if telemetry.count == 3:
+                raise ConnectionResetError('link dropped')
+            return ask(command)
+        supply.instrument.ask = drop_link
+        received = []
+        telemetry.start()
+        with self.assertRaises(ConnectionResetError):
+            for sample in telemetry:
+                received.append(sample)
+        telemetry.stop()
+        self.assertFalse(telemetry.running)
+        self.assertIsInstance(telemetry.error, ConnectionResetError)
+        self.assertLessEqual(len(received), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
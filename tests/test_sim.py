@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs the drivers against the simulated instruments."""
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z, load_waveform_file
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentsdm3055 import SiglentSDM3055
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X
+from electronics_lab.drivers.sim import SimRigolDS1054z, UnknownCommand, open_resource
+
+
+class SimTestCase(unittest.TestCase):
+    """Every test gets fresh simulated instruments"""
+
+    def tearDown(self):
+        pool.close_all()
+
+
+class TestSimRigolDS1054z(SimTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scope = RigolDS1054z('SIM::DS1054Z?memory_depth=30000')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SimTestCase.tearDown(self)
+
+    def test_identity_and_setup(self):
+        self.scope.print_info()
+        self.scope.setup_channel(channel=2, on=1, offset_divs=1.0, volts_per_div=0.5, probe=1.0)
+        self.scope.setup_timebase(time_per_div='5us', delay='0us')
+        self.scope.setup_trigger(channel=2, slope_pos=0, level='500mv')
+        self.scope.setup_i2c_decode(decode_channel=1)
+        self.scope.setup_mem_depth(6e3)
+        self.assertEqual(self.scope.query(':CHAN2:SCAL?'), '0.5')
+        self.assertEqual(self.scope.query(':TRIG:EDG:SLOP?'), 'NEG')
+        self.assertEqual(self.scope.query(':ACQ:MDEP?'), '6000')
+
+    def test_measurements(self):
+        self.assertAlmostEqual(self.scope.get_measurement(1, RigolDS1054z.frequency).value, 1e3)
+        self.assertAlmostEqual(self.scope.get_measurement(2, RigolDS1054z.max_voltage).value, 3.3)
+        results = self.scope.get_measurements(channels=(1, 2, 3, 4, (1, 3)))
+        self.assertEqual(len(results[4]), len(RigolDS1054z.single_measurement_list))
+        self.assertAlmostEqual(results[(1, 3)]['rising_phase_ratio'], 45.0)
+
+    def test_trigger_cycle(self):
+        self.scope.single_trigger()
+        self.scope.wait_for_trigger_status(('STOP',), timeout=1.0)
+        self.scope.run_trigger()
+        self.assertEqual(self.scope.trigger_status(), 'AUTO')
+
+    def test_deep_memory_waveform(self):
+        self.scope.max_waveform_chunk = 7000
+        time_axis, volts = self.scope.read_waveform(channel=1)
+        self.assertEqual(len(volts), 30000)
+        np.testing.assert_allclose(volts, np.sin(2 * np.pi * 1e3 * time_axis), atol=0.04)
+        filename = os.path.join(self.directory, 'capture.npy')
+        self.scope.stream_waveform_to_file(channel=1, filename=filename)
+        codes, header = load_waveform_file(filename)
+        self.assertEqual(header['points'], 30000)
+
+    def test_files(self):
+        screen = os.path.join(self.directory, 'screen.png')
+        self.scope.write_screen_capture(screen)
+        with open(screen, 'rb') as fid:
+            self.assertEqual(fid.read(8), b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(os.path.getsize(screen), 60000)
+        csv = os.path.join(self.directory, 'waveform.csv')
+        self.scope.write_waveform_data(channel=2, filename=csv)
+        self.assertEqual(len(np.loadtxt(csv)), 1200)
+        settings = os.path.join(self.directory, 'settings.stp')
+        self.scope.write_scope_settings_to_file(settings)
+        self.scope.setup_timebase(time_per_div='5us', delay='0us')
+        self.scope.restore_scope_settings_from_file(settings)
+        self.assertEqual(float(self.scope.query(':TIM:MAIN:SCAL?')), 1e-3)
+
+    def test_unknown_query(self):
+        with self.assertRaises(UnknownCommand):
+            self.scope.query(':NOSUCH?')
+
+
+class TestSimSiglentSDM3055(SimTestCase):
+
+    def test_measurements_and_sampling(self):
+        meter = SiglentSDM3055('SIM::SDM3055')
+        self.assertAlmostEqual(meter.get_measurement(SiglentSDM3055.dc_voltage).value, 5.0, places=2)
+        self.assertAlmostEqual(meter.get_measurement(SiglentSDM3055.ac_current).value, 0.05, places=3)
+        meter.configure_sampling(SiglentSDM3055.twow_resistance, sample_count=250)
+        _, values = meter.read_samples()
+        self.assertEqual(len(values), 250)
+        self.assertAlmostEqual(values.mean(), 1e3, places=0)
+        meter.start_sampling()
+        _, values = meter.fetch_samples()
+        self.assertEqual(len(values), 250)
+
+
+class TestSimSiglentSPD3303X(SimTestCase):
+
+    def test_outputs(self):
+        supply = SiglentSPD3303X('SIM::SPD3303X?load=5')
+        supply.print_info()
+        supply.set_param(1, SiglentSPD3303X.voltage, 5.0)
+        supply.set_param(1, SiglentSPD3303X.current, 0.5)
+        supply.set_param(1, SiglentSPD3303X.out, 'ON')
+        self.assertEqual(supply.get_measurement(1, SiglentSPD3303X.out).value, 1)
+        self.assertEqual(supply.get_measurement(2, SiglentSPD3303X.out).value, 0)
+        self.assertEqual(supply.get_measurement(1, SiglentSPD3303X.current).value, 0.5)
+        self.assertEqual(supply.get_measurement(1, SiglentSPD3303X.voltage).value, 2.5)
+        telemetry = supply.telemetry()
+        telemetry.poll_once()
+        self.assertEqual(telemetry.snapshot()['ch1_power'][0], 1.25)
+
+
+class TestSimTransport(unittest.TestCase):
+
+    def test_latency_and_bandwidth(self):
+        scope = open_resource('SIM::DS1054Z?latency=0.01&bandwidth=1e6&screen_bytes=50000')
+        self.assertIsInstance(scope, SimRigolDS1054z)
+        started = time.monotonic()
+        for _ in range(5):
+            scope.query('*OPC?')
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        started = time.monotonic()
+        scope.write(':DISP:DATA? ON,OFF,PNG')
+        scope.read_raw()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the instrument state cache."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentspd3303x import SiglentSPD3303X
+from electronics_lab.drivers.state import StateCache, normalize_value
+
+
+class TestStateCache(unittest.TestCase):
+
+    def test_values_are_normalized(self):
+        self.assertEqual(normalize_value('1.000000e+00'), normalize_value(1))
+        self.assertEqual(normalize_value(' on'), normalize_value(1))
+        self.assertEqual(normalize_value('chan1'), 'CHAN1')
+        cache = StateCache()
+        cache.set(':chan1:scal', '0.5')
+        self.assertTrue(cache.matches(':CHAN1:SCAL', 0.5))
+        self.assertIn('CHAN1:SCAL', cache)
+        cache.invalidate(':CHAN1:SCAL')
+        self.assertEqual(len(cache), 0)
+
+
+class TestRigolStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.scope = RigolDS1054z('SIM::DS1054Z')
+        self.sim = self.scope.instrument.instrument
+
+    def tearDown(self):
+        pool.close_all()
+
+    def sent(self):
+        commands, self.sim.commands = self.sim.commands, []
+        return commands
+
+    def test_repeated_setup_is_skipped(self):
+        self.scope.setup_channel(channel=1, volts_per_div=0.5, probe=1.0)
+        self.scope.setup_trigger(channel=1, level='100mv')
+        self.assertEqual(len(self.sent()), 7)
+
+        self.scope.setup_channel(channel=1, volts_per_div=0.5, probe=1.0)
+        self.scope.setup_trigger(channel=1, level='100mv')
+        self.scope.setup_channel(channel=1, volts_per_div=1.0, probe=1.0)
+        self.assertEqual(self.sent(), [':CHAN1:SCAL 1.0'])
+        self.assertEqual(self.scope.cache.skipped, 10)
+
+    def test_configure_sends_the_difference(self):
+        self.scope.configure({':TIM:MAIN:SCAL': 1e-3, ':ACQ:MDEP': 12000})
+        self.sent()
+        sent = self.scope.configure({':TIM:MAIN:SCAL': '1.0e-03', ':ACQ:MDEP': 6000, ':CHAN2:DISP': 'OFF'})
+        self.assertEqual(sorted(sent), [':ACQ:MDEP', ':CHAN2:DISP'])
+        self.assertEqual(sorted(self.sent()), [':ACQ:MDEP 6000', ':CHAN2:DISP OFF'])
+
+    def test_resync_after_front_panel_change(self):
+        self.scope.setup_timebase(time_per_div='5us', delay='0us')
+        self.assertEqual(self.scope.resync(), [])
+        self.sent()
+        # nothing changed since the full resync, one :SYST:SET? transfer confirms it
+        self.assertEqual(self.scope.resync(), [])
+        self.assertEqual(self.sent(), [':SYST:SET?'])
+
+        self.sim.state['TIM:MAIN:SCAL'] = '2e-06'
+        self.assertEqual(self.scope.resync(), ['TIM:MAIN:SCAL'])
+        self.scope.setup_timebase(time_per_div='5us', delay='0us')
+        self.assertTrue(self.sent()[-1].startswith(':TIM:MAIN:SCAL '))
+
+    def test_saving_settings_does_not_trust_a_stale_cache(self):
+        self.scope.setup_channel(channel=1, volts_per_div=1.0, probe=1.0)
+        self.sim.state['CHAN1:SCAL'] = '2.0'
+        directory = tempfile.mkdtemp()
+        try:
+            self.scope.write_scope_settings_to_file(os.path.join(directory, 'settings.stp'))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(self.scope.resync(), ['CHAN1:SCAL'])
+        self.sent()
+        self.scope.setup_channel(channel=1, volts_per_div=1.0, probe=1.0)
+        self.assertEqual(self.sent(), [':CHAN1:SCAL 1.0'])
+
+    def test_reset_clears_the_cache(self):
+        self.scope.setup_mem_depth(6e3)
+        self.scope.reset()
+        self.assertEqual(len(self.scope.cache), 0)
+        self.scope.setup_mem_depth(6e3)
+        self.assertIn(':ACQ:MDEP 6000', self.sent())
+
+
+class TestSupplyStateCache(unittest.TestCase):
+
+    def tearDown(self):
+        pool.close_all()
+
+    def test_set_param_and_resync(self):
+        supply = SiglentSPD3303X('SIM::SPD3303X')
+        sim = supply.instrument.instrument
+        for _ in range(3):
+            supply.set_param(1, SiglentSPD3303X.voltage, 5)
+            supply.set_param(1, SiglentSPD3303X.out, 1)
+        # the output state is sent every time, OVP/OCP can switch it off behind the cache
+        self.assertEqual(sim.commands, ['CH1:VOLT 5'] + ['OUTP CH1,ON'] * 3)
+
+        sim.outputs[1] = False
+        sim.state['CH1:VOLT'] = '12'
+        self.assertEqual(supply.resync(), ['CH1:VOLT'])
+        supply.set_param(1, SiglentSPD3303X.out, 'ON')
+        self.assertEqual(sim.commands[-1], 'OUTP CH1,ON')
+        self.assertTrue(sim.outputs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
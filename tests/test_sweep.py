@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the frequency response sweep."""
+
+
+import contextlib
+import io
+import threading
+import unittest
+
+import numpy as np
+
+from electronics_lab.drivers.rigolds1054z import RigolDS1054z
+from electronics_lab.drivers.session import pool
+from electronics_lab.drivers.siglentsdg1032x import SiglentSDG1032X, strip_unit
+from electronics_lab.drivers.sim import SimSiglentSDG1032X
+from electronics_lab.sweep import FrequencySweep, frequency_plan, timebase_for
+
+
+class LowPassBench(SimSiglentSDG1032X):
+    """Generator whose channel 1 drives an RC low pass between scope channels 1 and 2
+
+    The first ignored_updates frequency writes do not reach the low pass.
+    """
+
+    def __init__(self, scope, corner=1e3, ignored_updates=0):
+        self.scope = scope
+        self.corner = corner
+        self.ignored_updates = ignored_updates
+        SimSiglentSDG1032X.__init__(self)
+
+    def basic_wave(self, arguments, channel):
+        SimSiglentSDG1032X.basic_wave(self, arguments, channel)
+        if self.ignored_updates and 'FRQ' in arguments:
+            self.ignored_updates -= 1
+            return
+        wave = self.waves['1']
+        frequency, amplitude = float(strip_unit(wave['FRQ'])), float(strip_unit(wave['AMP'])) / 2
+        ratio = frequency / self.corner
+        self.scope.signals[1] = ('sine', frequency, amplitude, 0.0, 0.0)
+        self.scope.signals[2] = ('sine', frequency, amplitude / np.sqrt(1 + ratio ** 2), 0.0,
+                                 -np.degrees(np.arctan(ratio)))
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_plans(self):
+        np.testing.assert_allclose(frequency_plan(10, 1e4, 4), [10, 100, 1e3, 1e4])
+        np.testing.assert_allclose(frequency_plan(100, 400, 4, 'linear'), [100, 200, 300, 400])
+        with self.assertRaises(ValueError):
+            frequency_plan(1, 2, 3, 'octave')
+
+    def test_timebase_steps(self):
+        self.assertEqual(timebase_for(1e3, cycles=3), 5e-4)
+        self.assertEqual(timebase_for(1e3, cycles=12), 1e-3)
+        self.assertEqual(timebase_for(10e6, cycles=2), 2e-8)
+
+
+class TestFrequencySweep(unittest.TestCase):
+
+    def setUp(self):
+        self.scope = RigolDS1054z('SIM::DS1054Z')
+        self.generator = SiglentSDG1032X('SIM::SDG1032X')
+
+    def tearDown(self):
+        pool.close_all()
+
+    def sweep(self, frequencies, **kwargs):
+        points = []
+        sweep = FrequencySweep(self.generator, self.scope, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = sweep.run(frequencies, on_point=points.append)
+        self.assertEqual(len(points), len(frequencies))
+        return sweep, results
+
+    def test_low_pass_response(self):
+        self.generator.instrument.instrument = LowPassBench(self.scope.instrument.instrument)
+        frequencies = frequency_plan(100, 10e3, 5)
+        sweep, results = self.sweep(frequencies, amplitude=2.0)
+
+        np.testing.assert_allclose(results['frequency'], frequencies)
+        np.testing.assert_allclose(results['input_vpp'], 2.0, rtol=0.01)
+        expected = -10 * np.log10(1 + (frequencies / 1e3) ** 2)
+        np.testing.assert_allclose(results['gain_db'], expected, atol=0.1)
+        np.testing.assert_allclose(np.abs(results['phase']), np.degrees(np.arctan(frequencies / 1e3)), atol=0.5)
+        self.assertTrue(np.all(results['acquisitions'] == 1))
+        self.assertEqual(sweep.results_since(3)[0]['frequency'].tolist(), frequencies[3:].tolist())
+        self.assertEqual(float(self.scope.query(':TIM:MAIN:SCAL?')), timebase_for(10e3))
+        # the generator worker stops with the sweep
+        names = [thread.name for thread in threading.enumerate()]
+        self.assertFalse([name for name in names if name.startswith('electronics_lab-sweep')])
+
+    def test_stale_capture_is_repeated(self):
+        # the setup's frequency is followed by its amplitude, the next frequency change is lost
+        self.generator.instrument.instrument = LowPassBench(self.scope.instrument.instrument, ignored_updates=2)
+        sweep, results = self.sweep([1e3, 2e3], settle_cycles=1.0)
+        self.assertEqual(results['acquisitions'].tolist(), [1, 2])
+        np.testing.assert_allclose(results['measured_frequency'], [1e3, 2e3])
+        self.assertGreater(sweep.settle_cycles, 1.0)
+        # only the frequency was sent again, the rest of the generator's cache survived the retry
+        self.assertIn('C1:BSWV AMP', self.generator.cache)
+        self.assertIn('C1:OUTP', self.generator.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()